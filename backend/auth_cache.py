@@ -0,0 +1,69 @@
+"""
+In-process cache for API-key authentication.
+
+The authentication dependencies consult this cache before touching the
+database, so a warm key costs no connection checkout and no round-trip. The
+user's default thread id is cached alongside, so handlers need not look it
+up. Unknown keys are cached too (for a shorter TTL) so a flood of bad keys
+cannot hammer Postgres.
+"""
+
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import settings
+from cache import TTLCache
+
+
+class CachedUser(NamedTuple):
+    id: int
+    name: str
+    api_key: str
+    # The user's default thread, resolved by the same query; None until it exists
+    thread_id: Optional[int] = None
+
+
+class AuthCache:
+    """TTL + LRU cache from API key to user, with negative caching."""
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative_hits = 0
+
+    def lookup(self, api_key: str) -> Tuple[bool, Optional[CachedUser]]:
+        """Return ``(found, user)``; ``(True, None)`` means a known-invalid key."""
+        found, user = self._cache.lookup(api_key)
+        if found and user is None:
+            self.negative_hits += 1
+        return found, user
+
+    def store(self, api_key: str, user: Optional[CachedUser]) -> None:
+        """Cache the result of a database lookup; ``None`` marks an invalid key."""
+        if user is None:
+            if self.negative_ttl > 0:
+                self._cache.set(api_key, None, ttl=self.negative_ttl)
+        else:
+            self._cache.set(api_key, user)
+
+    def invalidate(self, api_key: str) -> bool:
+        """Forget a key, e.g. after it has been rotated or revoked."""
+        return self._cache.pop(api_key)
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Forget every cached key of a user, e.g. after the user is deleted."""
+        return self._cache.pop_where(
+            lambda _key, user: user is not None and user.id == user_id
+        )
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "negative_hits": self.negative_hits}
+
+
+auth_cache = AuthCache(
+    maxsize=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl=settings.AUTH_CACHE_TTL_SECONDS,
+    negative_ttl=settings.AUTH_CACHE_NEGATIVE_TTL_SECONDS,
+)
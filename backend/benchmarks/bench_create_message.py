@@ -0,0 +1,135 @@
+"""
+Benchmark of the POST /messages write path: database round-trips and latency.
+
+Compares the previous implementation (thread SELECT, optional thread INSERT,
+one INSERT + flush per message, COMMIT) with the path now used by
+create_message: the thread id comes from the auth cache, and one multi-row
+INSERT ... RETURNING also updates the thread's summary.
+
+Usage (from backend/, with the database running):
+    python -m benchmarks.bench_create_message --iterations 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_engine import engine
+from models import Message, Thread, User
+from queries import get_or_create_thread_id, insert_messages
+
+BENCH_USER = {"name": "Bench", "api_key": "bench_key_000"}
+
+
+class RoundTripCounter:
+    """Counts BEGIN, statements and COMMIT sent through the engine"""
+
+    def __init__(self, sync_engine):
+        self.count = 0
+        for name in ("begin", "commit", "before_cursor_execute"):
+            event.listen(sync_engine, name, self._bump)
+
+    def _bump(self, *args, **kwargs):
+        self.count += 1
+
+
+async def legacy_create_message(user_id: int, content: str, bot_content: str):
+    """The write path create_message used before the single-statement rewrite"""
+    async with AsyncSession(engine) as session:
+        thread = (
+            await session.execute(select(Thread).where(Thread.user_id == user_id, Thread.is_default))
+        ).scalars().first()
+        if thread is None:
+            thread = Thread(user_id=user_id, is_default=True)
+            session.add(thread)
+            await session.flush()
+
+        user_message = Message(thread_id=thread.id, content=content, is_from_user=True)
+        session.add(user_message)
+        await session.flush()
+
+        bot_message = Message(thread_id=thread.id, content=bot_content, is_from_user=False)
+        session.add(bot_message)
+        await session.flush()
+
+        await session.commit()
+
+
+# user id -> default thread id, standing in for the auth cache
+_thread_ids = {}
+
+
+async def single_statement_create_message(user_id: int, content: str, bot_content: str):
+    """The write path create_message uses now"""
+    async with AsyncSession(engine) as session:
+        if user_id not in _thread_ids:
+            _thread_ids[user_id] = await get_or_create_thread_id(session, user_id)
+        await insert_messages(session, _thread_ids[user_id], [
+            (content, True, datetime.utcnow()),
+            (bot_content, False, datetime.utcnow()),
+        ])
+        await session.commit()
+
+
+async def ensure_bench_user() -> int:
+    async with AsyncSession(engine) as session:
+        user_id = (
+            await session.execute(select(User.id).where(User.api_key == BENCH_USER["api_key"]))
+        ).scalar_one_or_none()
+        if user_id is None:
+            user = User(**BENCH_USER)
+            session.add(user)
+            await session.flush()
+            user_id = user.id
+            await session.commit()
+        return user_id
+
+
+async def run(implementation, user_id: int, iterations: int, counter: RoundTripCounter):
+    latencies = []
+    round_trips_before = counter.count
+    for i in range(iterations):
+        started = time.perf_counter()
+        await implementation(user_id, f"benchmark message {i}", "benchmark reply")
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    return {
+        "round_trips_per_request": (counter.count - round_trips_before) / iterations,
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    args = parser.parse_args()
+
+    counter = RoundTripCounter(engine.sync_engine)
+    user_id = await ensure_bench_user()
+
+    print(f"{'implementation':<18} {'round-trips':>11} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, implementation in (
+        ("before", legacy_create_message),
+        ("after", single_statement_create_message),
+    ):
+        await run(implementation, user_id, args.warmup, counter)
+        result = await run(implementation, user_id, args.iterations, counter)
+        print(
+            f"{name:<18} {result['round_trips_per_request']:>11.1f} {result['mean_ms']:>9.3f}"
+            f" {result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f}"
+        )
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
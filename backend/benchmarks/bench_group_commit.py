@@ -0,0 +1,116 @@
+"""
+Benchmark of concurrent message inserts: one commit per request versus group commit.
+
+``--writers`` tasks each store ``--requests`` user/bot message pairs, spread
+over ``--threads`` threads, as fast as they can. "per-request" opens a
+session, inserts and commits for every pair, as create_message does by
+default; "group" sends every pair through a GroupCommitWriter, as it does
+with MESSAGE_GROUP_COMMIT=true. Latency is from starting a request until
+its rows are committed.
+
+Usage (from backend/, with the database running):
+    python -m benchmarks.bench_group_commit --writers 64 --requests 50
+    python -m benchmarks.bench_group_commit --window-ms 5 --max-rows 1000
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from benchmarks.bench_create_message import ensure_bench_user
+from db_engine import engine
+from group_commit import GroupCommitWriter
+from models import Thread
+from queries import insert_messages, insert_thread
+
+BENCH_THREAD_TITLE = "Group commit benchmark"
+
+
+def message_rows(i: int):
+    return [
+        (f"benchmark message {i}", True, datetime.utcnow()),
+        ("benchmark reply", False, datetime.utcnow()),
+    ]
+
+
+async def per_request_commit(thread_id: int, i: int):
+    async with AsyncSession(engine) as session:
+        await insert_messages(session, thread_id, message_rows(i))
+        await session.commit()
+
+
+async def ensure_bench_threads(user_id: int, count: int) -> List[int]:
+    async with AsyncSession(engine) as session:
+        thread_ids = list((await session.execute(
+            select(Thread.id).where(Thread.user_id == user_id, Thread.title == BENCH_THREAD_TITLE).order_by(Thread.id)
+        )).scalars())
+        while len(thread_ids) < count:
+            thread_ids.append((await session.execute(insert_thread(user_id, BENCH_THREAD_TITLE))).scalar_one())
+        await session.commit()
+    return thread_ids[:count]
+
+
+async def run(store, thread_ids: List[int], writers: int, requests: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    counter = itertools.count()
+
+    async def writer(thread_id: int):
+        for _ in range(requests):
+            started = time.perf_counter()
+            await store(thread_id, next(counter))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = itertools.cycle(thread_ids)
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(next(threads)) for _ in range(writers)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rows_per_s": 2 * len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=64, help="Concurrent writers")
+    parser.add_argument("--requests", type=int, default=50, help="Message pairs stored by each writer")
+    parser.add_argument("--threads", type=int, default=16, help="Threads the writers are spread over")
+    parser.add_argument("--window-ms", type=float, default=2.0, help="GROUP_COMMIT_WINDOW_MS")
+    parser.add_argument("--max-rows", type=int, default=500, help="GROUP_COMMIT_MAX_ROWS")
+    args = parser.parse_args()
+
+    user_id = await ensure_bench_user()
+    thread_ids = await ensure_bench_threads(user_id, args.threads)
+    writer = GroupCommitWriter(engine, window=args.window_ms / 1000, max_rows=args.max_rows)
+    await writer.start()
+
+    async def group_commit(thread_id: int, i: int):
+        await writer.insert(thread_id, message_rows(i))
+
+    print(f"{'write path':<12} {'rows/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    results = {}
+    for name, store in (("per-request", per_request_commit), ("group", group_commit)):
+        await run(store, thread_ids, args.writers, 5)  # warm up the connection pool
+        results[name] = result = await run(store, thread_ids, args.writers, args.requests)
+        print(f"{name:<12} {result['rows_per_s']:>9.0f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+
+    stats = writer.stats()
+    await writer.stop()
+    print(
+        f"Group commit: {results['group']['rows_per_s'] / results['per-request']['rows_per_s']:.2f}x the rows/s,"
+        f" {stats['rows_written'] / max(stats['batches'], 1):.1f} rows per commit"
+    )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Benchmark of /messages/search against a large generated corpus.
+
+Times the ranked tsvector search used by the endpoint (GIN index, ts_rank,
+ts_headline on the returned page) against the ILIKE scan it replaces, for a
+sample of users. The ILIKE baseline is unranked and only finds the first
+word of each query, so it does strictly less work per row.
+
+Generate a corpus first, e.g. 3M messages skewed over 2,000 users:
+    python generate_data.py --users 2000 --messages 3000000 --thread-dist zipf --prefix search
+
+Usage (from backend/, with the database running):
+    python -m benchmarks.bench_search --key-prefix search --users 20 --iterations 5
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_engine import engine
+from models import Message, Thread, User
+from queries import search_messages_query
+
+QUERIES = ["refund", "payment problem", '"order update"', "password -email", "delivery or phone"]
+
+
+async def sample_users(session: AsyncSession, prefix: str, count: int, seed: int):
+    rows = (
+        await session.execute(
+            select(User.id, func.count(Message.id))
+            .join(Thread, Thread.user_id == User.id)
+            .join(Message, Message.thread_id == Thread.id)
+            .where(User.api_key.like(f"{prefix}\\_%"))
+            .group_by(User.id)
+        )
+    ).all()
+    if not rows:
+        raise SystemExit(f"No generated users with prefix {prefix!r}; run generate_data.py first")
+    random.Random(seed).shuffle(rows)
+    return rows[:count]
+
+
+def ilike_query(user_id: int, text_query: str, limit: int):
+    word = text_query.strip('"').split()[0]
+    return (
+        select(Message.id, Message.content)
+        .join(Thread, Thread.id == Message.thread_id)
+        .where(Thread.user_id == user_id, Message.content.ilike(f"%{word}%"))
+        .order_by(Message.id.desc())
+        .limit(limit)
+    )
+
+
+async def timed(session: AsyncSession, statement):
+    started = time.perf_counter()
+    rows = (await session.execute(statement)).all()
+    return (time.perf_counter() - started) * 1000, len(rows)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--key-prefix", required=True, help="API key prefix given to generate_data.py")
+    parser.add_argument("--users", type=int, default=20, help="Users to sample")
+    parser.add_argument("--iterations", type=int, default=5, help="Runs of each query per user")
+    parser.add_argument("--limit", type=int, default=20, help="Results per page")
+    parser.add_argument("--skip-ilike", action="store_true", help="Only time the tsvector search")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    async with AsyncSession(engine) as session:
+        users = await sample_users(session, args.key_prefix, args.users, args.seed)
+        total_messages = (await session.execute(select(func.count(Message.id)))).scalar_one()
+        sampled = sorted(count for _, count in users)
+        print(
+            f"corpus: {total_messages:,} messages; {len(users)} users with"
+            f" {sampled[0]:,}-{sampled[-1]:,} messages each"
+        )
+        print(f"{'query':<20} {'fts p50':>9} {'fts p95':>9} {'hits':>6} {'ilike p50':>10} {'ilike p95':>10}")
+
+        for text_query in QUERIES:
+            fts, ilike, hits = [], [], []
+            for user_id, _ in users:
+                for _ in range(args.iterations):
+                    elapsed, found = await timed(
+                        session, search_messages_query(user_id, text_query, args.limit + 1)
+                    )
+                    fts.append(elapsed)
+                    hits.append(found)
+                    if not args.skip_ilike:
+                        elapsed, _ = await timed(session, ilike_query(user_id, text_query, args.limit + 1))
+                        ilike.append(elapsed)
+
+            fts_p50, fts_p95 = summarize(fts)
+            line = f"{text_query:<20} {fts_p50:>9.2f} {fts_p95:>9.2f} {statistics.fmean(hits):>6.1f}"
+            if ilike:
+                ilike_p50, ilike_p95 = summarize(ilike)
+                line += f" {ilike_p50:>10.2f} {ilike_p95:>10.2f}"
+            print(line)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
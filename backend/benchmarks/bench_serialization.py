@@ -0,0 +1,93 @@
+"""
+Microbenchmark of serializing a thread of messages, per 10k messages.
+
+Compares the previous /threads/me response path (ORM Message objects copied
+into MessageRead models, then run through FastAPI's jsonable_encoder and
+JSONResponse) with the current fast path (row tuples turned into dicts and
+encoded by FastJSONResponse). Runs without a database:
+rows are synthetic, and ORM objects are built from them to stand in for the
+hydration the ORM does when loading.
+
+Usage (from backend/):
+    python -m benchmarks.bench_serialization --messages 10000 --repeat 20
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from main import MessageRead, ThreadRead
+from models import Message
+from serialization import FastJSONResponse, message_rows_to_dicts, orjson
+
+
+def synthetic_rows(count: int):
+    rng = random.Random(0)
+    started = datetime(2024, 1, 1)
+    return [
+        (
+            i,
+            " ".join(rng.choice(["hello", "thanks", "order", "help", "refund", "the", "a"]) for _ in range(12)),
+            i % 2 == 0,
+            started + timedelta(seconds=i, microseconds=rng.randrange(1_000_000)),
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def orm_path(rows) -> bytes:
+    messages = [
+        Message(id=id_, thread_id=1, content=content, is_from_user=is_from_user, created_at=created_at)
+        for id_, content, is_from_user, created_at in rows
+    ]
+    thread = ThreadRead(
+        id=1,
+        messages=[
+            MessageRead(id=msg.id, content=msg.content, is_from_user=msg.is_from_user, created_at=msg.created_at)
+            for msg in messages
+        ],
+        next_cursor=None,
+    )
+    # What FastAPI does with a returned model when no response_model is declared
+    return JSONResponse(jsonable_encoder(thread)).body
+
+
+def fast_path(rows) -> bytes:
+    return FastJSONResponse({"id": 1, "messages": message_rows_to_dicts(rows), "next_cursor": None}).body
+
+
+def measure(fn, rows, repeat: int):
+    fn(rows)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.messages)
+    assert json.loads(orm_path(rows)) == json.loads(fast_path(rows)), "Both paths must produce the same JSON"
+
+    scale = 10_000 / args.messages
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}, messages: {args.messages}")
+    print(f"{'path':<10} {'median ms/10k':>14} {'best ms/10k':>12}")
+    for name, fn in (("before", orm_path), ("after", fast_path)):
+        median, best = measure(fn, rows, args.repeat)
+        print(f"{name:<10} {median * scale:>14.2f} {best * scale:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
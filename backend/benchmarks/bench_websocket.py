@@ -0,0 +1,137 @@
+"""
+Benchmark of chat messages/sec over the /ws/chat WebSocket versus POST /messages.
+
+Each client sends ``--messages`` messages and waits for every bot reply,
+with up to ``--window`` messages in flight: over HTTP as that many
+concurrent POST /messages requests (each authenticated and routed on its
+own), over the WebSocket as pipelined sends on one connection that was
+authenticated once. Latency is from sending a message to receiving its
+stored reply.
+
+Runs against a server, which should not rate-limit the benchmark:
+    RATE_LIMIT_ENABLED=false uvicorn main:app
+    python -m benchmarks.bench_websocket --clients 20 --messages 200 --window 8
+
+Generated users (see generate_data.py) put each client on its own thread:
+    python -m benchmarks.bench_websocket --key-prefix load_1a2b3c
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from typing import Dict, List
+
+import httpx
+import websockets
+
+SEEDED_API_KEYS = ["alice_key_123", "bob_key_456", "charlie_key_789"]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def http_client(client: httpx.AsyncClient, api_key: str, messages: int, window: int, latencies: List[float]):
+    counter = itertools.count()
+
+    async def sender():
+        while next(counter) < messages:
+            started = time.perf_counter()
+            response = await client.post(
+                "/messages", json={"content": "Benchmark message"}, headers={"X-API-Key": api_key}
+            )
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(sender() for _ in range(window)))
+
+
+async def ws_client(url: str, api_key: str, messages: int, window: int, latencies: List[float]):
+    async with websockets.connect(f"{url}/ws/chat?api_key={api_key}&tokens=false") as ws:
+        sent_at: Dict[int, float] = {}
+        next_id = 0
+        while next_id < min(window, messages):
+            sent_at[next_id] = time.perf_counter()
+            await ws.send(json.dumps({"type": "send", "id": next_id, "content": "Benchmark message"}))
+            next_id += 1
+
+        done = 0
+        while done < messages:
+            frame = json.loads(await ws.recv())
+            if frame["type"] == "error":
+                raise RuntimeError(f"Message {frame['id']} failed: {frame['detail']}")
+            if frame["type"] != "reply":
+                continue
+            latencies.append((time.perf_counter() - sent_at.pop(frame["id"])) * 1000)
+            done += 1
+            if next_id < messages:
+                sent_at[next_id] = time.perf_counter()
+                await ws.send(json.dumps({"type": "send", "id": next_id, "content": "Benchmark message"}))
+                next_id += 1
+
+
+async def run(name: str, clients, api_keys: List[str], messages: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    keys = itertools.cycle(api_keys)
+    started = time.perf_counter()
+    await asyncio.gather(*(client(next(keys), messages, latencies) for client in clients))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "messages": len(latencies),
+        "messages_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+    print(
+        f"{name:<10} {result['messages']:>8} {result['messages_per_s']:>9.1f}"
+        f" {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+    )
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="Server to benchmark")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--messages", type=int, default=200, help="Messages sent by each client")
+    parser.add_argument("--window", type=int, default=8, help="Messages each client keeps in flight")
+    parser.add_argument("--key-prefix", default=None, help="Use generated keys <prefix>_1 ... <prefix>_N")
+    parser.add_argument("--key-count", type=int, default=100, help="N for --key-prefix")
+    args = parser.parse_args()
+
+    if args.key_prefix:
+        api_keys = [f"{args.key_prefix}_{i}" for i in range(1, args.key_count + 1)]
+    else:
+        api_keys = SEEDED_API_KEYS
+    ws_url = "ws" + args.url[len("http"):]
+    connections = args.clients * args.window
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+    print(f"{'transport':<10} {'messages':>8} {'msg/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        # Warm up connections, caches and the responder pool
+        await run("warm-up", [lambda key, n, lat: http_client(client, key, n, args.window, lat)] * 2, api_keys, 10)
+        http = await run(
+            "http",
+            [lambda key, n, lat: http_client(client, key, n, args.window, lat)] * args.clients,
+            api_keys,
+            args.messages,
+        )
+    ws = await run(
+        "websocket",
+        [lambda key, n, lat: ws_client(ws_url, key, n, args.window, lat)] * args.clients,
+        api_keys,
+        args.messages,
+    )
+    print(f"WebSocket throughput: {ws['messages_per_s'] / http['messages_per_s']:.2f}x of POST /messages")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
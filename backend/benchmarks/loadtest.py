@@ -0,0 +1,261 @@
+"""
+Concurrent load test of the API: throughput, latency percentiles and DB queries per request.
+
+Each scenario drives one endpoint with ``--concurrency`` workers for
+``--duration`` seconds. By default requests go through an in-process ASGI
+transport (no sockets, no uvicorn), which isolates the application and the
+database from HTTP serving; ``--url`` targets a running server instead.
+Database queries per request are only counted in-process.
+
+In-process runs disable rate limiting unless ``--rate-limit`` is given:
+with a handful of API keys the limiter would answer most requests with
+429. Start a server targeted with ``--url`` with RATE_LIMIT_ENABLED=false.
+
+Only successful (2xx) responses count toward the success throughput and
+the latency percentiles: failures are often fast, and would pass an error
+storm off as a speed-up. A scenario whose error rate is above
+``--max-error-rate`` is flagged, and the run exits with status 1.
+
+Results are written as JSON so runs can be compared between commits.
+
+Usage (from backend/, with the database running):
+    python -m benchmarks.loadtest --concurrency 20 --duration 10
+    python -m benchmarks.loadtest --scenarios threads_me,post_message --output before.json
+    python -m benchmarks.loadtest --compare before.json
+    python -m benchmarks.loadtest --url http://localhost:8000
+
+Generated users (see generate_data.py) spread the load over many threads:
+    python -m benchmarks.loadtest --key-prefix load_1a2b3c --key-count 1000
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+from sqlalchemy import event
+
+SEEDED_API_KEYS = ["alice_key_123", "bob_key_456", "charlie_key_789"]
+
+# name -> (method, path, JSON body)
+SCENARIOS = {
+    "users_me": ("GET", "/users/me", None),
+    "threads_me": ("GET", "/threads/me", None),
+    "post_message": ("POST", "/messages", {"content": "Load test message"}),
+    "users": ("GET", "/users", None),
+}
+
+
+class QueryCounter:
+    """Counts statements sent through an engine"""
+
+    def __init__(self, sync_engine):
+        self.count = 0
+        event.listen(sync_engine, "before_cursor_execute", self._bump)
+
+    def _bump(self, *args, **kwargs):
+        self.count += 1
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    name: str,
+    api_keys: List[str],
+    concurrency: int,
+    duration: float,
+    counter: Optional[QueryCounter],
+) -> Dict[str, Any]:
+    method, path, body = SCENARIOS[name]
+    keys = itertools.cycle(api_keys)
+    # Of successful responses only
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body, headers={"X-API-Key": next(keys)})
+                status = str(response.status_code)
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            if status.startswith("2"):
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    queries_before = counter.count if counter else 0
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    succeeded = len(latencies)
+    requests = succeeded + sum(errors.values())
+    return {
+        "requests": requests,
+        "succeeded": succeeded,
+        "errors": errors,
+        "error_rate": (requests - succeeded) / requests if requests else 0.0,
+        # All responses, failed ones included
+        "throughput_rps": requests / elapsed,
+        "success_rps": succeeded / elapsed,
+        "mean_ms": sum(latencies) / succeeded if succeeded else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+        "queries_per_request": (counter.count - queries_before) / requests if counter and requests else None,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """Print a table of the results; req/s and latencies are of successful responses"""
+    print(
+        f"{'scenario':<14} {'requests':>8} {'errors':>6} {'ok req/s':>9} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'p99 ms':>8} {'queries':>7}"
+    )
+    for name, result in results.items():
+        queries = result["queries_per_request"]
+        print(
+            f"{name:<14} {result['requests']:>8} {sum(result['errors'].values()):>6}"
+            f" {result['success_rps']:>9.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}"
+            f" {result['p99_ms']:>8.2f} {queries if queries is None else round(queries, 2)!s:>7}"
+        )
+        previous = (baseline or {}).get("results", {}).get(name)
+        if previous:
+            def change(key):
+                # Results from before success_rps existed have nothing comparable
+                return (result[key] / previous[key] - 1) * 100 if previous.get(key) else 0.0
+
+            print(
+                f"{'  vs baseline':<14} {'':>8} {'':>6} {change('success_rps'):>+8.1f}%"
+                f" {change('p50_ms'):>+7.1f}% {change('p95_ms'):>+7.1f}% {change('p99_ms'):>+7.1f}%"
+            )
+
+
+def failing_scenarios(results: Dict[str, Dict[str, Any]], max_error_rate: float) -> List[str]:
+    return [name for name, result in results.items() if result["error_rate"] > max_error_rate]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent workers per scenario")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--url", default=None, help="Target a running server instead of the in-process app")
+    parser.add_argument("--api-key", action="append", dest="api_keys", help="API key to send (repeatable)")
+    parser.add_argument("--key-prefix", default=None, help="Use generated keys <prefix>_1 ... <prefix>_N")
+    parser.add_argument("--key-count", type=int, default=100, help="N for --key-prefix")
+    parser.add_argument(
+        "--rate-limit", action="store_true", help="Keep the app's rate limits on (in-process runs only)"
+    )
+    parser.add_argument("--output", default=None, help="JSON results file (default: loadtest-<revision>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare against")
+    parser.add_argument(
+        "--max-error-rate", type=float, default=0.01,
+        help="Flag scenarios with more failed responses than this fraction, and exit with status 1",
+    )
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.key_prefix:
+        api_keys = [f"{args.key_prefix}_{i}" for i in range(1, args.key_count + 1)]
+    else:
+        api_keys = args.api_keys or SEEDED_API_KEYS
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results: Dict[str, Dict[str, Any]] = {}
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+            for name in scenarios:
+                await run_scenario(client, name, api_keys, args.concurrency, args.warmup, None)
+                results[name] = await run_scenario(client, name, api_keys, args.concurrency, args.duration, None)
+    else:
+        if not args.rate_limit:
+            # Read when the app's modules are imported, just below
+            os.environ["RATE_LIMIT_ENABLED"] = "false"
+        from db_engine import engine
+        from main import app
+
+        counter = QueryCounter(engine.sync_engine)
+        transport = httpx.ASGITransport(app=app)
+        # ASGITransport does not send lifespan events, so run startup/shutdown here
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30) as client:
+                for name in scenarios:
+                    await run_scenario(client, name, api_keys, args.concurrency, args.warmup, counter)
+                    results[name] = await run_scenario(
+                        client, name, api_keys, args.concurrency, args.duration, counter
+                    )
+        await engine.dispose()
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "timestamp": datetime.utcnow().isoformat(),
+        "target": args.url or "in-process",
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "api_keys": len(api_keys),
+        "rate_limit": args.rate_limit if not args.url else None,
+        "python": platform.python_version(),
+        "max_error_rate": args.max_error_rate,
+        "failed_scenarios": failing_scenarios(results, args.max_error_rate),
+        "results": results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Baseline: {args.compare} (revision {baseline.get('revision')})")
+    print_results(results, baseline)
+
+    output = args.output or f"loadtest-{revision or 'unknown'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    for name in report["failed_scenarios"]:
+        result = results[name]
+        print(
+            f"WARNING: {name} failed {result['error_rate']:.1%} of its requests {result['errors']};"
+            f" its numbers do not measure the endpoint",
+            file=sys.stderr,
+        )
+    if report["failed_scenarios"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
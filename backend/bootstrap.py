@@ -0,0 +1,116 @@
+"""
+One-time database setup: schema creation and seeding.
+
+Runs from the app's lifespan (unless DB_INIT_ON_STARTUP is off) and from the
+create_tables.py / seed.py scripts. A transaction-scoped advisory lock
+serializes workers that start together, so the DDL and the seed inserts
+happen once per deployment; workers that get the lock later only find that
+everything is already in place.
+
+Databases created by earlier versions are upgraded in place: tables that
+already exist get the columns and indexes added since (see
+``upgrade_schema``), and the user table's change trigger is (re)installed.
+A partitioned message table also gets its default partition and the
+partitions of the coming months here (see partitions.py).
+"""
+
+from typing import Set
+
+from sqlalchemy import Connection, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.schema import CreateColumn
+
+import settings
+from models import THREAD_PREVIEW_LENGTH, USER_CHANGED_TRIGGER_DDL, Base, Message
+from partitions import ensure_upcoming_partitions, is_partitioned
+from seed import seed_user_if_needed
+
+# Arbitrary application-wide key for pg_advisory_xact_lock
+BOOTSTRAP_LOCK_KEY = 727_001
+
+# Threads from before several threads per user: add the summary columns and
+# fill them in. A user's oldest thread becomes the default one (older
+# databases may have several threads per user, or a unique user_id that is
+# now replaced by a partial unique index).
+THREAD_SUMMARY_UPGRADE = (
+    text("ALTER TABLE thread DROP CONSTRAINT IF EXISTS thread_user_id_key"),
+    text(f"""
+        ALTER TABLE thread
+            ADD COLUMN IF NOT EXISTS title varchar(100),
+            ADD COLUMN is_default boolean NOT NULL DEFAULT false,
+            ADD COLUMN message_count integer NOT NULL DEFAULT 0,
+            ADD COLUMN last_message_at timestamp,
+            ADD COLUMN last_message_preview varchar({THREAD_PREVIEW_LENGTH})
+    """),
+    text("UPDATE thread SET is_default = true WHERE id IN (SELECT min(id) FROM thread GROUP BY user_id)"),
+    text(f"""
+        UPDATE thread SET
+            message_count = summary.message_count,
+            last_message_at = summary.last_message_at,
+            last_message_preview = left(summary.content, {THREAD_PREVIEW_LENGTH})
+        FROM (
+            SELECT DISTINCT ON (thread_id)
+                thread_id, count(*) OVER (PARTITION BY thread_id) AS message_count,
+                created_at AS last_message_at, content
+            FROM message
+            ORDER BY thread_id, created_at DESC, id DESC
+        ) AS summary
+        WHERE thread.id = summary.thread_id
+    """),
+    text("UPDATE thread SET last_message_at = created_at WHERE last_message_at IS NULL"),
+    text("""
+        ALTER TABLE thread
+            ALTER COLUMN last_message_at SET NOT NULL,
+            ALTER COLUMN is_default DROP DEFAULT,
+            ALTER COLUMN message_count DROP DEFAULT
+    """),
+)
+
+
+async def table_columns(conn: AsyncConnection, table: str) -> Set[str]:
+    result = await conn.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND table_name = :table"
+        ),
+        {"table": table},
+    )
+    return set(result.scalars())
+
+
+def create_missing_indexes(conn: Connection) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def upgrade_schema(conn: AsyncConnection) -> None:
+    """Bring tables created by earlier versions up to the models; a no-op on a current schema.
+
+    ``create_all`` only creates missing tables, so columns and indexes added
+    to existing ones since are added here.
+    """
+    if "is_default" not in await table_columns(conn, "thread"):
+        for statement in THREAD_SUMMARY_UPGRADE:
+            await conn.execute(statement)
+    if "content_tsv" not in await table_columns(conn, "message"):
+        # Computes the search vector of every existing message
+        column = CreateColumn(Message.__table__.c.content_tsv).compile(dialect=conn.dialect)
+        await conn.execute(text(f"ALTER TABLE message ADD COLUMN {column}"))
+    await conn.run_sync(create_missing_indexes)
+
+
+async def initialize_database(engine: AsyncEngine, seed: bool = True) -> None:
+    """Create missing tables, upgrade existing ones and, if ``seed``, add the default data, in one transaction"""
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": BOOTSTRAP_LOCK_KEY})
+        await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
+        for ddl in USER_CHANGED_TRIGGER_DDL:
+            await conn.execute(ddl)
+        if await is_partitioned(conn):
+            await ensure_upcoming_partitions(conn, settings.MESSAGE_PARTITION_MONTHS_AHEAD)
+        if seed:
+            async with AsyncSession(bind=conn) as session:
+                await seed_user_if_needed(session)
+                await session.flush()
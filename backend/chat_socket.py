@@ -0,0 +1,124 @@
+"""
+Connection plumbing for the /ws/chat WebSocket.
+
+A ``ChatSocket`` wraps one accepted WebSocket. Frames are JSON objects with
+a ``type``.
+
+- Outgoing frames go through a bounded buffer drained by a single writer
+  task, so the handlers of one connection can all send without waiting on
+  the client or interleaving writes. A client that lets the buffer fill up,
+  or does not take a frame within a heartbeat interval, is disconnected
+  instead of being buffered for without bound; it reconnects and catches up
+  with ``/threads/me?since_id=``.
+- Heartbeats: the server sends ``{"type": "ping"}`` every heartbeat
+  interval. Any frame from the client shows that it is alive; one that stays
+  silent for two intervals is disconnected. Clients answer with
+  ``{"type": "pong"}``, and may send ``{"type": "ping"}`` themselves.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+# WebSocket close codes (RFC 6455)
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class ChatSocket:
+    """One client connection: a bounded send buffer, a writer and heartbeats"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_buffered: int,
+        heartbeat: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.websocket = websocket
+        self.max_buffered = max_buffered
+        self.heartbeat = heartbeat
+        self._clock = clock
+        self._frames: Deque[Dict[str, Any]] = deque()
+        self._wakeup = asyncio.Event()
+        self.last_received = clock()
+        # (code, reason) once the connection is being closed
+        self.close_reason: Optional[Tuple[int, str]] = None
+        self.sent = 0
+        self.received = 0
+
+    def send(self, frame: Dict[str, Any]) -> None:
+        """Queue a frame for the client without waiting; closes the connection if the buffer is full"""
+        if self.close_reason is not None:
+            return
+        if len(self._frames) >= self.max_buffered:
+            self.close(CLOSE_TRY_AGAIN_LATER, "Send buffer full")
+            return
+        self._frames.append(frame)
+        self._wakeup.set()
+
+    def close(self, code: int, reason: str) -> None:
+        """Close the connection once the writer gets to it; frames still buffered are dropped"""
+        if self.close_reason is None:
+            self.close_reason = (code, reason)
+            self._frames.clear()
+            self._wakeup.set()
+
+    async def receive(self) -> Optional[Dict[str, Any]]:
+        """The next frame from the client; None (after telling it) if it is not a JSON object.
+
+        Raises ``WebSocketDisconnect`` when the client goes away.
+        """
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        self.last_received = self._clock()
+        self.received += 1
+        try:
+            frame = json.loads(message.get("text") or message.get("bytes") or "")
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            self.send({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+            return None
+        if frame.get("type") == "ping":
+            self.send({"type": "pong"})
+        return frame
+
+    async def run_writer(self) -> None:
+        """Send buffered frames until the connection is closed; returns once it is"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._frames and self.close_reason is None:
+                frame = self._frames.popleft()
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(json.dumps(frame)), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # Not reading: a close frame would not get through either
+                    self.close_reason = (CLOSE_TRY_AGAIN_LATER, "Client not reading")
+                    return
+                self.sent += 1
+            if self.close_reason is not None:
+                try:
+                    await asyncio.wait_for(self.websocket.close(*self.close_reason), self.heartbeat)
+                except Exception:
+                    logger.debug("Could not close the WebSocket cleanly", exc_info=True)
+                return
+
+    async def run_heartbeat(self) -> None:
+        """Ping the client every interval; close the connection once it has been silent for two"""
+        while self.close_reason is None:
+            await asyncio.sleep(self.heartbeat)
+            if self._clock() - self.last_received > 2 * self.heartbeat:
+                self.close(CLOSE_GOING_AWAY, "Heartbeat timeout")
+                return
+            self.send({"type": "ping"})
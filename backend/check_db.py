@@ -1,12 +1,11 @@
+import asyncio
 from sqlalchemy import text
-from sqlalchemy.orm import Session
-from db_engine import sync_engine
-from models import User
+from db_engine import engine
 
-def check_database():
-    with Session(sync_engine) as session:
+async def check_database():
+    async with engine.connect() as conn:
         # Check what tables exist
-        result = session.execute(text("""
+        result = await conn.execute(text("""
             SELECT table_name 
             FROM information_schema.tables 
             WHERE table_schema = 'public'
@@ -15,7 +14,7 @@ def check_database():
         print(f"Tables in database: {tables}")
         
         # Check user table structure
-        result = session.execute(text("""
+        result = await conn.execute(text("""
             SELECT column_name, data_type, is_nullable
             FROM information_schema.columns 
             WHERE table_name = 'user'
@@ -25,10 +24,12 @@ def check_database():
             print(f"  {row[0]}: {row[1]} ({'NULL' if row[2] == 'YES' else 'NOT NULL'})")
         
         # Check user data
-        users = session.execute(text("SELECT * FROM \"user\"")).fetchall()
+        users = (await conn.execute(text("SELECT * FROM \"user\""))).fetchall()
         print(f"\nUser data ({len(users)} rows):")
         for user in users:
             print(f"  ID: {user[0]}, Name: {user[1]}")
 
+    await engine.dispose()
+
 if __name__ == "__main__":
-    check_database()
+    asyncio.run(check_database())
@@ -1,9 +1,11 @@
-from db_engine import sync_engine
-from models import Base
+import asyncio
+from bootstrap import initialize_database
+from db_engine import engine
 
-def create_tables():
-    Base.metadata.create_all(bind=sync_engine)
+async def create_tables():
+    await initialize_database(engine, seed=False)
+    await engine.dispose()
     print("All tables created successfully!")
 
 if __name__ == "__main__":
-    create_tables()
+    asyncio.run(create_tables())
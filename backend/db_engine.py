@@ -1,14 +1,269 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import create_async_engine
+import asyncio
+import logging
+import time
+from collections import deque
+from itertools import count
+from typing import Any, Callable, Dict, Optional, Sequence
 
-from models import Base
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-_main_uri = "postgres:postgres@localhost:5432/postgres"
-_sync_uri = f"postgresql://{_main_uri}"
-_async_uri = f"postgresql+asyncpg://{_main_uri}"
+import settings
 
-sync_engine = create_engine(_sync_uri)
+logger = logging.getLogger(__name__)
 
-Base.metadata.create_all(sync_engine)
 
-engine = create_async_engine(_async_uri)
+class PoolWaitStats:
+    """Checkout wait times of a connection pool"""
+
+    def __init__(self, window: int = 1024):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Most recent waits, for percentiles
+        self._recent: "deque[float]" = deque(maxlen=window)
+
+    def record(self, wait: float) -> None:
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._recent.append(wait)
+
+    def to_dict(self) -> Dict[str, Any]:
+        recent = sorted(self._recent)
+
+        def percentile(p: float) -> float:
+            return recent[min(len(recent) - 1, int(len(recent) * p))] * 1000 if recent else 0.0
+
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_ms_mean": (self.total_wait / self.checkouts) * 1000 if self.checkouts else 0.0,
+            "wait_ms_max": self.max_wait * 1000,
+            "wait_ms_p50": percentile(0.50),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_p99": percentile(0.99),
+        }
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that records how long each checkout waits.
+
+    The wait covers queueing for a free connection, opening a new one when
+    the pool may still grow, and the pre-ping if enabled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.wait_stats.timeouts += 1
+            raise
+        self.wait_stats.record(time.perf_counter() - started)
+        return connection
+
+
+def create_engine_from_settings(url: Optional[str] = None) -> AsyncEngine:
+    """Build the async engine with pool and driver options from settings"""
+    return create_async_engine(
+        url or settings.DATABASE_URL,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        connect_args={
+            # SQLAlchemy's per-connection cache of asyncpg prepared statements
+            "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            # asyncpg's own statement cache (set both to 0 behind pgbouncer)
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+
+
+def pool_status(engine: AsyncEngine) -> Dict[str, Any]:
+    """Snapshot of an engine's pool occupancy and checkout wait times"""
+    pool = engine.pool
+    status = {
+        "size": pool.size(),
+        "open": pool.checkedout() + pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # QueuePool counts overflow from -size while the pool is filling up
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "timeout_s": pool.timeout(),
+    }
+    if isinstance(pool, InstrumentedAsyncQueuePool):
+        status.update(pool.wait_stats.to_dict())
+    return status
+
+
+# Seconds a replica is behind the primary; 0 on a primary or a replica that
+# has replayed everything it received (an idle primary sends nothing, so the
+# last replay timestamp alone would read as growing lag)
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    """A read replica's engine and its last health check"""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.healthy = True
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.ejections = 0
+        self.reads = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "lag_seconds": self.lag_seconds,
+            "last_error": self.last_error,
+            "ejections": self.ejections,
+            "reads": self.reads,
+        }
+
+
+class EngineRouter:
+    """Chooses the engine for a request: the primary for writes, a replica for reads.
+
+    Reads go round-robin to the replicas that passed their last health
+    check, and to the primary when there are none. A user who wrote within
+    ``read_your_writes`` seconds reads from the primary too, so they see
+    their own writes whatever the replication lag. Recent writers are
+    tracked per process; with several workers, a read served by another
+    worker than the write may still go to a replica.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: Sequence[AsyncEngine] = (),
+        read_your_writes: float = 5.0,
+        max_lag: float = 0.0,
+        check_timeout: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.primary = primary
+        self.replicas = [Replica(replica) for replica in replicas]
+        self.read_your_writes = read_your_writes
+        self.max_lag = max_lag
+        self.check_timeout = check_timeout
+        self._clock = clock
+        self._turn = count()
+        # Writer key -> time until which its reads go to the primary
+        self._recent_writes: Dict[str, float] = {}
+        self.primary_reads = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def writer(self) -> AsyncEngine:
+        return self.primary
+
+    def reader(self, key: Optional[str] = None) -> AsyncEngine:
+        """Engine for a read-only request by ``key`` (e.g. the API key)"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy or (key is not None and self._wrote_recently(key)):
+            self.primary_reads += 1
+            return self.primary
+        replica = healthy[next(self._turn) % len(healthy)]
+        replica.reads += 1
+        return replica.engine
+
+    def record_write(self, key: Optional[str]) -> None:
+        """Send ``key``'s reads to the primary for the read-your-writes window"""
+        if key is None or not self.replicas or self.read_your_writes <= 0:
+            return
+        now = self._clock()
+        if len(self._recent_writes) >= 10_000:
+            self._recent_writes = {k: until for k, until in self._recent_writes.items() if until > now}
+        self._recent_writes[key] = now + self.read_your_writes
+
+    def _wrote_recently(self, key: str) -> bool:
+        until = self._recent_writes.get(key)
+        if until is None:
+            return False
+        if until <= self._clock():
+            del self._recent_writes[key]
+            return False
+        return True
+
+    async def check_replica(self, replica: Replica) -> None:
+        """Probe one replica, taking it out of rotation or back in"""
+        async def probe() -> float:
+            async with replica.engine.connect() as conn:
+                return float(await conn.scalar(REPLICA_LAG_QUERY))
+
+        try:
+            # Bounds connecting too: an unreachable host may not refuse quickly
+            lag = await asyncio.wait_for(probe(), self.check_timeout)
+            replica.lag_seconds = lag
+            error = f"lag {lag:.1f}s" if self.max_lag > 0 and lag > self.max_lag else None
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+
+        url = replica.engine.url.render_as_string(hide_password=True)
+        if error is not None and replica.healthy:
+            replica.ejections += 1
+            logger.warning("Replica %s out of rotation: %s", url, error)
+        elif error is None and not replica.healthy:
+            logger.info("Replica %s back in rotation", url)
+        replica.healthy = error is None
+        replica.last_error = error
+
+    async def check_replicas(self) -> None:
+        await asyncio.gather(*(self.check_replica(replica) for replica in self.replicas))
+
+    async def _run_checks(self, interval: float) -> None:
+        while True:
+            await self.check_replicas()
+            await asyncio.sleep(interval)
+
+    async def start(self, interval: float) -> None:
+        """Check the replicas now, then every ``interval`` seconds"""
+        if self.replicas:
+            await self.check_replicas()
+            self._task = asyncio.ensure_future(self._run_checks(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "primary_reads": self.primary_reads,
+            "recent_writers": len(self._recent_writes),
+            "read_your_writes_seconds": self.read_your_writes,
+            "replicas": [replica.to_dict() for replica in self.replicas],
+        }
+
+
+engine = create_engine_from_settings()
+
+router = EngineRouter(
+    engine,
+    [create_engine_from_settings(url) for url in settings.DATABASE_REPLICA_URLS],
+    read_your_writes=settings.READ_YOUR_WRITES_SECONDS,
+    max_lag=settings.REPLICA_MAX_LAG_SECONDS,
+    check_timeout=settings.REPLICA_HEALTH_CHECK_TIMEOUT,
+)
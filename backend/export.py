@@ -0,0 +1,114 @@
+"""
+Streaming export of a thread's messages as NDJSON or CSV.
+
+An export is encoded one fetched batch of rows at a time and sent as it is
+produced, so a worker's memory use does not grow with the thread: rows come
+from a server-side cursor (see ``stream_thread_rows``), each batch becomes
+one chunk of the response body, and nothing else is kept. With gzip, a
+single streaming compressor runs over the whole body.
+
+Both formats carry the ``MessageRead`` fields, oldest message first. NDJSON
+has one JSON object per line; CSV has a header row, then one row per
+message with ``is_from_user`` as ``true``/``false`` and ``created_at`` in
+ISO 8601.
+"""
+
+import csv
+import io
+import zlib
+from typing import AsyncIterable, AsyncIterator, Dict, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Message
+from serialization import dumps, message_rows_to_dicts, select_message_rows
+
+# Format -> media type
+EXPORT_FORMATS: Dict[str, str] = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+CSV_HEADER = ("id", "content", "is_from_user", "created_at")
+
+
+class NdjsonEncoder:
+    """Encodes batches of message rows as NDJSON lines"""
+
+    header = b""
+
+    def __call__(self, rows: Sequence) -> bytes:
+        return b"".join(dumps(message) + b"\n" for message in message_rows_to_dicts(rows))
+
+
+class CsvEncoder:
+    """Encodes batches of message rows as consecutive pieces of one CSV document"""
+
+    header = (",".join(CSV_HEADER) + "\r\n").encode("utf-8")
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def __call__(self, rows: Sequence) -> bytes:
+        self._writer.writerows(
+            (id_, content, "true" if is_from_user else "false", created_at.isoformat())
+            for id_, content, is_from_user, created_at in rows
+        )
+        encoded = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return encoded
+
+
+def row_encoder(format: str):
+    """A new encoder for one export, for ``format`` in ``EXPORT_FORMATS``"""
+    if format == "ndjson":
+        return NdjsonEncoder()
+    if format == "csv":
+        return CsvEncoder()
+    raise ValueError(f"Unknown export format: {format}")
+
+
+async def stream_thread_rows(session: AsyncSession, thread_id: int, fetch_rows: int) -> AsyncIterator[Sequence]:
+    """A thread's message rows, oldest first, in batches of up to ``fetch_rows``.
+
+    Reads through a server-side cursor, so only one batch is in memory at a
+    time; the cursor stays open on the session's connection until the
+    iteration ends.
+    """
+    query = (
+        select_message_rows()
+        .where(Message.thread_id == thread_id)
+        .order_by(Message.created_at, Message.id)
+        .execution_options(yield_per=fetch_rows)
+    )
+    result = await session.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def export_chunks(
+    batches: AsyncIterable[Sequence], format: str, gzip_level: int = -1
+) -> AsyncIterator[bytes]:
+    """Encode batches of message rows as the body of an export, one chunk per batch.
+
+    ``gzip_level`` 0-9 compresses the body as one gzip stream; -1 leaves it
+    uncompressed.
+    """
+    encode = row_encoder(format)
+    compressor = None
+    if gzip_level >= 0:
+        # wbits 16 + MAX_WBITS: gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    async def encoded() -> AsyncIterator[bytes]:
+        yield encode.header
+        async for rows in batches:
+            yield encode(rows)
+
+    async for chunk in encoded():
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
@@ -0,0 +1,296 @@
+"""
+Generate synthetic users, threads and messages for load testing.
+
+Users and threads are created server-side with INSERT ... SELECT over
+generate_series. Messages are streamed thread by thread into Postgres in
+fixed-size batches through COPY (or asyncpg's pipelined executemany), so
+memory stays bounded however many rows are generated.
+
+Examples (from backend/, with the database running):
+    # 10k users, one thread each, 10M messages skewed towards a few long threads
+    python generate_data.py --users 10000 --messages 10000000 --thread-dist zipf
+
+    # Short conversations with bursty timestamps over the last 90 days
+    python generate_data.py --users 1000 --messages 200000 --time-dist bursty --days 90
+
+Generated users get the API keys ``<prefix>_1`` ... ``<prefix>_N``. On a
+partitioned message table, the monthly partitions of the generated time span
+are created first.
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+from db_engine import engine
+from models import THREAD_PREVIEW_LENGTH
+from partitions import create_partitions, is_partitioned
+
+# Words drawn with a Zipf-like frequency so that message text looks like
+# natural language to the planner and to full-text search
+VOCABULARY = (
+    "the be to of and a in that have I it for not on with he as you do at this but his by from "
+    "they we say her she or an will my one all would there their what so up out if about who get "
+    "which go me when make can like time no just him know take people into year your good some "
+    "could them see other than then now look only come its over think also back after use two how "
+    "our work first well way even new want because any these give day most us message thread chat "
+    "help question answer issue order account payment delivery update problem thanks please today "
+    "tomorrow week support product price refund error login password email phone address service"
+).split()
+
+# Characters of pre-generated text that messages are sliced from
+TEXT_BLOCK_SIZE = 1 << 20
+
+
+class Progress:
+    """Prints throughput of a load phase"""
+
+    def __init__(self, label: str, total: int):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def advance(self, rows: int) -> None:
+        self.done += rows
+        now = time.perf_counter()
+        if now - self._last_report >= 5:
+            self._last_report = now
+            elapsed = now - self.started
+            print(
+                f"  {self.label}: {self.done:,}/{self.total:,} rows"
+                f" ({self.done / elapsed:,.0f} rows/s)"
+            )
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        return f"{self.label}: {self.done:,} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)"
+
+
+class TextSource:
+    """Cheap random message text: slices of a pre-generated block of words"""
+
+    def __init__(self, rng: random.Random):
+        weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+        words = rng.choices(VOCABULARY, weights=weights, k=TEXT_BLOCK_SIZE // 5)
+        self.block = " ".join(words)
+        self.rng = rng
+
+    def text(self, length: int) -> str:
+        start = self.rng.randrange(0, len(self.block) - length)
+        # Start at a word boundary so messages do not begin mid-word
+        boundary = self.block.find(" ", start) + 1
+        return self.block[boundary:boundary + length].strip() or "hello"
+
+
+def message_lengths(args, rng: random.Random) -> Iterator[int]:
+    while True:
+        if args.length_dist == "fixed":
+            length = args.length_mean
+        elif args.length_dist == "uniform":
+            length = rng.randint(1, 2 * args.length_mean)
+        else:
+            # Lognormal with the requested mean and a long tail
+            sigma = 0.8
+            mu = math.log(args.length_mean) - sigma ** 2 / 2
+            length = int(rng.lognormvariate(mu, sigma))
+        yield max(1, min(length, args.length_max))
+
+
+def messages_per_thread(total: int, threads: int, dist: str) -> List[int]:
+    """Split ``total`` messages over ``threads`` threads"""
+    if dist == "uniform":
+        weights = [1.0] * threads
+    else:
+        weights = [1 / (rank + 1) for rank in range(threads)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for i in range(total - sum(counts)):
+        counts[i % threads] += 1
+    return counts
+
+
+def message_timestamps(count: int, start: datetime, end: datetime, dist: str, rng: random.Random) -> Iterator[datetime]:
+    """Increasing timestamps in [start, end], generated without materializing them"""
+    span = (end - start).total_seconds()
+    mean_gap = span / (count + 1)
+    current = start
+    for _ in range(count):
+        if dist == "uniform":
+            # Poisson arrivals: exponential gaps spread messages evenly over the span
+            gap = rng.expovariate(1 / mean_gap)
+        else:
+            # Conversations: mostly quick replies, occasionally a long pause
+            # (the two scales average out to mean_gap)
+            scale = 0.1 if rng.random() < 0.9 else 9.1
+            gap = rng.expovariate(1 / (mean_gap * scale))
+        current = min(current + timedelta(seconds=gap), end)
+        yield current
+
+
+async def create_users(conn, count: int, prefix: str) -> None:
+    progress = Progress("users", count)
+    await conn.execute(
+        """
+        INSERT INTO "user" (name, api_key)
+        SELECT 'Load user ' || g, $1 || '_' || g
+        FROM generate_series(1, $2) AS g
+        """,
+        prefix,
+        count,
+    )
+    progress.advance(count)
+    print(progress.summary())
+
+
+async def create_threads(conn, count: int, prefix: str, start: datetime) -> List[int]:
+    """Create ``count`` threads dealt round-robin over the generated users; each user's first is its default"""
+    progress = Progress("threads", count)
+    rows = await conn.fetch(
+        """
+        WITH users AS (
+            SELECT id, row_number() OVER (ORDER BY id) - 1 AS position, count(*) OVER () AS total
+            FROM "user"
+            -- Not LIKE: the prefix itself may contain _ or %
+            WHERE left(api_key, length($1) + 1) = $1 || '_'
+        )
+        INSERT INTO thread (user_id, is_default, created_at, last_message_at, message_count)
+        SELECT users.id, g < users.total, $3::timestamp, $3::timestamp, 0
+        FROM generate_series(0, $2 - 1) AS g
+        JOIN users ON users.position = g % users.total
+        ORDER BY g
+        RETURNING id
+        """,
+        prefix,
+        count,
+        start,
+    )
+    progress.advance(len(rows))
+    print(progress.summary())
+    return [row["id"] for row in rows]
+
+
+async def refresh_thread_summaries(conn, thread_ids: List[int]) -> None:
+    """Recompute the denormalized summaries of threads filled by COPY, which bypasses them"""
+    await conn.execute(
+        f"""
+        UPDATE thread SET
+            message_count = summary.message_count,
+            last_message_at = summary.last_message_at,
+            last_message_preview = summary.last_message_preview
+        FROM (
+            SELECT DISTINCT ON (thread_id)
+                thread_id,
+                count(*) OVER (PARTITION BY thread_id) AS message_count,
+                created_at AS last_message_at,
+                left(content, {THREAD_PREVIEW_LENGTH}) AS last_message_preview
+            FROM message
+            WHERE thread_id = ANY($1::int[])
+            ORDER BY thread_id, created_at DESC, id DESC
+        ) AS summary
+        WHERE thread.id = summary.thread_id
+        """,
+        thread_ids,
+    )
+
+
+def message_records(args, thread_ids: List[int], start: datetime, end: datetime, rng: random.Random):
+    lengths = message_lengths(args, rng)
+    text = TextSource(rng)
+    counts = messages_per_thread(args.messages, len(thread_ids), args.thread_dist)
+    for thread_id, count in zip(thread_ids, counts):
+        is_from_user = True
+        for created_at in message_timestamps(count, start, end, args.time_dist, rng):
+            yield (thread_id, text.text(next(lengths)), is_from_user, created_at)
+            is_from_user = not is_from_user
+
+
+async def load_messages(conn, args, thread_ids: List[int], start: datetime, end: datetime, rng: random.Random) -> None:
+    progress = Progress("messages", args.messages)
+    columns = ["thread_id", "content", "is_from_user", "created_at"]
+    batch = []
+
+    async def flush():
+        if args.method == "copy":
+            await conn.copy_records_to_table("message", records=batch, columns=columns)
+        else:
+            await conn.executemany(
+                "INSERT INTO message (thread_id, content, is_from_user, created_at) VALUES ($1, $2, $3, $4)",
+                batch,
+            )
+        progress.advance(len(batch))
+        batch.clear()
+
+    for record in message_records(args, thread_ids, start, end, rng):
+        batch.append(record)
+        if len(batch) >= args.batch_size:
+            await flush()
+    if batch:
+        await flush()
+    print(progress.summary())
+
+
+async def generate(args) -> None:
+    rng = random.Random(args.seed)
+    prefix = args.prefix or f"load_{secrets.token_hex(3)}"
+    end = datetime.utcnow()
+    start = end - timedelta(days=args.days)
+
+    async with engine.begin() as sa_conn:
+        if await is_partitioned(sa_conn):
+            created = await create_partitions(sa_conn, start.date(), end.date())
+            print(f"Created message partitions: {', '.join(created) or 'none needed'}")
+
+    async with engine.connect() as sa_conn:
+        # Talk to asyncpg directly: COPY is not exposed through SQLAlchemy
+        conn = (await sa_conn.get_raw_connection()).driver_connection
+
+        await create_users(conn, args.users, prefix)
+        thread_ids = await create_threads(conn, args.threads or args.users, prefix, start)
+        await load_messages(conn, args, thread_ids, start, end, rng)
+        print("Updating thread summaries")
+        await refresh_thread_summaries(conn, thread_ids)
+
+        print("Analyzing tables")
+        await conn.execute('ANALYZE "user", thread, message')
+
+    await engine.dispose()
+    print(f"API keys: {prefix}_1 ... {prefix}_{args.users}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Users to create")
+    parser.add_argument("--threads", type=int, default=None, help="Threads to create, dealt round-robin over the users (default: one per user)")
+    parser.add_argument("--messages", type=int, default=100_000, help="Messages to create in total")
+    parser.add_argument("--thread-dist", choices=["uniform", "zipf"], default="uniform",
+                        help="How messages are spread over threads")
+    parser.add_argument("--length-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal",
+                        help="Distribution of message lengths")
+    parser.add_argument("--length-mean", type=int, default=80, help="Mean message length in characters")
+    parser.add_argument("--length-max", type=int, default=2000, help="Longest message in characters")
+    parser.add_argument("--time-dist", choices=["uniform", "bursty"], default="uniform",
+                        help="Distribution of message timestamps within a thread")
+    parser.add_argument("--days", type=float, default=365, help="Time span covered by the messages")
+    parser.add_argument("--method", choices=["copy", "executemany"], default="copy", help="How rows are written")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Rows buffered per write")
+    parser.add_argument("--prefix", default=None, help="API key prefix (default: random)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible data")
+    args = parser.parse_args()
+
+    if args.threads is not None and args.threads < args.users:
+        parser.error("--threads cannot be below --users: every user needs its default thread")
+    if args.length_max >= TEXT_BLOCK_SIZE // 2:
+        parser.error(f"--length-max must be below {TEXT_BLOCK_SIZE // 2}")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(generate(parse_args()))
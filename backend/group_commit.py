@@ -0,0 +1,194 @@
+"""
+Group commit for message inserts.
+
+Every transaction pays for its commit: the server waits for the WAL to reach
+disk. Under concurrent load, committing each request's insert separately
+makes that wait the limit on write throughput. ``GroupCommitWriter`` lets
+the requests of one worker share it: ``insert`` queues the rows and waits,
+while a background task writes everything queued with one multi-row INSERT
+and one COMMIT, then hands each caller its own rows.
+
+A batch is written once ``max_rows`` rows are queued, or ``window`` seconds
+after the first of them arrived, whichever comes first; rows queued while a
+batch is being written go into the next one. If a batch fails, its requests
+are retried one transaction each, so a bad request fails alone instead of
+taking its batch down with it.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from queries import insert_thread_messages
+
+logger = logging.getLogger(__name__)
+
+# (content, is_from_user, created_at)
+MessageRow = Tuple[str, bool, Any]
+
+
+class PendingInsert(NamedTuple):
+    thread_id: int
+    rows: Sequence[MessageRow]
+    future: "asyncio.Future[List[Any]]"
+
+
+async def write_in_one_transaction(engine: AsyncEngine, inserts: List[PendingInsert]) -> List[Any]:
+    """Insert the rows of every request with one statement and commit; rows come back in order"""
+    async with AsyncSession(engine) as session:
+        inserted = await insert_thread_messages(
+            session, [(insert.thread_id, *row) for insert in inserts for row in insert.rows]
+        )
+        await session.commit()
+    return inserted
+
+
+class GroupCommitWriter:
+    """Batches concurrent message inserts into shared transactions"""
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        window: float,
+        max_rows: int,
+        write: Optional[Callable[[AsyncEngine, List[PendingInsert]], Awaitable[List[Any]]]] = None,
+    ):
+        self.engine = engine
+        self.window = window
+        self.max_rows = max_rows
+        self._write = write or write_in_one_transaction
+        self._queue: Deque[PendingInsert] = deque()
+        self._queued_rows = 0
+        # Created in start(), inside the running event loop
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # The batch being written, which stop() waits for
+        self._current: Optional["asyncio.Future[None]"] = None
+        self.batches = 0
+        self.rows_written = 0
+        self.requests_written = 0
+        self.isolated_failures = 0
+        self.largest_batch_rows = 0
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task, finish the batch it was writing, then write whatever is still queued"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._current is not None:
+            await asyncio.gather(self._current, return_exceptions=True)
+            self._current = None
+        while self._queue:
+            await self._write_batch(self._take_batch())
+
+    async def insert(self, thread_id: int, rows: Sequence[MessageRow]) -> List[Any]:
+        """Queue rows for one thread and wait until they are committed; returns them in order.
+
+        Raises whatever writing them raised. Cancelling the wait before the
+        rows are picked up for a batch withdraws them.
+        """
+        if self._task is None:
+            raise RuntimeError("GroupCommitWriter is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(PendingInsert(thread_id, rows, future))
+        self._queued_rows += len(rows)
+        self._wakeup.set()
+        if self._queued_rows >= self.max_rows:
+            self._full.set()
+        return await future
+
+    def _take_batch(self) -> List[PendingInsert]:
+        """Dequeue whole requests up to ``max_rows`` rows (always at least one request)"""
+        batch: List[PendingInsert] = []
+        rows = 0
+        while self._queue and (not batch or rows + len(self._queue[0].rows) <= self.max_rows):
+            insert = self._queue.popleft()
+            self._queued_rows -= len(insert.rows)
+            if insert.future.done():
+                # The caller gave up waiting before the batch was written
+                continue
+            batch.append(insert)
+            rows += len(insert.rows)
+        if self._queued_rows < self.max_rows:
+            self._full.clear()
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if not self._queue:
+                self._wakeup.clear()
+                continue
+            if self._queued_rows < self.max_rows and self.window > 0:
+                # Give concurrent requests a moment to join the batch
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take_batch()
+            if not self._queue:
+                self._wakeup.clear()
+            # Shielded, and kept for stop() to wait for: cancelling the task
+            # must not abandon a batch half-written
+            self._current = asyncio.ensure_future(self._write_batch(batch))
+            await asyncio.shield(self._current)
+            self._current = None
+
+    async def _write_batch(self, batch: List[PendingInsert]) -> None:
+        if not batch:
+            return
+        try:
+            inserted = await self._write(self.engine, batch)
+        except Exception as exc:
+            if len(batch) == 1:
+                self._resolve(batch[0], exception=exc)
+                return
+            logger.warning("Group commit of %d requests failed (%s); retrying them one by one", len(batch), exc)
+            for insert in batch:
+                try:
+                    self._resolve(insert, result=await self._write(self.engine, [insert]))
+                except Exception as single_exc:
+                    self.isolated_failures += 1
+                    self._resolve(insert, exception=single_exc)
+            return
+
+        self.batches += 1
+        self.largest_batch_rows = max(self.largest_batch_rows, len(inserted))
+        position = 0
+        for insert in batch:
+            self._resolve(insert, result=inserted[position:position + len(insert.rows)])
+            position += len(insert.rows)
+
+    def _resolve(self, insert: PendingInsert, result: Any = None, exception: Optional[BaseException] = None) -> None:
+        if exception is None:
+            self.rows_written += len(insert.rows)
+            self.requests_written += 1
+        if insert.future.done():
+            return
+        if exception is not None:
+            insert.future.set_exception(exception)
+        else:
+            insert.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "max_rows": self.max_rows,
+            "queued_requests": len(self._queue),
+            "batches": self.batches,
+            "requests_written": self.requests_written,
+            "rows_written": self.rows_written,
+            "largest_batch_rows": self.largest_batch_rows,
+            "isolated_failures": self.isolated_failures,
+        }
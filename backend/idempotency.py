@@ -0,0 +1,302 @@
+"""
+Idempotency keys for POST /messages.
+
+A client retrying a request it got no answer to (say, after a timeout)
+sends the same ``Idempotency-Key`` header again, and gets the response of
+the first request instead of storing its message twice.
+
+- The first request with a key claims it by inserting an
+  ``idempotency_key`` row in the same transaction as its message, and the
+  response is filled in once the bot reply is stored. Keys expire after
+  ``ttl`` seconds and are purged periodically.
+- Finished responses are also kept in an in-process LRU cache, so most
+  replays are answered without a query.
+- A duplicate arriving while the first request is still running waits for
+  it rather than racing it: on the first request's future when both are
+  in the same worker, otherwise by polling the row. It holds no database
+  connection meanwhile. After ``wait`` seconds it gives up with
+  ``IdempotencyInProgress``.
+- A claim still without a response ``abandon_after`` seconds after it was
+  made belongs to a request that died (its worker crashed, say); the next
+  request with the key takes it over rather than waiting for it.
+- Reusing a key for a different request raises ``IdempotencyKeyReused``.
+
+If the first request fails, its key is released and the next request with
+it runs as if it were the first.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import and_, delete, null, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from cache import TTLCache
+from models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+# Backoff while polling for a response being produced by another worker
+POLL_INITIAL_SECONDS = 0.05
+POLL_MAX_SECONDS = 1.0
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class IdempotencyInProgress(Exception):
+    """The request that claimed the key did not finish within the wait"""
+
+
+def fingerprint(body: str) -> str:
+    """The hash stored with a key, to recognize a retry of the same request"""
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class _InFlight(NamedTuple):
+    request_hash: str
+    # Resolves to the response, or to None if the key is released
+    done: "asyncio.Future[Optional[Dict[str, Any]]]"
+
+
+class IdempotencyStore:
+    """Claims keys, stores their responses and answers retries"""
+
+    def __init__(self, engine: AsyncEngine, ttl: float, cache_size: int, wait: float, abandon_after: float):
+        self.engine = engine
+        self.ttl = ttl
+        self.wait = wait
+        self.abandon_after = abandon_after
+        # (user id, key) -> (request hash, response)
+        self.responses = TTLCache(cache_size, ttl)
+        self._in_flight: Dict[Tuple[int, str], _InFlight] = {}
+        # Background writes of responses and releases
+        self._tasks: Set[asyncio.Task] = set()
+        self.claims = 0
+        self.replays = 0
+        self.waits = 0
+        self.released = 0
+
+    async def begin(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        key: str,
+        request_hash: str,
+        before_wait: Optional[Callable[[], None]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Claim ``key`` for this request, or return the response of the request that did.
+
+        None means this request claimed the key: the claim is part of
+        ``session``'s transaction, and once that commits the caller must
+        ``complete`` or ``release`` it. Otherwise the stored response is
+        returned, after waiting for it if it is still being produced
+        (``session``'s transaction is rolled back and ``before_wait`` is
+        called first, so that the wait holds no connection).
+        """
+        identity = (user_id, key)
+        deadline = time.monotonic() + self.wait
+        while True:
+            found, stored = self.responses.lookup(identity)
+            if found:
+                return self._replay(stored, request_hash)
+
+            in_flight = self._in_flight.get(identity)
+            if in_flight is not None:
+                self._check(in_flight.request_hash, request_hash)
+                await self._start_waiting(session, before_wait)
+                try:
+                    response = await asyncio.wait_for(
+                        asyncio.shield(in_flight.done), max(0.0, deadline - time.monotonic())
+                    )
+                except asyncio.TimeoutError:
+                    raise IdempotencyInProgress()
+                if response is not None:
+                    return self._replay((in_flight.request_hash, response), request_hash)
+                # Released: try to claim it
+                continue
+
+            now = datetime.utcnow()
+            claim = pg_insert(IdempotencyKey).values(
+                user_id=user_id,
+                key=key,
+                request_hash=request_hash,
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl),
+            )
+            claim = claim.on_conflict_do_update(
+                index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+                # Only an expired key that was not purged yet, or an abandoned
+                # claim, is taken over
+                set_={
+                    "request_hash": claim.excluded.request_hash,
+                    "response": null(),
+                    "created_at": claim.excluded.created_at,
+                    "expires_at": claim.excluded.expires_at,
+                },
+                where=or_(
+                    IdempotencyKey.expires_at <= now,
+                    and_(
+                        IdempotencyKey.response.is_(None),
+                        IdempotencyKey.created_at <= now - timedelta(seconds=self.abandon_after),
+                    ),
+                ),
+            ).returning(IdempotencyKey.user_id)
+            if (await session.execute(claim)).first() is not None:
+                self.claims += 1
+                self._in_flight[identity] = _InFlight(request_hash, asyncio.get_running_loop().create_future())
+                return None
+
+            # Claimed by another worker
+            await self._start_waiting(session, before_wait)
+            response = await self._poll(identity, request_hash, deadline)
+            if response is not None:
+                return response
+
+    def complete(self, user_id: int, key: str, response: Awaitable[Dict[str, Any]]) -> None:
+        """Store the response of a claimed key once ``response`` resolves.
+
+        Runs in the background, so the response is stored even if the client
+        has gone away; if ``response`` fails, the key is released.
+        """
+        self._spawn(self._complete((user_id, key), response))
+
+    def release(self, user_id: int, key: str) -> None:
+        """Give up a claim after the request failed, so that a retry runs it again"""
+        in_flight = self._in_flight.pop((user_id, key), None)
+        if in_flight is None:
+            return
+        self.released += 1
+        if not in_flight.done.done():
+            in_flight.done.set_result(None)
+        self._spawn(self._delete(user_id, key))
+
+    async def stop(self) -> None:
+        """Wait for responses still being stored"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def purge_expired(self) -> int:
+        """Delete expired keys; returns how many"""
+        async with AsyncSession(self.engine) as session:
+            result = await session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow())
+            )
+            await session.commit()
+        return result.rowcount
+
+    async def run_purge(self, interval: float) -> None:
+        """Purge expired keys every ``interval`` seconds, until cancelled"""
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("Purged %d expired idempotency keys", purged)
+            except Exception:
+                logger.exception("Could not purge expired idempotency keys")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "claims": self.claims,
+            "replays": self.replays,
+            "waits": self.waits,
+            "released": self.released,
+            "in_flight": len(self._in_flight),
+            "cache": self.responses.stats(),
+        }
+
+    def _replay(self, stored: Tuple[str, Dict[str, Any]], request_hash: str) -> Dict[str, Any]:
+        stored_hash, response = stored
+        self._check(stored_hash, request_hash)
+        self.replays += 1
+        return response
+
+    @staticmethod
+    def _check(stored_hash: str, request_hash: str) -> None:
+        if stored_hash != request_hash:
+            raise IdempotencyKeyReused()
+
+    async def _start_waiting(self, session: AsyncSession, before_wait: Optional[Callable[[], None]]) -> None:
+        self.waits += 1
+        # End the transaction, which returns the connection to the pool
+        await session.rollback()
+        if before_wait is not None:
+            before_wait()
+
+    async def _poll(self, identity: Tuple[int, str], request_hash: str, deadline: float) -> Optional[Dict[str, Any]]:
+        """Wait for the response of a key claimed elsewhere; None once the key is released, expired or abandoned"""
+        user_id, key = identity
+        interval = POLL_INITIAL_SECONDS
+        while True:
+            async with AsyncSession(self.engine) as session:
+                row = (await session.execute(
+                    select(
+                        IdempotencyKey.request_hash,
+                        IdempotencyKey.response,
+                        IdempotencyKey.created_at,
+                        IdempotencyKey.expires_at,
+                    )
+                    .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                )).first()
+            now = datetime.utcnow()
+            if row is None or row.expires_at <= now:
+                return None
+            self._check(row.request_hash, request_hash)
+            if row.response is None and row.created_at <= now - timedelta(seconds=self.abandon_after):
+                return None
+            if row.response is not None:
+                remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+                self.responses.set(identity, (row.request_hash, row.response), ttl=remaining)
+                return self._replay((row.request_hash, row.response), request_hash)
+            if time.monotonic() + interval > deadline:
+                raise IdempotencyInProgress()
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, POLL_MAX_SECONDS)
+
+    async def _complete(self, identity: Tuple[int, str], response: Awaitable[Dict[str, Any]]) -> None:
+        user_id, key = identity
+        try:
+            body = await response
+            async with AsyncSession(self.engine) as session:
+                await session.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                    .values(response=body)
+                )
+                await session.commit()
+        except Exception:
+            logger.exception("Could not store the response of idempotency key %r", key)
+            self.release(user_id, key)
+            return
+
+        in_flight = self._in_flight.pop(identity, None)
+        if in_flight is not None:
+            self.responses.set(identity, (in_flight.request_hash, body))
+            if not in_flight.done.done():
+                in_flight.done.set_result(body)
+
+    async def _delete(self, user_id: int, key: str) -> None:
+        try:
+            async with AsyncSession(self.engine) as session:
+                await session.execute(
+                    delete(IdempotencyKey).where(
+                        IdempotencyKey.user_id == user_id,
+                        IdempotencyKey.key == key,
+                        IdempotencyKey.response.is_(None),
+                    )
+                )
+                await session.commit()
+        except Exception:
+            # The key stays claimed until it expires
+            logger.exception("Could not release idempotency key %r", key)
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -1,46 +1,411 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy import select
-from seed import seed_user_if_needed
 from sqlalchemy.ext.asyncio import AsyncSession
-from db_engine import engine
-from models import User, Thread, Message
-from datetime import datetime
-import random
+from db_engine import engine, pool_status, router
+from bootstrap import initialize_database
+from auth_cache import auth_cache, CachedUser
+from cache import TTLCache
+from chat_socket import CLOSE_POLICY_VIOLATION, CLOSE_TRY_AGAIN_LATER, ChatSocket
+from export import EXPORT_FORMATS, export_chunks, stream_thread_rows
+from group_commit import GroupCommitWriter
+from idempotency import IdempotencyInProgress, IdempotencyKeyReused, IdempotencyStore, fingerprint
+from pagination import INT_MAX, encode_cursor, decode_cursor
+from queries import (
+    get_or_create_thread_id,
+    get_thread_version,
+    insert_messages,
+    insert_thread,
+    search_messages_query,
+    select_messages_since,
+    select_thread_page,
+    select_user_by_api_key,
+    select_user_threads,
+    select_users_page,
+    thread_belongs_to,
+)
+from pubsub import Event, Hub, SubscriptionClosed, create_backend
+from metrics import Metrics, MetricsMiddleware, instrument_engine
+from partitions import maintain_partitions
+from ratelimit import AdmissionControl, AdmissionRejected, AdmissionSlot, Decision, RateLimit, RateLimiter, create_bucket_store
+from responder import ResponderBusy, ResponderPool, create_responder
+from serialization import FastJSONResponse, message_rows_to_dicts
+from warmup import DRAINING, READY, WARMING, readiness, warm_up_engine
+import settings
+from models import IDEMPOTENCY_KEY_MAX_LENGTH, USERS_CHANNEL, User, Message
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import math
 import asyncio
-from typing import List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+async def load_message_events(channel: str, events: List[Event]) -> List[Event]:
+    """Re-read message events whose payload was too big to travel through NOTIFY"""
+    async with AsyncSession(engine) as session:
+        result = await session.execute(
+            select(Message).where(Message.id.in_([event.id for event in events])).order_by(Message.id)
+        )
+        return [message_event(msg) for msg in result.scalars().all()]
+
+
+# Real-time message fan-out to the SSE streams of this worker
+hub = Hub(queue_size=settings.SSE_QUEUE_SIZE)
+event_backend = create_backend(
+    settings.PUBSUB_BACKEND,
+    hub,
+    dsn=engine.url.set(drivername="postgresql").render_as_string(hide_password=False),
+    loader=load_message_events,
+)
+
+
+# Pages of the public user list, keyed by (prefix, cursor, limit)
+user_pages = TTLCache(maxsize=settings.USERS_CACHE_MAX_ENTRIES, ttl=settings.USERS_CACHE_TTL_SECONDS)
+
+
+async def drop_user_pages_on_change() -> None:
+    """Clear the cached user list whenever the user table changes, until cancelled.
+
+    The change notifications come from a trigger on the user table, so only
+    the postgres pub/sub backend delivers them; otherwise pages expire on
+    their TTL.
+    """
+    while True:
+        subscription = hub.subscribe(USERS_CHANNEL)
+        try:
+            while True:
+                if await subscription.get(timeout=3600) is not None:
+                    user_pages.clear()
+        except SubscriptionClosed:
+            # Dropped as a slow consumer: anything may have changed meanwhile
+            user_pages.clear()
+        finally:
+            hub.unsubscribe(subscription)
+
+
+# Shares commits between the messages stored by concurrent requests
+message_writer = (
+    GroupCommitWriter(
+        engine, window=settings.GROUP_COMMIT_WINDOW_MS / 1000, max_rows=settings.GROUP_COMMIT_MAX_ROWS
+    )
+    if settings.MESSAGE_GROUP_COMMIT
+    else None
+)
+
+
+async def commit_messages(
+    thread_id: int, rows: List[Tuple[str, bool, datetime]], session: Optional[AsyncSession] = None
+) -> List:
+    """Insert and commit messages, returning the rows in order.
+
+    Goes through the group-commit writer when it is enabled; otherwise uses
+    ``session`` (committing whatever else it holds) or a session of its own.
+    """
+    if message_writer is not None:
+        if session is not None:
+            # Give back the request's connection while waiting for the batch
+            await session.commit()
+        return await message_writer.insert(thread_id, rows)
+    if session is not None:
+        inserted = await insert_messages(session, thread_id, rows)
+        await session.commit()
+        return inserted
+    async with AsyncSession(engine) as own_session:
+        inserted = await insert_messages(own_session, thread_id, rows)
+        await own_session.commit()
+    return inserted
+
+
+# Responses of POST /messages requests sent with an Idempotency-Key
+idempotency = IdempotencyStore(
+    engine,
+    ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+    cache_size=settings.IDEMPOTENCY_CACHE_MAX_ENTRIES,
+    wait=settings.IDEMPOTENCY_WAIT_SECONDS,
+    # Longer than any live request takes to store its response
+    abandon_after=settings.IDEMPOTENCY_WAIT_SECONDS + settings.RESPONDER_TIMEOUT_SECONDS,
+)
+
+
+# Bot replies are generated on a bounded pool of workers, outside any transaction
+responder_pool = ResponderPool(
+    create_responder(
+        settings.RESPONDER_BACKEND,
+        first_token_delay=settings.RESPONDER_FIRST_TOKEN_MS / 1000,
+        token_delay=settings.RESPONDER_TOKEN_MS / 1000,
+    ),
+    workers=settings.RESPONDER_WORKERS,
+    queue_size=settings.RESPONDER_QUEUE_SIZE,
+    timeout=settings.RESPONDER_TIMEOUT_SECONDS,
+)
+
+
+# Per-API-key request budgets, and a cap on requests doing database work at once
+rate_limiter = (
+    RateLimiter(
+        create_bucket_store(settings.RATE_LIMIT_BACKEND, url=settings.REDIS_URL),
+        read=RateLimit(settings.RATE_LIMIT_READ_BURST, settings.RATE_LIMIT_READ_PER_SECOND),
+        write=RateLimit(settings.RATE_LIMIT_WRITE_BURST, settings.RATE_LIMIT_WRITE_PER_SECOND),
+    )
+    if settings.RATE_LIMIT_ENABLED
+    else None
+)
+admission = AdmissionControl(settings.ADMISSION_MAX_IN_FLIGHT, settings.ADMISSION_WAIT_SECONDS)
 
-seed_user_if_needed()
 
-app = FastAPI()
+async def run_hot_queries(session: AsyncSession) -> None:
+    """Run the statements of the busiest endpoints once, with parameters that match nothing.
+
+    Executing them compiles them into the engine's statement cache and
+    prepares them on the session's connection. The message insert inserts
+    nothing, and the caller rolls back anyway.
+    """
+    await session.execute(select_user_by_api_key(""))
+    await get_thread_version(session, 0)
+    await get_thread_version(session, 0, 0)
+    await select_thread_page(session, 0, 2, recent_window=RECENT_WINDOW)
+    await select_thread_page(session, 0, 2, before=(datetime.utcnow(), 0), recent_window=RECENT_WINDOW)
+    await session.execute(select_messages_since(0, 0, 1))
+    await session.execute(select_user_threads(0, 1))
+    await session.execute(select_users_page(1))
+    await insert_messages(session, 0, [])
+
+
+async def warm_up() -> None:
+    """Warm the connection pools of the primary and the replicas before the worker serves"""
+    readiness.set(WARMING)
+    if settings.WARMUP_CONNECTIONS > 0:
+        engines = {"primary": engine}
+        for index, replica in enumerate(router.replicas):
+            engines[f"replica_{index}"] = replica.engine
+        for name, warmed in engines.items():
+            try:
+                readiness.warmup[name] = await warm_up_engine(warmed, settings.WARMUP_CONNECTIONS, run_hot_queries)
+            except Exception as exc:
+                # A cold pool is no reason not to serve
+                logger.exception("Could not warm up the %s connection pool", name)
+                readiness.warmup[name] = {"error": str(exc)}
+    readiness.set(READY)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.DB_INIT_ON_STARTUP:
+        await initialize_database(engine)
+    await router.start(settings.REPLICA_HEALTH_CHECK_SECONDS)
+    await event_backend.start()
+    if message_writer is not None:
+        await message_writer.start()
+    await responder_pool.start()
+    user_pages_invalidation = asyncio.ensure_future(drop_user_pages_on_change())
+    idempotency_purge = asyncio.ensure_future(idempotency.run_purge(settings.IDEMPOTENCY_PURGE_SECONDS))
+    partition_maintenance = None
+    if settings.MESSAGE_PARTITIONING:
+        partition_maintenance = asyncio.ensure_future(maintain_partitions(
+            engine, settings.MESSAGE_PARTITION_MONTHS_AHEAD, settings.MESSAGE_PARTITION_CHECK_SECONDS
+        ))
+    await warm_up()
+    try:
+        yield
+    finally:
+        readiness.set(DRAINING)
+        user_pages_invalidation.cancel()
+        idempotency_purge.cancel()
+        if partition_maintenance is not None:
+            partition_maintenance.cancel()
+        await responder_pool.stop()
+        # Store the responses of the last replies
+        await idempotency.stop()
+        if message_writer is not None:
+            # After the responder pool: its last replies are written through it
+            await message_writer.stop()
+        await event_backend.stop()
+        await router.stop()
+        if rate_limiter is not None:
+            await rate_limiter.store.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def admit() -> AdmissionSlot:
+    """An admission slot for database work; 503 when none frees up in time"""
+    try:
+        return await admission.acquire()
+    except AdmissionRejected:
+        raise HTTPException(
+            status_code=503,
+            detail="The server is busy. Please try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def get_session(request: Request):
+    """Request-scoped session.
+
+    FastAPI caches dependencies per request, so every dependency and the
+    handler share this session and the request checks out at most one
+    connection (none if nothing touches the database).
+
+    GET requests are read-only and get a session on a read replica (see
+    ``EngineRouter``); anything else is bound to the primary and starts the
+    caller's read-your-writes window, renewed once the request is done.
+
+    The request holds an admission slot while it has the session, or until
+    it calls ``release_admission``; 503 when none frees up in time.
+    """
+    slot = await admit()
+    request.state.admission_slot = slot
+    
+    api_key = request.headers.get("X-API-Key")
+    try:
+        if request.method in ("GET", "HEAD"):
+            async with AsyncSession(router.reader(api_key)) as session:
+                yield session
+            return
+        
+        router.record_write(api_key)
+        async with AsyncSession(router.writer()) as session:
+            yield session
+        router.record_write(api_key)
+    finally:
+        slot.release()
+
+
+def release_admission(request: Request) -> None:
+    """Give back the request's admission slot once it is done with the database"""
+    slot = getattr(request.state, "admission_slot", None)
+    if slot is not None:
+        slot.release()
+
+
+async def check_rate_limit(user_id: int, write: bool, cost: float = 1.0) -> Decision:
+    """Take ``cost`` tokens from the user's read or write budget"""
+    if rate_limiter is None:
+        return Decision(True, 0.0, 0.0)
+    # Keyed by user id rather than the API key, which would then be stored in the bucket store
+    return await rate_limiter.check(f"user:{user_id}", write=write, cost=cost)
+
+
+async def enforce_rate_limit(request: Request, user_id: int, cost: float = 1.0) -> None:
+    """Take ``cost`` tokens from the user's read or write budget, raising 429 when it is spent"""
+    decision = await check_rate_limit(user_id, write=request.method not in ("GET", "HEAD"), cost=cost)
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please slow down.",
+            headers={"Retry-After": str(max(1, math.ceil(decision.retry_after)))},
+        )
+
+
+async def authenticate(session: AsyncSession, api_key: str) -> CachedUser:
+    """Resolve an API key to the cached user snapshot, raising 401 if it is unknown"""
+    found, cached = auth_cache.lookup(api_key)
+    
+    if not found:
+        # Find the user by API key, and their default thread, in one query
+        result = await session.execute(select_user_by_api_key(api_key))
+        row = result.one_or_none()
+        
+        cached = CachedUser(*row) if row is not None else None
+        auth_cache.store(api_key, cached)
+    
+    if cached is None:
+        raise HTTPException(
+            status_code=401, 
+            detail="Invalid API key. Please provide a valid X-API-Key header."
+        )
+    return cached
+
+
+async def resolve_thread_id(session: AsyncSession, api_key: str, cached: CachedUser) -> int:
+    """The id of the user's default thread, creating the thread on first use"""
+    if cached.thread_id is not None:
+        return cached.thread_id
+    if session.bind is router.writer():
+        thread_id = await get_or_create_thread_id(session, cached.id)
+    else:
+        # A read-only request on a replica: create the thread on the primary
+        async with AsyncSession(router.writer()) as write_session:
+            thread_id = await get_or_create_thread_id(write_session, cached.id)
+        router.record_write(api_key)
+    auth_cache.store(api_key, cached._replace(thread_id=thread_id))
+    return thread_id
+
+
+def detached_user(cached: CachedUser) -> User:
+    # Hand out a detached User built from the cached snapshot
+    return User(id=cached.id, name=cached.name, api_key=cached.api_key)
+
+
+class UserThread(NamedTuple):
+    user: User
+    # The user's default thread, unless the request named another of theirs
+    thread_id: int
+
+
+async def owned_thread_id(session: AsyncSession, current: UserThread, thread_id: Optional[int]) -> int:
+    """The thread a request targets: ``thread_id`` if given and owned by the user, else the default"""
+    if thread_id is None or thread_id == current.thread_id:
+        return current.thread_id
+    if not await thread_belongs_to(session, thread_id, current.user.id):
+        # Someone else's thread looks the same as a missing one
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return thread_id
 
 
 # Authentication dependency
 async def get_current_user(
-    x_api_key: str = Header(alias="X-API-Key", description="API key for user authentication")
+    request: Request,
+    x_api_key: str = Header(alias="X-API-Key", description="API key for user authentication"),
+    session: AsyncSession = Depends(get_session),
 ) -> User:
-    async with AsyncSession(engine) as session:
-        async with session.begin():
-            # Find user by API key
-            result = await session.execute(
-                select(User).where(User.api_key == x_api_key)
-            )
-            user = result.scalar_one_or_none()
-            
-            if user is None:
-                raise HTTPException(
-                    status_code=401, 
-                    detail="Invalid API key. Please provide a valid X-API-Key header."
-                )
-            
-            # Capture user data before session closes
-            user_id = user.id
-            user_name = user.name
-            user_api_key = user.api_key
-            
-            # Create a new User object with the captured data
-            return User(id=user_id, name=user_name, api_key=user_api_key)
+    cached = await authenticate(session, x_api_key)
+    await enforce_rate_limit(request, cached.id)
+    return detached_user(cached)
+
+
+# Authentication dependency that also resolves the user's thread
+async def get_current_user_thread(
+    request: Request,
+    x_api_key: str = Header(alias="X-API-Key", description="API key for user authentication"),
+    session: AsyncSession = Depends(get_session),
+) -> UserThread:
+    cached = await authenticate(session, x_api_key)
+    await enforce_rate_limit(request, cached.id)
+    return UserThread(detached_user(cached), await resolve_thread_id(session, x_api_key, cached))
+
+
+# Authentication dependency for clients that cannot set headers (EventSource,
+# download links).
+# Uses its own short-lived session: the request-scoped one would stay open
+# for as long as the stream.
+async def get_stream_user_thread(
+    request: Request,
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key", description="API key for user authentication"),
+    api_key: Optional[str] = Query(None, description="API key, for clients that cannot set the X-API-Key header"),
+    thread_id: Optional[int] = Query(
+        None, ge=1, le=INT_MAX, description="Thread to stream; the user's default thread if omitted"
+    ),
+) -> UserThread:
+    if not (x_api_key or api_key):
+        raise HTTPException(
+            status_code=401,
+            detail="Missing API key. Provide an X-API-Key header or an api_key query parameter."
+        )
+    key = x_api_key or api_key
+    async with AsyncSession(router.reader(key)) as session:
+        cached = await authenticate(session, key)
+        await enforce_rate_limit(request, cached.id)
+        current = UserThread(detached_user(cached), await resolve_thread_id(session, key, cached))
+        return current._replace(thread_id=await owned_thread_id(session, current, thread_id))
 
 # Add CORS middleware
 app.add_middleware(
@@ -49,8 +414,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read the thread version for conditional requests, the
+    # cursor of the next page of users, and whether a response was replayed
+    expose_headers=["ETag", "X-Next-Cursor", "Idempotent-Replayed"],
 )
 
+# Per-route request and query metrics; added last so it also times CORS handling
+metrics = Metrics(query_budget=settings.DB_QUERY_BUDGET)
+if settings.METRICS_ENABLED:
+    for instrumented in [engine] + [replica.engine for replica in router.replicas]:
+        instrument_engine(instrumented.sync_engine, metrics)
+    for key in ("checked_out", "idle", "overflow"):
+        metrics.add_gauge(
+            f"db_pool_{key}", f"Connection pool {key.replace('_', ' ')} connections.",
+            lambda key=key: pool_status(engine)[key],
+        )
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 
 class UserRead(BaseModel):
     id: int
@@ -66,11 +446,127 @@ class MessageRead(BaseModel):
 
 class MessageCreate(BaseModel):
     content: str
+    # One of the user's threads; their default thread if omitted
+    thread_id: Optional[int] = Field(None, ge=1, le=INT_MAX)
+
+
+class MessageBatchItem(BaseModel):
+    content: str
+    # When the message was written, e.g. while the client was offline; now if omitted
+    created_at: Optional[datetime] = None
+
+
+class MessageBatchCreate(BaseModel):
+    messages: List[MessageBatchItem] = Field(min_length=1, max_length=settings.MESSAGE_BATCH_MAX)
+    # Also store a bot reply right after each message
+    generate_replies: bool = False
+    # One of the user's threads; their default thread if omitted
+    thread_id: Optional[int] = Field(None, ge=1, le=INT_MAX)
+
+
+class MessageBatchRead(BaseModel):
+    # Ids of the submitted messages, in submission order
+    ids: List[int]
+    # The bot replies, one per submitted message, when requested
+    replies: List[MessageRead]
 
 
 class ThreadRead(BaseModel):
     id: int
     messages: List[MessageRead]
+    # Pass as `before` to fetch the next (older) page; None on the oldest page
+    next_cursor: Optional[str] = None
+
+
+class ThreadCreate(BaseModel):
+    title: Optional[str] = Field(None, max_length=100)
+
+
+class ThreadSummary(BaseModel):
+    id: int
+    title: Optional[str]
+    is_default: bool
+    message_count: int
+    # Time of the newest message; the creation time while the thread is empty
+    last_message_at: datetime
+    # Start of the newest message's content
+    last_message_preview: Optional[str]
+    created_at: datetime
+
+
+class ThreadList(BaseModel):
+    threads: List[ThreadSummary]
+    # Pass as `before` to fetch the next (less recently active) page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class MessageSearchHit(MessageRead):
+    thread_id: int
+    rank: float
+    # HTML excerpt of the content: the content is HTML-escaped and matched
+    # terms are wrapped in <mark>...</mark>
+    highlight: str
+
+
+class MessageSearchPage(BaseModel):
+    results: List[MessageSearchHit]
+    # Pass as `after` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+def message_event(msg) -> Event:
+    """Build the real-time event announcing a stored message"""
+    data = MessageRead(
+        id=msg.id,
+        content=msg.content,
+        is_from_user=msg.is_from_user,
+        created_at=msg.created_at
+    ).model_dump(mode="json")
+    return Event(id=msg.id, type="message", data=data)
+
+
+# History pages are read from the last weeks first when messages are partitioned
+RECENT_WINDOW = (
+    timedelta(days=settings.THREAD_RECENT_WINDOW_DAYS)
+    if settings.MESSAGE_PARTITIONING and settings.THREAD_RECENT_WINDOW_DAYS > 0
+    else None
+)
+
+
+def thread_etag(thread_id: int, message_count: int, last_message_at: datetime) -> str:
+    # Weak: identifies the thread's content, not the bytes of one page of it
+    return f'W/"{thread_id}-{message_count}-{last_message_at:%Y%m%d%H%M%S%f}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+    
+    return any(opaque(tag) == opaque(etag) for tag in if_none_match.split(","))
+
+
+def thread_channel(thread_id: int) -> str:
+    return f"thread:{thread_id}"
+
+
+async def publish_messages(thread_id: int, messages: List[MessageRead]) -> None:
+    """Announce committed messages to every stream on the thread, in any worker"""
+    try:
+        await event_backend.publish(thread_channel(thread_id), [message_event(msg) for msg in messages])
+    except Exception:
+        # The messages are committed; streams that miss the event catch up on resume
+        logger.exception("Failed to publish messages for thread %s", thread_id)
+
+
+def format_sse(event: Event) -> str:
+    return f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
 
 
 @app.get("/users/me")
@@ -78,135 +574,851 @@ async def get_my_user(current_user: User = Depends(get_current_user)):
     return UserRead(id=current_user.id, name=current_user.name)
 
 
-@app.get("/threads/me")
-async def get_my_thread(current_user: User = Depends(get_current_user)):
-    async with AsyncSession(engine) as session:
-        # Get or create thread for the user
-        thread_result = await session.execute(
-            select(Thread).where(Thread.user_id == current_user.id)
-        )
-        thread = thread_result.scalars().first()
-        
-        if thread is None:
-            thread = Thread(user_id=current_user.id)
-            session.add(thread)
-            await session.commit()
-        
-        # Get messages for the thread
-        messages_result = await session.execute(
-            select(Message).where(Message.thread_id == thread.id).order_by(Message.created_at)
+@app.get("/threads", response_model=ThreadList)
+async def list_threads(
+    limit: int = Query(
+        settings.THREAD_LIST_DEFAULT_LIMIT,
+        ge=1,
+        le=settings.THREAD_LIST_MAX_LIMIT,
+        description="Maximum number of threads to return",
+    ),
+    before: Optional[str] = Query(
+        None, description="Cursor from a previous page's next_cursor; returns less recently active threads"
+    ),
+    current: UserThread = Depends(get_current_user_thread),
+    session: AsyncSession = Depends(get_session),
+):
+    """The user's threads with their summaries, most recently active first"""
+    before_key = None
+    if before is not None:
+        try:
+            before_key = decode_cursor(before, datetime, int)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # Summaries are stored on the thread rows: no message is read
+    result = await session.execute(select_user_threads(current.user.id, limit + 1, before_key))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return ThreadList(
+        threads=[ThreadSummary(**row._mapping) for row in rows],
+        next_cursor=encode_cursor(rows[-1].last_message_at, rows[-1].id) if has_more else None,
+    )
+
+
+@app.post("/threads", response_model=ThreadSummary, status_code=201)
+async def create_thread(
+    thread: ThreadCreate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """Start a new thread for the user"""
+    title = thread.title.strip() if thread.title else None
+    row = (await session.execute(insert_thread(current_user.id, title or None))).one()
+    await session.commit()
+    return ThreadSummary(**row._mapping)
+
+
+async def read_thread(
+    session: AsyncSession,
+    thread_id: int,
+    version: Tuple[int, datetime],
+    limit: int,
+    before: Optional[str],
+    since_id: Optional[int],
+    if_none_match: Optional[str],
+):
+    """One page of a thread's messages, or 304 when the client's ETag is current"""
+    if before is not None and since_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before or since_id, not both")
+    if before is not None:
+        try:
+            before_created_at, before_id = decode_cursor(before, datetime, int)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    message_count, last_message_at = version
+    etag = thread_etag(thread_id, message_count, last_message_at)
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    # Messages are read as (id, content, is_from_user, created_at) tuples
+    # and encoded directly, without ORM objects or per-message models
+    if since_id is not None:
+        # Delta sync: the oldest `limit` messages after since_id. A full
+        # page means there may be more; ask again from its last id.
+        messages_result = await session.execute(select_messages_since(thread_id, since_id, limit))
+        rows = messages_result.all()
+        has_older = False
+    else:
+        # Get the newest page of messages older than the cursor, newest first,
+        # fetching one extra row to learn whether an older page exists
+        rows = await select_thread_page(
+            session,
+            thread_id,
+            limit + 1,
+            before=(before_created_at, before_id) if before is not None else None,
+            recent_window=RECENT_WINDOW,
+            thread_size=message_count,
         )
-        messages = messages_result.scalars().all()
         
-        return ThreadRead(
-            id=thread.id,
-            messages=[MessageRead(
-                id=msg.id,
-                content=msg.content,
-                is_from_user=msg.is_from_user,
-                created_at=msg.created_at
-            ) for msg in messages]
-        )
+        has_older = len(rows) > limit
+        rows = rows[:limit][::-1]
+    
+    return FastJSONResponse(
+        {
+            "id": thread_id,
+            "messages": message_rows_to_dicts(rows),
+            "next_cursor": encode_cursor(rows[0].created_at, rows[0].id) if has_older else None,
+        },
+        headers={"ETag": etag},
+    )
+
+
+@app.get("/threads/me", response_model=ThreadRead)
+async def get_my_thread(
+    limit: int = Query(
+        settings.THREAD_PAGE_DEFAULT_LIMIT,
+        ge=1,
+        le=settings.THREAD_PAGE_MAX_LIMIT,
+        description="Maximum number of messages to return",
+    ),
+    before: Optional[str] = Query(
+        None, description="Cursor from a previous page's next_cursor; returns older messages"
+    ),
+    since_id: Optional[int] = Query(
+        None, ge=0, le=INT_MAX, description="Return only messages newer than this id, oldest first"
+    ),
+    if_none_match: Optional[str] = Header(
+        None, alias="If-None-Match", description="ETag of a previous response; 304 if the thread is unchanged"
+    ),
+    current: UserThread = Depends(get_current_user_thread),
+    session: AsyncSession = Depends(get_session),
+):
+    """The user's default thread"""
+    # Version the thread before loading anything
+    version = await get_thread_version(session, current.thread_id)
+    if version is None and session.bind is not router.writer():
+        # The thread was just created on the primary and this replica has
+        # not replayed it yet: read it from the primary
+        async with AsyncSession(router.writer()) as primary_session:
+            version = await get_thread_version(primary_session, current.thread_id)
+            if version is not None:
+                return await read_thread(
+                    primary_session, current.thread_id, version, limit, before, since_id, if_none_match
+                )
+    if version is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return await read_thread(session, current.thread_id, version, limit, before, since_id, if_none_match)
+
+
+@app.get("/threads/{thread_id}", response_model=ThreadRead)
+async def get_thread(
+    thread_id: int = Path(ge=1, le=INT_MAX),
+    limit: int = Query(
+        settings.THREAD_PAGE_DEFAULT_LIMIT,
+        ge=1,
+        le=settings.THREAD_PAGE_MAX_LIMIT,
+        description="Maximum number of messages to return",
+    ),
+    before: Optional[str] = Query(
+        None, description="Cursor from a previous page's next_cursor; returns older messages"
+    ),
+    since_id: Optional[int] = Query(
+        None, ge=0, le=INT_MAX, description="Return only messages newer than this id, oldest first"
+    ),
+    if_none_match: Optional[str] = Header(
+        None, alias="If-None-Match", description="ETag of a previous response; 304 if the thread is unchanged"
+    ),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """One of the user's threads"""
+    # Versioning the thread also checks that it is the user's
+    version = await get_thread_version(session, thread_id, current_user.id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return await read_thread(session, thread_id, version, limit, before, since_id, if_none_match)
+
+
+@app.get("/threads/me/export")
+async def export_my_thread(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson (one JSON message per line) or csv"),
+    gzip: bool = Query(False, description="Compress the body (Content-Encoding: gzip)"),
+    current: UserThread = Depends(get_stream_user_thread),
+):
+    """Download a whole thread, oldest message first, streamed in constant memory.
+
+    The body opens its own session rather than using the request-scoped one:
+    the server-side cursor has to outlive the handler, and dependency
+    teardown is not guaranteed to wait for a streamed body. The admission
+    slot is taken up front (503 when the server is busy) and held until the
+    body is done.
+    """
+    thread_id = current.thread_id
+    slot = await admit()
+    headers = {"Content-Disposition": f'attachment; filename="thread-{thread_id}.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export_body(current.user.api_key, thread_id, format, settings.EXPORT_GZIP_LEVEL if gzip else -1, slot),
+        media_type=EXPORT_FORMATS[format],
+        headers=headers,
+    )
+
+
+async def export_body(
+    api_key: str, thread_id: int, format: str, gzip_level: int, slot: AdmissionSlot
+) -> AsyncIterator[bytes]:
+    """The export of a thread, read through a session that lives as long as the stream"""
+    try:
+        async with AsyncSession(router.reader(api_key)) as session:
+            batches = stream_thread_rows(session, thread_id, settings.EXPORT_FETCH_ROWS)
+            async for chunk in export_chunks(batches, format, gzip_level):
+                yield chunk
+    finally:
+        slot.release()
+
+
+def message_read_from_row(row) -> MessageRead:
+    return MessageRead(id=row.id, content=row.content, is_from_user=row.is_from_user, created_at=row.created_at)
+
+
+async def store_bot_reply(
+    thread_id: int, content: str, on_stored: Optional[Callable[[int], Any]] = None
+) -> MessageRead:
+    """Persist a finished bot reply in its own short transaction and announce it.
+
+    ``on_stored`` gets the new message id before the announcement goes out.
+    """
+    inserted = await commit_messages(thread_id, [(content, False, datetime.utcnow())])
+    bot_message_read = message_read_from_row(inserted[0])
+    if on_stored is not None:
+        on_stored(bot_message_read.id)
+    await publish_messages(thread_id, [bot_message_read])
+    return bot_message_read
+
+
+async def generate_replies(prompts: List[str]) -> List[str]:
+    """Replies to ``prompts`` from the responder pool, as many at a time as it has workers.
+
+    A failed generation comes back as the fallback reply. Raises
+    ``ResponderBusy`` when the pool has no room; jobs already submitted
+    still finish.
+    """
+    async def keep(reply: str) -> str:
+        return reply
+    
+    replies: List[str] = []
+    for start in range(0, len(prompts), responder_pool.workers):
+        jobs = []
+        for prompt in prompts[start:start + responder_pool.workers]:
+            responder_pool.reserve()
+            jobs.append(responder_pool.submit(prompt, on_complete=keep))
+        replies += await asyncio.gather(*(job.result for job in jobs))
+    return replies
+
+
+def ndjson_line(payload: dict) -> str:
+    return json.dumps(jsonable_encoder(payload)) + "\n"
+
+
+def replayed_message_response(stored: Dict[str, Any], stream: bool) -> Response:
+    """The stored response of an idempotent POST /messages, in the form the retry asked for"""
+    headers = {"Idempotent-Replayed": "true"}
+    if not stream:
+        return FastJSONResponse(stored, headers=headers)
+    body = (
+        ndjson_line({"type": "user_message", "message": stored["user_message"]})
+        + ndjson_line({"type": "bot_message", "message": stored["bot_message"]})
+    )
+    return StreamingResponse(iter([body]), media_type="application/x-ndjson", headers=headers)
 
 
 @app.post("/messages")
-async def create_message(message: MessageCreate, current_user: User = Depends(get_current_user)):
-    async with AsyncSession(engine) as session:
-        # Get or create thread for the user
-        thread_result = await session.execute(
-            select(Thread).where(Thread.user_id == current_user.id)
+async def create_message(
+    request: Request,
+    message: MessageCreate,
+    stream: bool = Query(
+        False, description="Stream the reply as NDJSON events while it is generated"
+    ),
+    idempotency_key: Optional[str] = Header(
+        None,
+        alias="Idempotency-Key",
+        max_length=IDEMPOTENCY_KEY_MAX_LENGTH,
+        description="Unique per message; a retry with the same key gets the first response instead of a duplicate",
+    ),
+    current: UserThread = Depends(get_current_user_thread),
+    session: AsyncSession = Depends(get_session),
+):
+    thread_id = await owned_thread_id(session, current, message.thread_id)
+    user_id = current.user.id
+    
+    if idempotency_key is not None:
+        try:
+            stored = await idempotency.begin(
+                session,
+                user_id,
+                idempotency_key,
+                fingerprint(message.model_dump_json()),
+                # Waiting for the first request does not count against admission
+                before_wait=lambda: release_admission(request),
+            )
+        except IdempotencyKeyReused:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different message")
+        except IdempotencyInProgress:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "1"},
+            )
+        if stored is not None:
+            release_admission(request)
+            return replayed_message_response(stored, stream)
+    
+    # Claim a reply slot before storing anything: when the responder is
+    # saturated, refuse the message rather than store it without a reply
+    try:
+        responder_pool.reserve()
+    except ResponderBusy:
+        if idempotency_key is not None:
+            idempotency.release(user_id, idempotency_key)
+        raise HTTPException(
+            status_code=503,
+            detail="The assistant is busy. Please try again shortly.",
+            headers={"Retry-After": "1"},
         )
-        thread = thread_result.scalars().first()
-        
-        if thread is None:
-            thread = Thread(user_id=current_user.id)
-            session.add(thread)
-            await session.flush()
+    
+    try:
+        # Commit the user's message (and the idempotency key) right away;
+        # committing also returns the connection to the pool before the
+        # reply is generated
+        inserted = await commit_messages(thread_id, [(message.content, True, datetime.utcnow())], session)
+    except BaseException:
+        responder_pool.release()
+        if idempotency_key is not None:
+            idempotency.release(user_id, idempotency_key)
+        raise
+    # Done with the database; generating the reply does not count against admission
+    release_admission(request)
+    
+    user_message_read = message_read_from_row(inserted[0])
+    try:
+        await publish_messages(thread_id, [user_message_read])
+    except BaseException:
+        # Cancelled before the reply was submitted: give back its slot and the key
+        responder_pool.release()
+        if idempotency_key is not None:
+            idempotency.release(user_id, idempotency_key)
+        raise
+    
+    # Nothing below awaits until the reply is submitted and the key completed
+    job = responder_pool.submit(message.content, on_complete=lambda reply: store_bot_reply(thread_id, reply))
+    
+    if idempotency_key is not None:
+        async def response():
+            return jsonable_encoder({"user_message": user_message_read, "bot_message": await asyncio.shield(job.result)})
         
-        # Create user message
-        user_message = Message(
-            thread_id=thread.id,
-            content=message.content,
-            is_from_user=True
+        idempotency.complete(user_id, idempotency_key, response())
+    
+    if not stream:
+        # Shielded: the reply is still stored if this request is cancelled
+        bot_message_read = await asyncio.shield(job.result)
+        return {
+            "user_message": user_message_read,
+            "bot_message": bot_message_read
+        }
+    
+    async def generate():
+        yield ndjson_line({"type": "user_message", "message": user_message_read})
+        async for token in job.tokens():
+            yield ndjson_line({"type": "token", "text": token})
+        try:
+            bot_message_read = await asyncio.shield(job.result)
+        except Exception:
+            yield ndjson_line({"type": "error", "detail": "Failed to store the reply"})
+            return
+        yield ndjson_line({"type": "bot_message", "message": bot_message_read})
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.get("/messages/search", response_model=MessageSearchPage)
+async def search_messages(
+    q: str = Query(
+        min_length=1, max_length=200,
+        description='Search terms; supports "quoted phrases", or, and -excluded words',
+    ),
+    limit: int = Query(
+        settings.SEARCH_PAGE_DEFAULT_LIMIT,
+        ge=1,
+        le=settings.SEARCH_PAGE_MAX_LIMIT,
+        description="Maximum number of results to return",
+    ),
+    after: Optional[str] = Query(
+        None, description="Cursor from a previous page's next_cursor; returns lower-ranked results"
+    ),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """Full-text search over the messages in the caller's threads, best matches first"""
+    after_key = None
+    if after is not None:
+        try:
+            after_key = decode_cursor(after, float, int)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # One extra row tells whether there is a next page
+    result = await session.execute(search_messages_query(current_user.id, q, limit + 1, after_key))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return MessageSearchPage(
+        results=[
+            MessageSearchHit(
+                id=row.id,
+                thread_id=row.thread_id,
+                content=row.content,
+                is_from_user=row.is_from_user,
+                created_at=row.created_at,
+                rank=row.rank,
+                highlight=row.highlight,
+            )
+            for row in rows
+        ],
+        next_cursor=encode_cursor(rows[-1].rank, rows[-1].id) if has_more else None,
+    )
+
+
+def utc_naive(value: Optional[datetime]) -> datetime:
+    """Timestamps are stored as naive UTC; convert aware client timestamps"""
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@app.post("/messages/batch", response_model=MessageBatchRead)
+async def create_messages_batch(
+    request: Request,
+    batch: MessageBatchCreate,
+    current: UserThread = Depends(get_current_user_thread),
+    session: AsyncSession = Depends(get_session),
+):
+    """Store many messages (and optionally their bot replies) in one transaction"""
+    # Authentication took one write token; a batch costs one per message
+    if len(batch.messages) > 1:
+        await enforce_rate_limit(request, current.user.id, cost=len(batch.messages) - 1)
+    latest = datetime.utcnow() + timedelta(seconds=settings.MESSAGE_MAX_CLOCK_SKEW_SECONDS)
+    created_ats = [utc_naive(item.created_at) for item in batch.messages]
+    future = [index for index, created_at in enumerate(created_ats) if created_at > latest]
+    if future:
+        raise HTTPException(
+            status_code=422, detail=f"created_at is in the future for messages at positions {future}"
         )
-        session.add(user_message)
-        await session.flush()
-        
-        # Store the user message ID before creating bot message
-        user_message_id = user_message.id
-        user_message_content = user_message.content
-        user_message_created_at = user_message.created_at
+    thread_id = await owned_thread_id(session, current, batch.thread_id)
+    replies = None
+    if batch.generate_replies:
+        # Give the connection back while the replies are generated
+        await session.commit()
+        try:
+            replies = await generate_replies([item.content for item in batch.messages])
+        except ResponderBusy:
+            raise HTTPException(
+                status_code=503,
+                detail="The assistant is busy. Please try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+    
+    rows = []
+    for index, (item, created_at) in enumerate(zip(batch.messages, created_ats)):
+        rows.append((item.content, True, created_at))
+        if replies is not None:
+            rows.append((replies[index], False, created_at))
+    
+    # One multi-row INSERT; rows come back in the order they were given
+    inserted = await insert_messages(session, thread_id, rows)
+    await session.commit()
+    
+    created = [message_read_from_row(row) for row in inserted]
+    await publish_messages(thread_id, created)
+    
+    return MessageBatchRead(
+        ids=[msg.id for msg in created if msg.is_from_user],
+        replies=[msg for msg in created if not msg.is_from_user],
+    )
+
+
+@app.get("/users")
+async def list_users(
+    limit: int = Query(
+        settings.USERS_PAGE_DEFAULT_LIMIT,
+        ge=1,
+        le=settings.USERS_PAGE_MAX_LIMIT,
+        description="Maximum number of users to return",
+    ),
+    after: Optional[str] = Query(
+        None, description="Cursor from a previous page's X-Next-Cursor header; returns the following users"
+    ),
+    q: Optional[str] = Query(
+        None, max_length=30, description="Only users whose name starts with this, ignoring case"
+    ),
+):
+    """List available users and their API keys, by name (for testing purposes).
+
+    A full page carries the cursor of the next one in the X-Next-Cursor header.
+    """
+    prefix = q.lower() if q else ""
+    key = (prefix, after, limit)
+    found, page = user_pages.lookup(key)
+    if not found:
+        after_key = None
+        if after is not None:
+            try:
+                after_key = decode_cursor(after, str, int)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
         
-        # Generate bot response
-        bot_responses = [
-            "That's interesting! Tell me more about that.",
-            "I understand what you're saying. How can I help you further?",
-            "Thanks for sharing that with me. Is there anything specific you'd like to know?",
-            "I'm here to help! What would you like to discuss?",
-            "That's a great point. Let me think about that for a moment...",
-            "I appreciate you reaching out. How can I assist you today?",
-            "That sounds fascinating! I'd love to hear more details.",
-            "I'm processing what you've said. What's your next question?",
-            "Thank you for the information. How can I be of service?",
-            "I'm listening and ready to help. What's on your mind?"
-        ]
+        async with AsyncSession(router.reader()) as session:
+            result = await session.execute(select_users_page(limit + 1, after_key, prefix))
+            rows = result.all()
         
-        bot_message = Message(
-            thread_id=thread.id,
-            content=random.choice(bot_responses),
-            is_from_user=False
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        page = (
+            [{"id": row.id, "name": row.name, "api_key": row.api_key} for row in rows],
+            encode_cursor(rows[-1].sort_name, rows[-1].id) if has_more else None,
         )
-        session.add(bot_message)
-        await session.flush()
+        user_pages.set(key, page)
+    
+    users, next_cursor = page
+    return FastJSONResponse(users, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+
+@app.get("/debug/users-cache")
+async def user_pages_stats():
+    """Hit/miss counters of the /users page cache (this worker only)"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return user_pages.stats()
+
+
+@app.get("/debug/auth-cache")
+async def auth_cache_stats():
+    """Hit/miss counters of the API-key authentication cache"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return auth_cache.stats()
+
+
+@app.get("/debug/pool")
+async def database_pool_stats():
+    """Connection pool occupancy and checkout wait times"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return pool_status(engine)
+
+
+@app.get("/debug/rate-limit")
+async def rate_limit_stats():
+    """Rate limiter counters and admission control occupancy"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {
+        "rate_limit": rate_limiter.stats() if rate_limiter is not None else None,
+        "admission": admission.stats(),
+    }
+
+
+@app.get("/debug/replicas")
+async def replica_stats():
+    """Read routing counters and the health of each read replica"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return router.stats()
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the worker has warmed up, 503 before that and while it drains"""
+    return FastJSONResponse(readiness.to_dict(), status_code=200 if readiness.is_ready else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request, query and pool metrics in Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/messages/stream")
+async def stream_messages(
+    last_event_id: Optional[int] = Header(
+        None, alias="Last-Event-ID", description="Resume after this message id (sent by EventSource on reconnect)"
+    ),
+    after_id: Optional[int] = Query(
+        None, description="Resume after this message id on the first connection"
+    ),
+    current: UserThread = Depends(get_stream_user_thread),
+):
+    """Stream new messages of one of the user's threads as Server-Sent Events"""
+    thread_id = current.thread_id
+    resume_after = last_event_id if last_event_id is not None else after_id
+    
+    # Subscribe before replaying so nothing committed in between is missed
+    subscription = hub.subscribe(thread_channel(thread_id))
+    
+    async def generate():
+        try:
+            yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+            
+            replayed_ids = set()
+            if resume_after is not None:
+                async with AsyncSession(engine) as session:
+                    result = await session.execute(
+                        select(Message)
+                        .where(Message.thread_id == thread_id, Message.id > resume_after)
+                        .order_by(Message.id)
+                        .limit(settings.SSE_REPLAY_LIMIT + 1)
+                    )
+                    missed = result.scalars().all()
+                
+                if len(missed) > settings.SSE_REPLAY_LIMIT:
+                    # Too far behind to replay; the client reloads the thread instead
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                
+                for msg in missed:
+                    replayed_ids.add(msg.id)
+                    yield format_sse(message_event(msg))
+            
+            while True:
+                try:
+                    event = await subscription.get(timeout=settings.SSE_HEARTBEAT_SECONDS)
+                except SubscriptionClosed:
+                    # Dropped as a slow consumer; the client reconnects with Last-Event-ID
+                    return
+                
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif event.id not in replayed_ids:
+                    yield format_sse(event)
+        finally:
+            hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class ChatSend(NamedTuple):
+    # Client correlation id, echoed on every frame about this message
+    id: Any
+    content: str
+
+
+def error_frame(correlation_id: Any, status: int, detail: str) -> Dict[str, Any]:
+    return {"type": "error", "id": correlation_id, "status": status, "detail": detail}
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(
+    websocket: WebSocket,
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key", description="API key for user authentication"),
+    api_key: Optional[str] = Query(None, description="API key, for clients that cannot set the X-API-Key header"),
+    thread_id: Optional[int] = Query(
+        None, ge=1, le=INT_MAX, description="Thread to chat in; the user's default thread if omitted"
+    ),
+    tokens: bool = Query(True, description="Stream bot replies token by token"),
+):
+    """Chat over one WebSocket: send messages, receive replies and messages from other devices.
+    
+    The user and thread are resolved once, at the handshake. Client frames:
+    ``{"type": "send", "id": <correlation id>, "content": "..."}`` (any
+    number, without waiting for answers), ``ping`` and ``pong``. Server
+    frames: ``ack`` (the stored message), ``token`` and ``reply`` (the bot
+    reply), ``error``, each with the correlation id of its send; ``message``
+    for messages stored by other connections; ``ping`` and ``pong``.
+    """
+    key = x_api_key or api_key
+    if not key:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason="Missing API key")
+        return
+    try:
+        async with AsyncSession(router.reader(key)) as session:
+            cached = await authenticate(session, key)
+            current = UserThread(detached_user(cached), await resolve_thread_id(session, key, cached))
+            current = current._replace(thread_id=await owned_thread_id(session, current, thread_id))
+    except HTTPException as exc:
+        # Refused before the handshake completes: the client sees a 403
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason=exc.detail)
+        return
+    
+    await websocket.accept()
+    socket = ChatSocket(websocket, settings.WS_SEND_BUFFER_FRAMES, settings.WS_HEARTBEAT_SECONDS)
+    chat_thread_id = current.thread_id
+    pending: "asyncio.Queue[ChatSend]" = asyncio.Queue(maxsize=settings.WS_MAX_PENDING_SENDS)
+    # Messages stored through this connection: already sent as ack or reply,
+    # so skipped when their announcement comes back from the hub
+    own_ids: Set[int] = set()
+    reply_tasks: Set[asyncio.Task] = set()
+    subscription = hub.subscribe(thread_channel(chat_thread_id))
+    
+    async def deliver_reply(send: ChatSend, job) -> None:
+        if tokens:
+            async for token in job.tokens():
+                socket.send({"type": "token", "id": send.id, "text": token})
+        try:
+            bot_message_read = await asyncio.shield(job.result)
+        except Exception:
+            socket.send(error_frame(send.id, 500, "Failed to store the reply"))
+            return
+        socket.send({"type": "reply", "id": send.id, "message": bot_message_read.model_dump(mode="json")})
+    
+    async def store_sends(sends: List[ChatSend]) -> None:
+        """Store queued messages with one INSERT and start their replies"""
+        accepted = []
+        for send in sends:
+            try:
+                responder_pool.reserve()
+                accepted.append(send)
+            except ResponderBusy:
+                socket.send(error_frame(send.id, 503, "The assistant is busy. Please try again shortly."))
+        if not accepted:
+            return
         
-        # Store the bot message ID before committing
-        bot_message_id = bot_message.id
-        bot_message_content = bot_message.content
-        bot_message_created_at = bot_message.created_at
+        try:
+            slot = await admission.acquire()
+        except AdmissionRejected:
+            for send in accepted:
+                responder_pool.release()
+                socket.send(error_frame(send.id, 503, "The server is busy. Please try again shortly."))
+            return
+        try:
+            now = datetime.utcnow()
+            inserted = await commit_messages(chat_thread_id, [(send.content, True, now) for send in accepted])
+        except Exception:
+            logger.exception("Failed to store WebSocket messages")
+            for send in accepted:
+                responder_pool.release()
+                socket.send(error_frame(send.id, 500, "Failed to store the message"))
+            return
+        finally:
+            slot.release()
+        router.record_write(key)
         
-        await session.commit()
+        created = [message_read_from_row(row) for row in inserted]
+        own_ids.update(msg.id for msg in created)
+        for send, msg in zip(accepted, created):
+            socket.send({"type": "ack", "id": send.id, "message": msg.model_dump(mode="json")})
+        await publish_messages(chat_thread_id, created)
         
-        return {
-            "user_message": MessageRead(
-                id=user_message_id,
-                content=user_message_content,
-                is_from_user=True,
-                created_at=user_message_created_at
-            ),
-            "bot_message": MessageRead(
-                id=bot_message_id,
-                content=bot_message_content,
-                is_from_user=False,
-                created_at=bot_message_created_at
+        for send in accepted:
+            job = responder_pool.submit(
+                send.content,
+                on_complete=lambda reply: store_bot_reply(chat_thread_id, reply, on_stored=own_ids.add),
             )
-        }
+            task = asyncio.ensure_future(deliver_reply(send, job))
+            reply_tasks.add(task)
+            task.add_done_callback(reply_tasks.discard)
+    
+    async def run_storer() -> None:
+        # Whatever queued up while the previous INSERT ran goes in the next one
+        while True:
+            sends = [await pending.get()]
+            while not pending.empty():
+                sends.append(pending.get_nowait())
+            # Shielded: a disconnect does not abandon a half-finished write
+            await asyncio.shield(store_sends(sends))
+    
+    async def run_forwarder() -> None:
+        while True:
+            try:
+                event = await subscription.get(timeout=settings.WS_HEARTBEAT_SECONDS)
+            except SubscriptionClosed:
+                socket.close(CLOSE_TRY_AGAIN_LATER, "Too far behind")
+                return
+            if event is None:
+                continue
+            if event.id in own_ids:
+                own_ids.discard(event.id)
+                continue
+            socket.send({"type": "message", "message": event.data})
+    
+    async def run_reader() -> None:
+        while True:
+            frame = await socket.receive()
+            if frame is None or frame.get("type") != "send":
+                continue
+            correlation_id = frame.get("id")
+            content = frame.get("content")
+            if not isinstance(content, str):
+                socket.send(error_frame(correlation_id, 400, "content must be a string"))
+                continue
+            decision = await check_rate_limit(current.user.id, write=True)
+            if not decision.allowed:
+                socket.send({
+                    **error_frame(correlation_id, 429, "Too many requests. Please slow down."),
+                    "retry_after": max(1, math.ceil(decision.retry_after)),
+                })
+                continue
+            try:
+                pending.put_nowait(ChatSend(correlation_id, content))
+            except asyncio.QueueFull:
+                socket.send(error_frame(correlation_id, 429, "Too many messages waiting to be stored"))
+    
+    reader = asyncio.ensure_future(run_reader())
+    writer = asyncio.ensure_future(socket.run_writer())
+    helpers = [asyncio.ensure_future(run) for run in (socket.run_heartbeat(), run_storer(), run_forwarder())]
+    try:
+        # Ends when the client disconnects or the server closes the connection
+        await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in [reader, writer, *helpers, *reply_tasks]:
+            task.cancel()
+        await asyncio.gather(reader, writer, *helpers, return_exceptions=True)
+        hub.unsubscribe(subscription)
+    
+    if reader.done() and not reader.cancelled() and not isinstance(reader.exception(), WebSocketDisconnect):
+        logger.error("WebSocket reader failed", exc_info=reader.exception())
 
 
-@app.get("/users")
-async def list_users():
-    """List all available users and their API keys (for testing purposes)"""
-    async with AsyncSession(engine) as session:
-        async with session.begin():
-            result = await session.execute(select(User))
-            users = result.scalars().all()
-            
-            return [
-                {
-                    "id": user.id,
-                    "name": user.name,
-                    "api_key": user.api_key
-                }
-                for user in users
-            ]
-
-# @app.get("/messages/stream")
-# async def stream_messages():
-#     """Stream new messages for real-time updates"""
-#     async def generate():
-#         while True:
-#             # In a real implementation, you'd use a proper message queue
-#             # For now, we'll just yield a simple heartbeat
-#             yield f"data: {datetime.now().isoformat()}\n\n"
-#             await asyncio.sleep(1)
-    
-#     return generate()
+@app.get("/debug/group-commit")
+async def group_commit_stats():
+    """Batches written by the group-commit writer; null when it is disabled"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return message_writer.stats() if message_writer is not None else None
+
+
+@app.get("/debug/idempotency")
+async def idempotency_stats():
+    """Idempotency-Key claims, replays and waits, and the response cache"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return idempotency.stats()
+
+
+@app.get("/debug/responder")
+async def responder_stats():
+    """Reply generation pool occupancy and outcomes"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return responder_pool.stats()
+
+
+@app.get("/debug/stream")
+async def stream_stats():
+    """Subscriber and delivery counters of the real-time message hub"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return hub.stats()
@@ -0,0 +1,230 @@
+"""
+Request and database metrics, exposed in Prometheus text format.
+
+- ``MetricsMiddleware`` is a pure ASGI middleware that times every request
+  and counts it by method, route template and status code. It adds a
+  ``Server-Timing`` header with the request's database time and query count.
+- ``instrument_engine`` hooks SQLAlchemy cursor events to count queries and
+  database time. Queries are attributed to the request that issued them
+  through a context variable, which SQLAlchemy's async layer carries into
+  the greenlet running the statement.
+- Requests that run more queries than the configured budget are counted and
+  logged, which surfaces N+1 query patterns.
+
+Metrics are kept per worker process; scrape every worker.
+"""
+
+import bisect
+import logging
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class RequestStats:
+    """Database work done on behalf of one request"""
+
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label set"""
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        # labels -> ([count per bucket] + [+Inf], sum)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self, name: str, label_names: Tuple[str, ...]) -> Iterable[str]:
+        for labels, (counts, total) in sorted(self._series.items()):
+            base = _format_labels(label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{name}_bucket{_format_labels(label_names + ('le',), labels + (le,))} {cumulative}"
+            yield f"{name}_sum{base} {total}"
+            yield f"{name}_count{base} {cumulative}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class Metrics:
+    """Registry of the application's request and query metrics"""
+
+    def __init__(self, query_budget: int):
+        self.query_budget = query_budget
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        self.over_budget: Dict[Tuple[str, str], int] = {}
+        self.request_duration = Histogram(DEFAULT_BUCKETS)
+        self.request_queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_duration = Histogram(DEFAULT_BUCKETS)
+        # Gauges read on every scrape: name -> (help, callable returning the value)
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def add_gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        self._gauges[name] = (help_text, read)
+
+    def record_query(self, duration: float) -> None:
+        self.query_duration.observe((), duration)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += duration
+
+    def record_request(self, method: str, route: str, status: int, duration: float, stats: RequestStats) -> None:
+        key = (method, route, str(status))
+        self.requests[key] = self.requests.get(key, 0) + 1
+        self.request_duration.observe((method, route), duration)
+        self.request_queries.observe((method, route), stats.queries)
+        if self.query_budget and stats.queries > self.query_budget:
+            self.over_budget[(method, route)] = self.over_budget.get((method, route), 0) + 1
+            logger.warning(
+                "%s %s ran %d queries (budget %d); possible N+1 query pattern",
+                method, route, stats.queries, self.query_budget,
+            )
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP http_requests_total Requests handled, by route and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for labels, count in sorted(self.requests.items()):
+            lines.append(f"http_requests_total{_format_labels(('method', 'route', 'status'), labels)} {count}")
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        lines.extend(self.request_duration.samples("http_request_duration_seconds", ("method", "route")))
+
+        lines += [
+            "# HELP http_request_db_queries Database queries run per request, by route.",
+            "# TYPE http_request_db_queries histogram",
+        ]
+        lines.extend(self.request_queries.samples("http_request_db_queries", ("method", "route")))
+
+        lines += [
+            "# HELP http_requests_over_query_budget_total Requests that ran more queries than the budget.",
+            "# TYPE http_requests_over_query_budget_total counter",
+        ]
+        for labels, count in sorted(self.over_budget.items()):
+            lines.append(
+                f"http_requests_over_query_budget_total{_format_labels(('method', 'route'), labels)} {count}"
+            )
+
+        lines += [
+            "# HELP db_query_duration_seconds Latency of individual database queries.",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        lines.extend(self.query_duration.samples("db_query_duration_seconds", ()))
+
+        for name, (help_text, read) in sorted(self._gauges.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+
+def instrument_engine(sync_engine, metrics: Metrics) -> None:
+    """Time every statement the engine executes and attribute it to the current request"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        metrics.record_query(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        # Failed statements never reach after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            metrics.record_query(time.perf_counter() - conn.info["query_started"].pop())
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route request metrics and Server-Timing"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self._route_paths: Optional[Dict[Callable, str]] = None
+
+    def _route_template(self, scope) -> str:
+        # Label by route template (/threads/{id}) rather than raw path to keep
+        # label cardinality bounded; unmatched paths share one label
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total_ms = (time.perf_counter() - started) * 1000
+                timing = (
+                    f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+                    f"app;dur={total_ms:.2f}"
+                )
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timing.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_request.reset(token)
+            self.metrics.record_request(
+                scope["method"], self._route_template(scope), status, time.perf_counter() - started, stats
+            )
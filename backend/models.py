@@ -1,6 +1,23 @@
-from sqlalchemy import String, ForeignKey, DateTime, Text
+from sqlalchemy import DDL, String, ForeignKey, DateTime, Text, Index, Computed, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from datetime import datetime
+from typing import Optional
+
+import settings
+from pubsub import PostgresNotifyBackend
+
+# Text search configuration of the message search index
+SEARCH_CONFIG = "english"
+# Prefix of the lexeme naming a message's thread in its search vector. The
+# parser never emits '#', so it cannot collide with a word in the content.
+THREAD_LEXEME_PREFIX = "#t"
+# Characters of the newest message kept in a thread's summary
+THREAD_PREVIEW_LENGTH = 200
+# Pub/sub channel announcing changes to the user table
+USERS_CHANNEL = "users"
+# Longest accepted Idempotency-Key header
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
 
 
 class Base(DeclarativeBase):
@@ -10,6 +27,13 @@ class Base(DeclarativeBase):
 class User(Base):
     __tablename__ = "user"
 
+    __table_args__ = (
+        # Serves the user list: ordering and name-prefix ranges on the
+        # case-folded name. The C collation compares bytes, so a prefix is
+        # a plain range of the index whatever the database locale.
+        Index("ix_user_name_lower", text('lower(name) COLLATE "C"'), "id"),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(30))
     api_key: Mapped[str] = mapped_column(String(50), unique=True)
@@ -21,12 +45,60 @@ class User(Base):
         return f"User(id={self.id!r}, name={self.name!r}, api_key={self.api_key!r})"
 
 
+# Any change to the user table is announced on the pub/sub NOTIFY channel,
+# once per statement, so every worker drops its cached /users pages; the
+# payload is in PostgresNotifyBackend's format. Not part of the metadata:
+# bootstrap.py installs it on every start, so databases whose user table
+# predates the trigger get it too.
+USER_CHANGED_TRIGGER_DDL = (
+    DDL(f"""
+        CREATE OR REPLACE FUNCTION notify_users_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify(
+                '{PostgresNotifyBackend.NOTIFY_CHANNEL}',
+                '{{"channel": "{USERS_CHANNEL}", "events": [{{"id": 0, "type": "users_changed"}}]}}'
+            );
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """),
+    DDL("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT FROM pg_trigger WHERE tgname = 'user_changed' AND tgrelid = '"user"'::regclass
+            ) THEN
+                CREATE TRIGGER user_changed AFTER INSERT OR UPDATE OR DELETE ON "user"
+                    FOR EACH STATEMENT EXECUTE FUNCTION notify_users_changed();
+            END IF;
+        END
+        $$
+    """),
+)
+
+
 class Thread(Base):
     __tablename__ = "thread"
+    __table_args__ = (
+        # At most one default thread per user; also the conflict target of
+        # its atomic get-or-create
+        Index("ux_thread_user_default", "user_id", unique=True, postgresql_where=text("is_default")),
+        # Serves the thread list: a user's threads, most recently active first
+        Index("ix_thread_user_activity", "user_id", text("last_message_at DESC"), text("id DESC")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    title: Mapped[Optional[str]] = mapped_column(String(100))
+    # The thread /threads/me and messages without a thread_id go to
+    is_default: Mapped[bool] = mapped_column(default=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Summary of the thread's messages, updated by the statements that insert
+    # them (see queries.py) so listing threads never aggregates messages.
+    # last_message_at is the creation time until the first message.
+    message_count: Mapped[int] = mapped_column(default=0)
+    last_message_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_message_preview: Mapped[Optional[str]] = mapped_column(String(THREAD_PREVIEW_LENGTH))
     
     # Relationships
     user: Mapped[User] = relationship(back_populates="threads")
@@ -38,15 +110,67 @@ class Thread(Base):
 
 class Message(Base):
     __tablename__ = "message"
+    __table_args__ = (
+        # Serves keyset pagination of a thread's history: each page is a
+        # bounded range scan on (thread_id, created_at, id)
+        Index("ix_message_thread_created_id", "thread_id", "created_at", "id"),
+        # Serves since_id deltas: a thread's messages after an id, in id order
+        Index("ix_message_thread_id_id", "thread_id", "id"),
+        # Full-text search over content; the thread lexeme in content_tsv lets
+        # the index itself narrow a search to one user's threads
+        Index("ix_message_content_tsv", "content_tsv", postgresql_using="gin"),
+        # Monthly partitions on created_at (see partitions.py)
+        {"postgresql_partition_by": "RANGE (created_at)"} if settings.MESSAGE_PARTITIONING else {},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # A partitioned table's primary key must include the partition key, so
+    # there it is (id, created_at); id alone still identifies a Message
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     thread_id: Mapped[int] = mapped_column(ForeignKey("thread.id"))
     content: Mapped[str] = mapped_column(Text)
     is_from_user: Mapped[bool] = mapped_column(default=True)  # True for user, False for bot
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, primary_key=settings.MESSAGE_PARTITIONING
+    )
+    # Maintained by Postgres from content plus a lexeme for thread_id;
+    # deferred so loading a Message skips it
+    content_tsv: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"to_tsvector('{SEARCH_CONFIG}', content)"
+            f" || array_to_tsvector(ARRAY['{THREAD_LEXEME_PREFIX}' || thread_id::text])",
+            persisted=True,
+        ),
+        deferred=True,
+    )
     
     # Relationships
     thread: Mapped[Thread] = relationship(back_populates="messages")
 
+    __mapper_args__ = {"primary_key": [id]}
+
     def __repr__(self) -> str:
         return f"Message(id={self.id!r}, thread_id={self.thread_id!r}, content={self.content!r})"
+
+
+class IdempotencyKey(Base):
+    """A POST /messages request sent with an Idempotency-Key, and its response once it is done"""
+
+    __tablename__ = "idempotency_key"
+    __table_args__ = (
+        # Serves the purge of expired keys
+        Index("ix_idempotency_key_expires_at", "expires_at"),
+    )
+
+    # Keys are chosen by clients, so they are only unique per user
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    key: Mapped[str] = mapped_column(String(IDEMPOTENCY_KEY_MAX_LENGTH), primary_key=True)
+    # SHA-256 of the request body; reusing a key for another request is an error
+    request_hash: Mapped[str] = mapped_column(String(64))
+    # The JSON response; NULL while the first request is still being handled
+    response: Mapped[Optional[dict]] = mapped_column(JSONB)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+
+    def __repr__(self) -> str:
+        return f"IdempotencyKey(user_id={self.user_id!r}, key={self.key!r})"
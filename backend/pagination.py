@@ -0,0 +1,68 @@
+"""
+Opaque cursors for keyset pagination.
+
+A cursor is the sort key of the last row a client has seen, serialized as
+URL-safe base64 JSON. Clients must treat it as an opaque string.
+"""
+
+import base64
+import json
+import math
+from datetime import datetime
+from typing import Any, Tuple
+
+# Range of the INTEGER columns that cursors hold keys of
+INT_MIN = -(2 ** 31)
+INT_MAX = 2 ** 31 - 1
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode a sort key (ints, floats, strings, datetimes) as a cursor."""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: type) -> Tuple[Any, ...]:
+    """Decode a cursor into a sort key of the given types.
+
+    Raises ``ValueError`` if the cursor is malformed, or holds a value that
+    no cursor of ours has: a timestamp with a time zone (they are naive
+    UTC), an int outside the INTEGER range, a float that is not finite, or
+    a string with a NUL character. Those would fail in the database.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
+
+    if not isinstance(payload, list) or len(payload) != len(types):
+        raise ValueError("Malformed cursor")
+
+    values = []
+    for value, kind in zip(payload, types):
+        if kind is datetime:
+            if not isinstance(value, str):
+                raise ValueError("Malformed cursor")
+            value = datetime.fromisoformat(value)
+            if value.tzinfo is not None:
+                raise ValueError("Malformed cursor")
+            values.append(value)
+        elif kind is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+            if not math.isfinite(value):
+                raise ValueError("Malformed cursor")
+            values.append(float(value))
+        elif kind is int and isinstance(value, int) and not isinstance(value, bool):
+            if not INT_MIN <= value <= INT_MAX:
+                raise ValueError("Malformed cursor")
+            values.append(value)
+        elif kind is str and isinstance(value, str):
+            if "\x00" in value:
+                raise ValueError("Malformed cursor")
+            values.append(value)
+        elif isinstance(value, kind) and not isinstance(value, bool):
+            values.append(value)
+        else:
+            raise ValueError("Malformed cursor")
+    return tuple(values)
@@ -0,0 +1,275 @@
+"""
+Monthly partitions of the message table.
+
+With MESSAGE_PARTITIONING on, ``message`` is created range-partitioned on
+``created_at``, one partition per calendar month (``message_p2024_05``),
+plus ``message_default`` for rows outside every monthly partition (e.g.
+history imported with old timestamps). Upcoming months are created ahead
+of time: at startup, periodically by each worker, and with ``create``.
+
+Retention never deletes rows: partitions older than the retention window
+are detached and dropped whole, optionally exported first to a gzipped CSV
+file per partition. The default partition is never retired.
+
+Usage (from backend/, with the database running):
+    python partitions.py list
+    python partitions.py create --months-ahead 3 --from 2024-01
+    python partitions.py retire --keep-months 12 --export-dir /backups/messages
+    python partitions.py retire --keep-months 12 --detach-only
+
+Partitions must exist before rows for their month arrive: a month cannot be
+created while the default partition holds rows for it, so create the
+months of a history import (``create --from``) before importing it.
+"""
+
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "message"
+DEFAULT_PARTITION = "message_default"
+
+# Arbitrary application-wide key for pg_advisory_xact_lock
+PARTITION_LOCK_KEY = 727_002
+
+_PARTITION_NAME = re.compile(r"^message_p(\d{4})_(\d{2})$")
+
+
+class Partition(NamedTuple):
+    name: str
+    # First day of the month held; None for the default partition
+    month: Optional[date]
+    # Planner estimate, -1 if the partition was never analyzed
+    estimated_rows: int
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Month held by a partition named by ``partition_name``, else None"""
+    match = _PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def months_between(first: date, last: date) -> List[date]:
+    """Months from ``first`` to ``last``, both included"""
+    months = []
+    month = month_start(first)
+    while month <= month_start(last):
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+    ), {"table": PARENT_TABLE})
+    return result.scalar_one()
+
+
+async def list_partitions(conn: AsyncConnection) -> List[Partition]:
+    """Partitions attached to the message table, oldest month first, default last"""
+    result = await conn.execute(text("""
+        SELECT child.relname, child.reltuples::bigint
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:table)
+    """), {"table": PARENT_TABLE})
+    partitions = [Partition(name, partition_month(name), rows) for name, rows in result]
+    return sorted(partitions, key=lambda partition: (partition.month is None, partition.month or date.min))
+
+
+async def create_partitions(conn: AsyncConnection, first: date, last: date) -> List[str]:
+    """Create the default partition and any missing monthly partitions from ``first`` to ``last``.
+
+    Runs in the caller's transaction; returns the names of the partitions created.
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    existing = {partition.name for partition in await list_partitions(conn)}
+    created = []
+    if DEFAULT_PARTITION not in existing:
+        await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+        created.append(DEFAULT_PARTITION)
+    for month in months_between(first, last):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        await conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE}"
+            f" FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+
+async def ensure_upcoming_partitions(
+    conn: AsyncConnection, months_ahead: int, today: Optional[date] = None
+) -> List[str]:
+    """Make sure the current month and the next ``months_ahead`` months have partitions"""
+    current = month_start(today or datetime.utcnow().date())
+    return await create_partitions(conn, current, add_months(current, months_ahead))
+
+
+async def export_partition(conn: AsyncConnection, name: str, directory: str) -> str:
+    """Write a partition to ``<directory>/<name>.csv.gz`` with COPY; returns the path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+    partial = path + ".partial"
+    raw = (await conn.get_raw_connection()).driver_connection
+    with gzip.open(partial, "wb") as out:
+        async def write(chunk: bytes) -> None:
+            out.write(chunk)
+
+        await raw.copy_from_table(
+            name,
+            columns=["id", "thread_id", "content", "is_from_user", "created_at"],
+            output=write,
+            format="csv",
+            header=True,
+        )
+    # Only a complete export gets the final name
+    os.replace(partial, path)
+    return path
+
+
+async def retire_partitions(
+    engine: AsyncEngine,
+    keep_months: int,
+    export_dir: Optional[str] = None,
+    drop: bool = True,
+    today: Optional[date] = None,
+) -> List[str]:
+    """Detach (and unless ``drop`` is False, drop) monthly partitions older than the retention window.
+
+    The current month and the ``keep_months - 1`` months before it are kept.
+    Each partition is exported first if ``export_dir`` is set, and retired in
+    its own transaction. Returns the names of the partitions retired.
+    """
+    if keep_months < 1:
+        raise ValueError("keep_months must be at least 1")
+    cutoff = add_months(month_start(today or datetime.utcnow().date()), -(keep_months - 1))
+
+    async with engine.connect() as conn:
+        expired = [
+            partition.name for partition in await list_partitions(conn)
+            if partition.month is not None and partition.month < cutoff
+        ]
+
+    retired = []
+    for name in expired:
+        async with engine.begin() as conn:
+            if export_dir is not None:
+                path = await export_partition(conn, name, export_dir)
+                logger.info("Exported %s to %s", name, path)
+            # Keep the denormalized thread counts in step with the rows leaving
+            await conn.execute(text(f"""
+                UPDATE thread SET message_count = thread.message_count - retired.count
+                FROM (SELECT thread_id, count(*) AS count FROM {name} GROUP BY thread_id) AS retired
+                WHERE thread.id = retired.thread_id
+            """))
+            await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            if drop:
+                await conn.execute(text(f"DROP TABLE {name}"))
+        logger.info("%s partition %s", "Dropped" if drop else "Detached", name)
+        retired.append(name)
+    return retired
+
+
+async def maintain_partitions(engine: AsyncEngine, months_ahead: int, interval: float) -> None:
+    """Keep upcoming partitions in place every ``interval`` seconds, until cancelled"""
+    while True:
+        try:
+            async with engine.begin() as conn:
+                created = await ensure_upcoming_partitions(conn, months_ahead)
+            if created:
+                logger.info("Created message partitions: %s", ", ".join(created))
+        except Exception:
+            logger.exception("Could not create upcoming message partitions")
+        await asyncio.sleep(interval)
+
+
+def parse_month(value: str) -> date:
+    try:
+        return month_start(datetime.strptime(value, "%Y-%m").date())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+async def run(args) -> None:
+    # Imported here so the helpers above can be used without a configured engine
+    from db_engine import engine
+
+    try:
+        async with engine.connect() as conn:
+            if not await is_partitioned(conn):
+                raise SystemExit(
+                    f"Table {PARENT_TABLE!r} is not partitioned; create it with MESSAGE_PARTITIONING=true"
+                )
+
+        if args.command == "list":
+            async with engine.connect() as conn:
+                for partition in await list_partitions(conn):
+                    rows = "not analyzed" if partition.estimated_rows < 0 else f"~{partition.estimated_rows:,} rows"
+                    print(f"{partition.name:<24} {rows}")
+        elif args.command == "create":
+            current = month_start(datetime.utcnow().date())
+            async with engine.begin() as conn:
+                created = await create_partitions(
+                    conn, args.first or current, add_months(current, args.months_ahead)
+                )
+            print(f"Created: {', '.join(created)}" if created else "All partitions already exist")
+        elif args.command == "retire":
+            retired = await retire_partitions(
+                engine, args.keep_months, export_dir=args.export_dir, drop=not args.detach_only
+            )
+            action = "Detached" if args.detach_only else "Dropped"
+            print(f"{action}: {', '.join(retired)}" if retired else "Nothing to retire")
+    finally:
+        await engine.dispose()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="Show partitions with estimated row counts")
+
+    create = commands.add_parser("create", help="Create missing monthly partitions")
+    create.add_argument("--months-ahead", type=int, default=2, help="Months after the current one to create")
+    create.add_argument("--from", dest="first", type=parse_month, default=None,
+                        help="First month to create, YYYY-MM (default: the current month)")
+
+    retire = commands.add_parser("retire", help="Detach and drop partitions older than the retention window")
+    retire.add_argument("--keep-months", type=int, required=True,
+                        help="Months kept, counting the current one")
+    retire.add_argument("--export-dir", default=None, help="Export each partition to a .csv.gz here first")
+    retire.add_argument("--detach-only", action="store_true", help="Detach but keep the tables")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.INFO)
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,224 @@
+"""
+Publish/subscribe hub for real-time message events.
+
+Each worker process owns one ``Hub`` that fans events out to the SSE streams
+connected to it. Events reach the hub through a backend:
+
+- ``LocalBackend`` delivers published events straight to the local hub. It is
+  enough for a single worker and doubles as the stand-in for tests.
+- ``PostgresNotifyBackend`` publishes with ``pg_notify`` and LISTENs on a
+  dedicated connection, so an event published by any uvicorn worker reaches
+  the subscribers of every worker.
+
+Every subscriber has a bounded queue. A subscriber that falls so far behind
+that its queue fills up is dropped instead of blocking the publisher; its
+stream ends and the client resumes with ``Last-Event-ID``.
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# pg_notify payloads must stay below 8000 bytes
+_NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+@dataclass
+class Event:
+    id: int
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "type": self.type, "data": self.data}
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "Event":
+        return cls(id=raw["id"], type=raw["type"], data=raw.get("data") or {})
+
+
+class Subscription:
+    """One consumer's bounded view of a channel."""
+
+    def __init__(self, channel: str, maxsize: int):
+        self.channel = channel
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=maxsize)
+        # Set when the hub stops delivering to this subscriber
+        self.closed = False
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """Wait for the next event; ``None`` if nothing arrived within ``timeout``.
+
+        Raises ``SubscriptionClosed`` once the subscription is closed and every
+        event queued before closing has been consumed.
+        """
+        if self.queue.empty() and self.closed:
+            raise SubscriptionClosed(self.channel)
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class SubscriptionClosed(Exception):
+    pass
+
+
+class Hub:
+    """In-process fan-out of events to channel subscribers."""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, self.queue_size)
+        self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.closed = True
+        subscribers = self._channels.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._channels[subscription.channel]
+
+    def dispatch(self, channel: str, events: List[Event]) -> None:
+        """Queue events for every subscriber of ``channel`` without blocking."""
+        for subscription in list(self._channels.get(channel, ())):
+            for event in events:
+                try:
+                    subscription.queue.put_nowait(event)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    # Slow consumer: stop feeding it rather than buffering
+                    # without bound; it resumes from the database on reconnect
+                    self.dropped_subscribers += 1
+                    self.unsubscribe(subscription)
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "channels": len(self._channels),
+            "subscribers": sum(len(subs) for subs in self._channels.values()),
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+class LocalBackend:
+    """Single-process backend: publishing dispatches directly to the hub."""
+
+    def __init__(self, hub: Hub):
+        self.hub = hub
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, channel: str, events: List[Event]) -> None:
+        self.hub.dispatch(channel, events)
+
+
+class PostgresNotifyBackend:
+    """Cross-worker backend built on Postgres LISTEN/NOTIFY.
+
+    Publishing and listening share one dedicated asyncpg connection, so the
+    backend never takes a connection from the SQLAlchemy pool. Events too big
+    for a NOTIFY payload are sent without their data, and ``loader`` re-reads
+    them from the database on the receiving side.
+    """
+
+    NOTIFY_CHANNEL = "chat_events"
+
+    def __init__(
+        self,
+        hub: Hub,
+        dsn: str,
+        loader: Optional[Callable[[str, List[Event]], Awaitable[List[Event]]]] = None,
+        reconnect_delay: float = 1.0,
+    ):
+        self.hub = hub
+        self.dsn = dsn
+        self.loader = loader
+        self.reconnect_delay = reconnect_delay
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self) -> None:
+        self._stopping = False
+        await self._connect()
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def publish(self, channel: str, events: List[Event]) -> None:
+        payload = json.dumps({"channel": channel, "events": [e.to_dict() for e in events]})
+        if len(payload.encode()) > _NOTIFY_PAYLOAD_LIMIT:
+            stubs = [{"id": e.id, "type": e.type, "data": None} for e in events]
+            payload = json.dumps({"channel": channel, "events": stubs, "partial": True})
+
+        async with self._lock:
+            if self._conn is None:
+                raise ConnectionError("Postgres pub/sub connection is not available")
+            await self._conn.execute("SELECT pg_notify($1, $2)", self.NOTIFY_CHANNEL, payload)
+
+    async def _connect(self) -> None:
+        import asyncpg
+
+        self._conn = await asyncpg.connect(self.dsn)
+        self._conn.add_termination_listener(self._on_terminated)
+        await self._conn.add_listener(self.NOTIFY_CHANNEL, self._on_notify)
+
+    def _on_terminated(self, _conn) -> None:
+        self._conn = None
+        if not self._stopping:
+            logger.warning("Postgres pub/sub connection lost; reconnecting")
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self._connect()
+                return
+            except Exception:
+                logger.exception("Postgres pub/sub reconnect failed")
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        message = json.loads(payload)
+        events = [Event.from_dict(raw) for raw in message["events"]]
+        if message.get("partial") and self.loader is not None:
+            asyncio.ensure_future(self._dispatch_loaded(message["channel"], events))
+        else:
+            self.hub.dispatch(message["channel"], events)
+
+    async def _dispatch_loaded(self, channel: str, events: List[Event]) -> None:
+        try:
+            self.hub.dispatch(channel, await self.loader(channel, events))
+        except Exception:
+            logger.exception("Failed to load oversized events for %s", channel)
+
+
+def create_backend(kind: str, hub: Hub, dsn: str, loader=None):
+    if kind == "local":
+        return LocalBackend(hub)
+    if kind == "postgres":
+        return PostgresNotifyBackend(hub, dsn, loader=loader)
+    raise ValueError(f"Unknown pub/sub backend: {kind!r}")
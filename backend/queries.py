@@ -0,0 +1,336 @@
+"""
+Reusable SQL statements for the API handlers.
+
+Statements that the handlers share, or that need PostgreSQL-specific syntax,
+live here so ``main.py`` keeps to request handling.
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import Text, func, literal, literal_column, select, text, tuple_
+from sqlalchemy.dialects.postgresql import TSQUERY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import SEARCH_CONFIG, THREAD_LEXEME_PREFIX, THREAD_PREVIEW_LENGTH, Message, Thread, User
+from serialization import select_message_rows
+
+
+# Sort key of the user list, matching the expression of ix_user_name_lower
+USER_SORT_KEY = func.lower(User.name).collate("C")
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """The smallest string greater than every string starting with ``prefix`` (in code point order)"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def select_users_page(limit: int, after: Optional[Tuple[str, int]] = None, prefix: Optional[str] = None):
+    """Users ordered by case-folded name, after the ``(sort_name, id)`` key ``after``.
+
+    ``prefix`` keeps the names that start with it, ignoring case. It is
+    turned into a range on the sort key, so every page is one bounded scan
+    of ``ix_user_name_lower``.
+    """
+    query = select(User.id, User.name, User.api_key, USER_SORT_KEY.label("sort_name"))
+    if prefix:
+        prefix = prefix.lower()
+        query = query.where(USER_SORT_KEY >= prefix, USER_SORT_KEY < prefix_upper_bound(prefix))
+    if after is not None:
+        query = query.where(tuple_(USER_SORT_KEY, User.id) > tuple_(*after))
+    return query.order_by(USER_SORT_KEY, User.id).limit(limit)
+
+
+def insert_thread_if_missing(user_id: int):
+    """INSERT the user's default thread unless it exists; RETURNING the new id (if any)."""
+    now = datetime.utcnow()
+    return (
+        pg_insert(Thread)
+        .values(user_id=user_id, is_default=True, created_at=now, last_message_at=now)
+        .on_conflict_do_nothing(index_elements=[Thread.user_id], index_where=Thread.is_default)
+        .returning(Thread.id)
+    )
+
+
+async def get_or_create_thread_id(session: AsyncSession, user_id: int) -> int:
+    """Return the id of the user's default thread, creating it atomically if needed."""
+    default_thread = select(Thread.id).where(Thread.user_id == user_id, Thread.is_default)
+    thread_id = (await session.execute(default_thread)).scalar_one_or_none()
+    if thread_id is not None:
+        return thread_id
+
+    thread_id = (await session.execute(insert_thread_if_missing(user_id))).scalar_one_or_none()
+    if thread_id is None:
+        # A concurrent request created it first; it is committed and visible now
+        thread_id = (await session.execute(default_thread)).scalar_one()
+    await session.commit()
+    return thread_id
+
+
+async def get_thread_version(
+    session: AsyncSession, thread_id: int, user_id: Optional[int] = None
+) -> Optional[Tuple[int, datetime]]:
+    """``(message_count, last_message_at)`` of a thread, from its summary columns.
+
+    Both change whenever messages are added, so together they version the
+    thread's content without loading it. With ``user_id``, returns None
+    unless the thread belongs to that user.
+    """
+    query = select(Thread.message_count, Thread.last_message_at).where(Thread.id == thread_id)
+    if user_id is not None:
+        query = query.where(Thread.user_id == user_id)
+    row = (await session.execute(query)).one_or_none()
+    return tuple(row) if row is not None else None
+
+
+# Columns of a thread's entry in the thread list
+THREAD_SUMMARY_COLUMNS = (
+    Thread.id,
+    Thread.title,
+    Thread.is_default,
+    Thread.message_count,
+    Thread.last_message_at,
+    Thread.last_message_preview,
+    Thread.created_at,
+)
+
+
+def select_user_by_api_key(api_key: str):
+    """The user with ``api_key`` and the id of their default thread (None until it exists)"""
+    return (
+        select(User.id, User.name, User.api_key, Thread.id)
+        .outerjoin(Thread, (Thread.user_id == User.id) & Thread.is_default)
+        .where(User.api_key == api_key)
+    )
+
+
+def select_messages_since(thread_id: int, since_id: int, limit: int):
+    """The oldest ``limit`` message rows of a thread after ``since_id``, oldest first"""
+    return (
+        select_message_rows()
+        .where(Message.thread_id == thread_id, Message.id > since_id)
+        .order_by(Message.id)
+        .limit(limit)
+    )
+
+
+def select_user_threads(user_id: int, limit: int, before: Optional[Tuple[datetime, int]] = None):
+    """A user's threads, most recently active first, older than the ``(last_message_at, id)`` key ``before``.
+
+    Served by ``ix_thread_user_activity`` in index order, whatever the page.
+    """
+    query = select(*THREAD_SUMMARY_COLUMNS).where(Thread.user_id == user_id)
+    if before is not None:
+        query = query.where(tuple_(Thread.last_message_at, Thread.id) < tuple_(*before))
+    return query.order_by(Thread.last_message_at.desc(), Thread.id.desc()).limit(limit)
+
+
+def insert_thread(user_id: int, title: Optional[str]):
+    """INSERT a new (non-default) thread for the user, RETURNING its summary"""
+    now = datetime.utcnow()
+    return (
+        pg_insert(Thread)
+        .values(user_id=user_id, title=title, is_default=False, created_at=now, last_message_at=now)
+        .returning(*THREAD_SUMMARY_COLUMNS)
+    )
+
+
+async def thread_belongs_to(session: AsyncSession, thread_id: int, user_id: int) -> bool:
+    row = await session.execute(select(Thread.id).where(Thread.id == thread_id, Thread.user_id == user_id))
+    return row.first() is not None
+
+
+# Updates the summary of the threads that messages were just inserted into,
+# in the same statement and so the same transaction. Appended to a WITH
+# whose "inserted" CTE is an INSERT INTO message ... RETURNING. Messages
+# with old timestamps (imports) count, but only replace the preview when
+# they are the newest. Concurrent inserts into one thread queue up on its
+# row lock for the rest of their transaction.
+_UPDATE_THREAD_SUMMARY = f"""
+    , summary AS (
+        UPDATE thread SET
+            message_count = thread.message_count + batch.added,
+            last_message_at = CASE
+                WHEN thread.message_count = 0 THEN batch.newest_at
+                ELSE GREATEST(thread.last_message_at, batch.newest_at)
+            END,
+            last_message_preview = CASE
+                WHEN thread.message_count = 0 OR batch.newest_at >= thread.last_message_at THEN batch.preview
+                ELSE thread.last_message_preview
+            END
+        FROM (
+            SELECT
+                thread_id,
+                count(*) AS added,
+                max(created_at) AS newest_at,
+                left((array_agg(content ORDER BY created_at DESC, id DESC))[1], {THREAD_PREVIEW_LENGTH}) AS preview
+            FROM inserted
+            GROUP BY thread_id
+        ) AS batch
+        WHERE thread.id = batch.thread_id
+    )
+    SELECT id, thread_id, content, is_from_user, created_at FROM inserted
+"""
+
+
+# Inserts messages and updates the summaries of their threads, RETURNING the
+# inserted rows. Rows arrive as parallel arrays so the statement text is the
+# same for any count. Rows are inserted in array order, so their serial ids
+# increase in that order; RETURNING itself is unordered.
+INSERT_MESSAGES = text("""
+    WITH inserted AS (
+        INSERT INTO message (thread_id, content, is_from_user, created_at)
+        SELECT new_messages.thread_id, new_messages.content, new_messages.is_from_user, new_messages.created_at
+        FROM unnest(
+            CAST(:thread_ids AS INTEGER[]),
+            CAST(:contents AS TEXT[]),
+            CAST(:is_from_user AS BOOLEAN[]),
+            CAST(:created_ats AS TIMESTAMP[])
+        ) WITH ORDINALITY AS new_messages (thread_id, content, is_from_user, created_at, position)
+        ORDER BY new_messages.position
+        RETURNING id, thread_id, content, is_from_user, created_at
+    )
+""" + _UPDATE_THREAD_SUMMARY)
+
+# Takes the row locks of several threads in id order. A transaction about to
+# update more than one thread summary takes them first, so two such
+# transactions cannot deadlock by locking the same threads in opposite orders.
+LOCK_THREADS = text("SELECT id FROM thread WHERE id = ANY(CAST(:thread_ids AS INTEGER[])) ORDER BY id FOR UPDATE")
+
+
+async def insert_thread_messages(
+    session: AsyncSession, rows: Sequence[Tuple[int, str, bool, datetime]]
+) -> List:
+    """Insert ``(thread_id, content, is_from_user, created_at)`` rows, in any threads, in one round-trip.
+
+    Also updates the threads' summaries (locking the threads in id order
+    first when there are several). Returns the inserted rows in the order of
+    ``rows``.
+    """
+    thread_ids = [row[0] for row in rows]
+    distinct_thread_ids = sorted(set(thread_ids))
+    if len(distinct_thread_ids) > 1:
+        await session.execute(LOCK_THREADS, {"thread_ids": distinct_thread_ids})
+    inserted = (
+        await session.execute(INSERT_MESSAGES, {
+            "thread_ids": thread_ids,
+            "contents": [row[1] for row in rows],
+            "is_from_user": [row[2] for row in rows],
+            "created_ats": [row[3] for row in rows],
+        })
+    ).all()
+    return sorted(inserted, key=lambda row: row.id)
+
+
+async def insert_messages(
+    session: AsyncSession, thread_id: int, rows: Sequence[Tuple[str, bool, datetime]]
+) -> List:
+    """Insert ``(content, is_from_user, created_at)`` rows into a thread in one round-trip.
+
+    Also updates the thread's summary. Returns the inserted rows in the
+    order of ``rows``.
+    """
+    return await insert_thread_messages(session, [(thread_id, *row) for row in rows])
+
+
+async def select_thread_page(
+    session: AsyncSession,
+    thread_id: int,
+    limit: int,
+    before: Optional[Tuple[datetime, int]] = None,
+    recent_window: Optional[timedelta] = None,
+    thread_size: Optional[int] = None,
+) -> List:
+    """The newest ``limit`` message rows of a thread older than ``before``, newest first.
+
+    ``before`` is the ``(created_at, id)`` of the oldest message already
+    seen. With ``recent_window``, the page is first read from the messages
+    created within that span before the newest possible row (now, or
+    ``before``); only if those do not fill it is the rest read from older
+    messages. On a partitioned table the first read prunes to the recent
+    partitions, so the usual page never touches the old ones.
+    ``thread_size``, the thread's message count if known, skips the second
+    read when the first one already found every message.
+    """
+    query = select_message_rows().where(Message.thread_id == thread_id)
+    if before is not None:
+        # The plain bound lets the planner prune newer partitions; the row
+        # comparison alone does not
+        query = query.where(
+            Message.created_at <= before[0],
+            tuple_(Message.created_at, Message.id) < tuple_(*before),
+        )
+    query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    if recent_window is None:
+        return (await session.execute(query.limit(limit))).all()
+
+    boundary = (before[0] if before is not None else datetime.utcnow()) - recent_window
+    rows = (await session.execute(query.where(Message.created_at >= boundary).limit(limit))).all()
+    if len(rows) < limit and not (before is None and thread_size is not None and len(rows) >= thread_size):
+        rows += (
+            await session.execute(query.where(Message.created_at < boundary).limit(limit - len(rows)))
+        ).all()
+    return rows
+
+
+# Inlined rather than bound, so Postgres can fold the parsed query into a constant
+SEARCH_REGCONFIG = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+# Marks matched terms in search highlights
+HIGHLIGHT_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+# Characters escaped in highlights, in this order (& first)
+HTML_ESCAPES = [("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#39;")]
+
+
+def html_escape(expression):
+    """SQL expression escaping ``expression`` for use as HTML text"""
+    for character, entity in HTML_ESCAPES:
+        expression = func.replace(expression, character, entity)
+    return expression
+
+
+def search_messages_query(user_id: int, text_query: str, limit: int, after: Optional[Tuple[float, int]] = None):
+    """Ranked full-text search over the messages in a user's threads.
+
+    ``text_query`` uses web-search syntax (quoted phrases, ``or``, ``-term``).
+    Results are ordered by rank, then id, both descending; ``after`` is the
+    ``(rank, id)`` of the last result already seen. Fetches ``limit`` rows;
+    headlines are computed for those rows only, after ranking. A headline
+    is HTML: the content is escaped before the matched terms are wrapped in
+    ``<mark>``. The parser reads each entity as one token, so excerpts do
+    not cut through them.
+
+    The search is scoped by AND-ing the query with the thread lexemes of the
+    user's threads, so the GIN index intersects the term postings with the
+    user's messages rather than finding every match in the table first.
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_REGCONFIG, text_query)
+    rank = func.ts_rank(Message.content_tsv, tsquery)
+    # '#t1 | #t2 | ...' for the user's threads; NULL (no matches) without threads
+    user_threads = (
+        select(func.string_agg(literal(THREAD_LEXEME_PREFIX) + Thread.id.cast(Text), " | ").cast(TSQUERY))
+        .where(Thread.user_id == user_id)
+        .scalar_subquery()
+    )
+
+    matches = (
+        select(
+            Message.id, Message.thread_id, Message.content, Message.is_from_user, Message.created_at,
+            rank.label("rank"),
+        )
+        .where(
+            # A query of stop words only has no nodes and would match every message
+            func.numnode(tsquery) > 0,
+            Message.content_tsv.bool_op("@@")(tsquery.op("&&")(user_threads)),
+        )
+    )
+    if after is not None:
+        matches = matches.where(tuple_(rank, Message.id) < tuple_(*after))
+    page = matches.order_by(rank.desc(), Message.id.desc()).limit(limit).subquery()
+
+    return select(
+        page,
+        func.ts_headline(
+            SEARCH_REGCONFIG, html_escape(page.c.content), tsquery, HIGHLIGHT_OPTIONS
+        ).label("highlight"),
+    ).order_by(page.c.rank.desc(), page.c.id.desc())
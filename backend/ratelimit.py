@@ -0,0 +1,251 @@
+"""
+Per-API-key rate limiting and admission control.
+
+Every authenticated request takes a token from its API key's bucket: one
+bucket for reads, a smaller one for writes. A bucket holds up to
+``capacity`` tokens and refills continuously at ``refill_per_second``, so a
+client can burst up to the capacity and then sustain the refill rate. An
+empty bucket means ``429 Too Many Requests`` with ``Retry-After``.
+
+A request may cost more than one token (a batch of messages costs one per
+message). One costing more than the capacity is let through from a full
+bucket and leaves it in debt, which later requests wait out.
+
+Buckets live in a store:
+
+- ``MemoryBucketStore`` keeps them in the worker process. Each worker
+  enforces the limits on its own share of the traffic; it is enough for a
+  single worker and doubles as the stand-in for tests.
+- ``RedisBucketStore`` keeps them in Redis, updated atomically by a Lua
+  script on Redis's clock, so the limits hold across all workers. Needs
+  the ``redis`` package.
+
+If the store fails, requests are let through: losing rate limiting is
+better than losing the API.
+
+``AdmissionControl`` caps the requests doing database work at once across
+all keys, answering ``503`` when no slot frees up quickly, instead of
+letting requests pile up in the connection pool's queue.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - exercised only without redis
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit(NamedTuple):
+    capacity: float
+    refill_per_second: float
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    # Tokens left after this request; negative while the bucket is in debt
+    remaining: float
+    # Seconds until the request would be allowed; 0 when allowed
+    retry_after: float
+
+
+def _refill_and_take(tokens: float, elapsed: float, limit: RateLimit, cost: float) -> Decision:
+    tokens = min(limit.capacity, tokens + elapsed * limit.refill_per_second)
+    # More than the capacity could never be available at once
+    needed = min(cost, limit.capacity)
+    if tokens >= needed:
+        return Decision(True, tokens - cost, 0.0)
+    return Decision(False, tokens, (needed - tokens) / limit.refill_per_second)
+
+
+class MemoryBucketStore:
+    """Token buckets in this process, least recently used evicted beyond ``max_keys``"""
+
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        # key -> (tokens, last update)
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> Decision:
+        now = self._clock()
+        tokens, updated = self._buckets.get(key, (limit.capacity, now))
+        decision = _refill_and_take(tokens, now - updated, limit, cost)
+        self._buckets[key] = (decision.remaining, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            # An evicted key starts again from a full bucket
+            self._buckets.popitem(last=False)
+        return decision
+
+    async def close(self) -> None:
+        pass
+
+
+# KEYS[1] bucket; ARGV capacity, refill per second, cost. Returns
+# {allowed, remaining, retry_after} with the numbers as strings, since Lua
+# numbers would be truncated to integers on the way back.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+
+local allowed = 0
+local retry_after = 0
+-- More than the capacity could never be available at once
+local needed = math.min(cost, capacity)
+if tokens >= needed then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (needed - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+-- A bucket left alone long enough to refill is the same as no bucket
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens), tostring(retry_after)}
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through Redis"""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        if aioredis is None:
+            raise RuntimeError("The redis rate limit backend needs the redis package (pip install redis)")
+        self.prefix = prefix
+        self._client = aioredis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> Decision:
+        allowed, remaining, retry_after = await self._take(
+            keys=[self.prefix + key], args=[limit.capacity, limit.refill_per_second, cost]
+        )
+        return Decision(bool(allowed), float(remaining), float(retry_after))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_bucket_store(kind: str, url: Optional[str] = None):
+    if kind == "memory":
+        return MemoryBucketStore()
+    if kind == "redis":
+        return RedisBucketStore(url)
+    raise ValueError(f"Unknown rate limit backend: {kind!r}")
+
+
+class RateLimiter:
+    """Separate read and write budgets per API key"""
+
+    def __init__(self, store, read: RateLimit, write: RateLimit):
+        self.store = store
+        self.read = read
+        self.write = write
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    async def check(self, key: str, write: bool, cost: float = 1.0) -> Decision:
+        limit = self.write if write else self.read
+        # Read and write budgets are separate buckets
+        bucket = f"{'w' if write else 'r'}:{key}"
+        try:
+            decision = await self.store.take(bucket, limit, cost)
+        except Exception:
+            logger.exception("Rate limit store failed; letting the request through")
+            self.errors += 1
+            return Decision(True, 0.0, 0.0)
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return decision
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.store).__name__,
+            "read": self.read._asdict(),
+            "write": self.write._asdict(),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors,
+        }
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class AdmissionSlot:
+    """A held admission slot; releasing twice is harmless"""
+
+    def __init__(self, control: "AdmissionControl"):
+        self._control = control
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._control._release()
+
+
+class AdmissionControl:
+    """At most ``max_in_flight`` requests doing database work at once.
+
+    A request waits up to ``wait`` seconds for a slot, then is rejected.
+    """
+
+    def __init__(self, max_in_flight: int, wait: float):
+        self.max_in_flight = max_in_flight
+        self.wait = wait
+        # Created on first use, inside the running event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self) -> AdmissionSlot:
+        """Take a slot; raises ``AdmissionRejected`` if none frees up in time"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        if self._slots.locked():
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.wait)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise AdmissionRejected()
+        else:
+            await self._slots.acquire()
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        self.admitted += 1
+        return AdmissionSlot(self)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "peak": self.peak,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,218 @@
+"""
+Bot reply generation, off the request's database connection.
+
+A ``Responder`` turns a user message into a stream of reply tokens. The
+``ResponderPool`` runs generations on a fixed number of worker tasks, so a
+slow responder cannot pile up unbounded concurrent work:
+
+- Each generation first reserves a slot. Once every worker is busy and the
+  backlog is full, ``reserve`` raises ``ResponderBusy`` and the caller sheds
+  the request instead of queueing it.
+- Tokens are handed to the caller through the job as they are produced.
+- When generation finishes, successfully or not, the job's ``on_complete``
+  callback persists the reply. It runs even if the client went away, so the
+  conversation never ends up with a message and no reply.
+- A job the pool stops before it is done (at shutdown) fails with
+  ``ResponderStopped``, so nothing waiting on it hangs.
+
+No database connection is held while a reply is generated.
+"""
+
+import asyncio
+import logging
+import random
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Canned bot responses
+BOT_RESPONSES = [
+    "That's interesting! Tell me more about that.",
+    "I understand what you're saying. How can I help you further?",
+    "Thanks for sharing that with me. Is there anything specific you'd like to know?",
+    "I'm here to help! What would you like to discuss?",
+    "That's a great point. Let me think about that for a moment...",
+    "I appreciate you reaching out. How can I assist you today?",
+    "That sounds fascinating! I'd love to hear more details.",
+    "I'm processing what you've said. What's your next question?",
+    "Thank you for the information. How can I be of service?",
+    "I'm listening and ready to help. What's on your mind?"
+]
+
+# Stored when generation fails or times out, so every message gets a reply
+FALLBACK_REPLY = "Sorry, I couldn't come up with a reply. Please try again."
+
+
+def canned_reply() -> str:
+    return random.choice(BOT_RESPONSES)
+
+
+class LocalResponder:
+    """Stand-in responder: a canned reply, streamed word by word with simulated latency."""
+
+    def __init__(self, first_token_delay: float = 0.0, token_delay: float = 0.0):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    async def generate(self, prompt: str) -> AsyncIterator[str]:
+        words = canned_reply().split(" ")
+        await asyncio.sleep(self.first_token_delay)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+
+class ResponderBusy(Exception):
+    pass
+
+
+class ResponderStopped(Exception):
+    """The pool stopped before the job was done"""
+
+
+_DONE = object()
+
+
+class ReplyJob:
+    """One reply being generated; the caller reads its tokens and final result."""
+
+    def __init__(self, prompt: str, on_complete: Callable[[str], Awaitable[Any]]):
+        self.prompt = prompt
+        self.on_complete = on_complete
+        self._tokens: "asyncio.Queue[Any]" = asyncio.Queue()
+        # Whatever on_complete returned (e.g. the stored message)
+        self.result: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        # The caller may be gone by the time the job ends; don't warn about
+        # an exception nobody retrieved (it is logged by the pool)
+        self.result.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    async def tokens(self) -> AsyncIterator[str]:
+        """Tokens as they are produced; ends when generation does."""
+        while True:
+            token = await self._tokens.get()
+            if token is _DONE:
+                return
+            yield token
+
+
+class ResponderPool:
+    """Fixed set of worker tasks generating replies, with a bounded backlog."""
+
+    def __init__(self, responder, workers: int, queue_size: int, timeout: float):
+        self.responder = responder
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.timeout = timeout
+        # Created in start(), inside the running event loop
+        self._queue: "Optional[asyncio.Queue[ReplyJob]]" = None
+        self._tasks: List[asyncio.Task] = []
+        # Jobs reserved, queued or running
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Let queued and running generations finish (up to ``timeout``), then stop the workers."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping responder pool with %d replies unfinished", self._pending)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs no worker got to
+        while not self._queue.empty():
+            self._finish(self._queue.get_nowait())
+            self._pending -= 1
+            self._queue.task_done()
+
+    def reserve(self) -> None:
+        """Claim capacity for one reply; raises ``ResponderBusy`` when the pool is saturated.
+
+        Reserve before doing work that needs a reply (such as storing the
+        user's message), then ``submit``.
+        """
+        if self._pending >= self.capacity:
+            self.rejected += 1
+            raise ResponderBusy()
+        self._pending += 1
+
+    def submit(self, prompt: str, on_complete: Callable[[str], Awaitable[Any]]) -> ReplyJob:
+        """Queue a generation for a slot taken with ``reserve``."""
+        job = ReplyJob(prompt, on_complete)
+        self._queue.put_nowait(job)
+        return job
+
+    def release(self) -> None:
+        """Give back a reserved slot that will not be submitted."""
+        self._pending -= 1
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._pending -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: ReplyJob) -> None:
+        parts: List[str] = []
+
+        async def generate():
+            async for token in self.responder.generate(job.prompt):
+                parts.append(token)
+                job._tokens.put_nowait(token)
+
+        try:
+            try:
+                await asyncio.wait_for(generate(), self.timeout)
+                reply = "".join(parts)
+            except Exception:
+                logger.exception("Reply generation failed")
+                self.failed += 1
+                reply = FALLBACK_REPLY
+
+            try:
+                stored = await job.on_complete(reply)
+                self.completed += 1
+                if not job.result.done():
+                    job.result.set_result(stored)
+            except Exception as exc:
+                logger.exception("Failed to store reply")
+                if not job.result.done():
+                    job.result.set_exception(exc)
+        finally:
+            # Also when the worker is cancelled midway
+            self._finish(job)
+
+    @staticmethod
+    def _finish(job: ReplyJob) -> None:
+        """End the job's token stream, and fail its result unless it has one"""
+        if not job.result.done():
+            job.result.set_exception(ResponderStopped())
+        job._tokens.put_nowait(_DONE)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "pending": self._pending,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def create_responder(kind: str, first_token_delay: float = 0.0, token_delay: float = 0.0):
+    if kind == "local":
+        return LocalResponder(first_token_delay=first_token_delay, token_delay=token_delay)
+    raise ValueError(f"Unknown responder: {kind!r}")
@@ -1,65 +1,75 @@
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from db_engine import sync_engine
-from models import User, Thread, Message
+import asyncio
+from datetime import datetime
 
+from sqlalchemy import exists, func, select, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Thread
+from queries import insert_messages
 
-def seed_user_if_needed():
-    with Session(sync_engine) as session:
-        with session.begin():
-            # Check if users exist
-            users = session.execute(select(User)).scalars().all()
+
+async def seed_user_if_needed(session: AsyncSession):
+    """Create the default users, threads and messages; the caller commits"""
+    # Check if users exist
+    has_users = (await session.execute(select(User.id).limit(1))).first() is not None
+    
+    if not has_users:
+        print("Seeding users")
+        
+        # Create multiple users with API keys
+        users_data = [
+            {"name": "Alice", "api_key": "alice_key_123"},
+            {"name": "Bob", "api_key": "bob_key_456"},
+            {"name": "Charlie", "api_key": "charlie_key_789"}
+        ]
+        
+        for user_data in users_data:
+            user = User(name=user_data["name"], api_key=user_data["api_key"])
+            session.add(user)
+            await session.flush()  # Flush to get the user ID
+            
+            # Create a default thread for each user
+            thread = Thread(user_id=user.id, is_default=True)
+            session.add(thread)
+            await session.flush()  # Flush to get the thread ID
             
-            if not users:
-                print("Seeding users")
-                
-                # Create multiple users with API keys
-                users_data = [
-                    {"name": "Alice", "api_key": "alice_key_123"},
-                    {"name": "Bob", "api_key": "bob_key_456"},
-                    {"name": "Charlie", "api_key": "charlie_key_789"}
-                ]
-                
-                for user_data in users_data:
-                    user = User(name=user_data["name"], api_key=user_data["api_key"])
-                    session.add(user)
-                    session.flush()  # Flush to get the user ID
-                    
-                    # Create a default thread for each user
-                    thread = Thread(user_id=user.id)
-                    session.add(thread)
-                    session.flush()  # Flush to get the thread ID
-                    
-                    # Add some sample messages for each user
-                    sample_messages = [
-                        Message(thread_id=thread.id, content=f"Hello {user.name}! How can I help you today?", is_from_user=False),
-                        Message(thread_id=thread.id, content="I'm here to assist you with any questions.", is_from_user=False),
-                    ]
-                    
-                    for message in sample_messages:
-                        session.add(message)
-                
-                session.commit()
-                print(f"Created {len(users_data)} users with threads and sample messages")
-                print("Available API keys:")
-                for user_data in users_data:
-                    print(f"  {user_data['name']}: {user_data['api_key']}")
-            else:
-                print(f"Found {len(users)} existing users")
-                
-                # Ensure each user has a thread
-                for user in users:
-                    thread = session.execute(select(Thread).where(Thread.user_id == user.id)).scalar_one_or_none()
-                    
-                    if thread is None:
-                        print(f"Creating thread for user {user.name}")
-                        thread = Thread(user_id=user.id)
-                        session.add(thread)
-                        session.commit()
-                        print(f"Thread created for {user.name}")
-                    else:
-                        print(f"Thread already exists for {user.name}")
+            # Add some sample messages for each user (also fills in the thread summary)
+            await insert_messages(session, thread.id, [
+                (f"Hello {user.name}! How can I help you today?", False, datetime.utcnow()),
+                ("I'm here to assist you with any questions.", False, datetime.utcnow()),
+            ])
+        
+        await session.flush()
+        print(f"Created {len(users_data)} users with threads and sample messages")
+        print("Available API keys:")
+        for user_data in users_data:
+            print(f"  {user_data['name']}: {user_data['api_key']}")
+    else:
+        # Ensure each user has a default thread, in one statement rather than one query per user
+        now = func.timezone("utc", func.now())
+        result = await session.execute(
+            pg_insert(Thread)
+            .from_select(
+                ["user_id", "is_default", "created_at", "last_message_at"],
+                select(User.id, true(), now, now)
+                .where(~exists().where(Thread.user_id == User.id, Thread.is_default))
+            )
+            .on_conflict_do_nothing(index_elements=[Thread.user_id], index_where=Thread.is_default)
+        )
+        if result.rowcount:
+            print(f"Created threads for {result.rowcount} users")
+        else:
+            print("Users already seeded")
+
+
+async def main():
+    from db_engine import engine
+    
+    async with AsyncSession(engine) as session:
+        await seed_user_if_needed(session)
+        await session.commit()
+    await engine.dispose()
 
 
 if __name__ == "__main__":
-    seed_user_if_needed()
+    asyncio.run(main())
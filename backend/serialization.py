@@ -0,0 +1,62 @@
+"""
+Fast JSON encoding of message rows.
+
+Read endpoints that return many messages select only the columns they need
+as plain row tuples and encode them directly, skipping ORM objects and the
+per-message Pydantic models. The JSON has the same shape as ``MessageRead``.
+
+orjson is used when installed; otherwise the standard library encoder is
+used with the same compact output as FastAPI's JSONResponse.
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+
+from models import Message
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+
+# Columns of a MessageRead, in row order
+MESSAGE_COLUMNS = (Message.id, Message.content, Message.is_from_user, Message.created_at)
+
+
+def select_message_rows():
+    """SELECT of the MessageRead columns as plain tuples"""
+    return select(*MESSAGE_COLUMNS)
+
+
+def message_rows_to_dicts(rows: Iterable[Tuple[int, str, bool, datetime]]) -> List[Dict[str, Any]]:
+    """Turn (id, content, is_from_user, created_at) rows into MessageRead-shaped dicts"""
+    return [
+        {"id": id_, "content": content, "is_from_user": is_from_user, "created_at": created_at}
+        for id_, content, is_from_user, created_at in rows
+    ]
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, with datetimes as ISO 8601"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that encodes with orjson (datetimes as ISO 8601) when available"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
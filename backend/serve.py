@@ -0,0 +1,111 @@
+"""
+Production entrypoint: prefork worker processes that warm up before serving
+and drain before stopping.
+
+    python serve.py --workers 4 --port 8000
+
+The parent process binds the socket and starts the workers (uvicorn's
+multiprocess supervisor); each one imports the app and serves it on the
+shared socket. A worker starts accepting connections only after the app's
+startup, which ends with the warm-up (see warmup.py), so the first requests
+it gets find a full connection pool and prepared statements. GET /ready
+answers 200 from then on.
+
+On SIGTERM a worker drains: /ready turns 503 so that load balancers stop
+sending it requests, while it keeps serving for ``--drain-seconds``. Then
+it stops accepting connections, gives requests in flight up to
+``--graceful-timeout`` seconds to finish (streams still open after that
+are cancelled, and their clients reconnect to another worker), and runs
+the app's shutdown, which stores the last replies and flushes queued
+writes. Stopping the parent stops every worker this way. A second signal
+cuts the drain short.
+
+Settings come from the environment (see settings.py); the options
+override WEB_CONCURRENCY, SERVER_DRAIN_SECONDS and
+SERVER_GRACEFUL_TIMEOUT_SECONDS. With several workers, every worker has
+its own connection pool: size DB_POOL_SIZE accordingly.
+"""
+
+import argparse
+import logging
+import time
+from types import FrameType
+from typing import Optional
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+import settings
+from warmup import DRAINING, readiness
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server whose first exit signal starts a drain instead of stopping at once"""
+
+    def __init__(self, config: uvicorn.Config, drain_seconds: float):
+        super().__init__(config)
+        self.drain_seconds = drain_seconds
+        self.drain_deadline: Optional[float] = None
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        if self.drain_deadline is None and self.drain_seconds > 0:
+            logger.info("Draining for %.1f seconds before shutting down", self.drain_seconds)
+            readiness.set(DRAINING)
+            self.drain_deadline = time.monotonic() + self.drain_seconds
+            return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        # Called every 0.1 s by the server's main loop, which stops once it returns True
+        if self.drain_deadline is not None and time.monotonic() >= self.drain_deadline:
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class DrainingMultiprocess(Multiprocess):
+    """Multiprocess supervisor that stops its workers together, so that they drain at the same time"""
+
+    def shutdown(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        super().shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WEB_CONCURRENCY, help="Worker processes")
+    parser.add_argument(
+        "--drain-seconds", type=float, default=settings.SERVER_DRAIN_SECONDS,
+        help="Seconds a worker keeps serving after SIGTERM while /ready reports it draining",
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=settings.SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        help="Seconds requests in flight get to finish once the worker stops accepting connections",
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+    )
+    server = DrainingServer(config, args.drain_seconds)
+    if args.workers <= 1:
+        server.run()
+        return
+    socket = config.bind_socket()
+    DrainingMultiprocess(config, target=server.run, sockets=[socket]).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Tests for POST /messages/batch
+"""
+
+import requests
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import settings
+
+
+class TestMessageBatch:
+    """Bulk message ingestion"""
+
+    def test_batch_keeps_submission_order(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that ids come back in submission order and the thread stores the messages in it"""
+        sentinel = requests.post(
+            f"{base_url}/messages/batch", json={"messages": [{"content": "Before batch"}]}, headers=charlie_headers
+        ).json()
+        last_id = sentinel["ids"][0]
+        contents = [f"Batch message {i}" for i in range(5)]
+
+        response = requests.post(
+            f"{base_url}/messages/batch",
+            json={"messages": [{"content": content} for content in contents]},
+            headers=charlie_headers,
+        )
+        assert response.status_code == 200
+        result = response.json()
+        assert len(result["ids"]) == 5
+        assert result["ids"] == sorted(result["ids"]), "Ids should follow submission order"
+        assert result["replies"] == [], "No replies unless requested"
+
+        delta = requests.get(f"{base_url}/threads/me", params={"since_id": last_id}, headers=charlie_headers).json()
+        assert [msg["content"] for msg in delta["messages"]] == contents
+
+    def test_batch_with_replies_and_client_timestamps(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that replies are generated per message and client timestamps are kept (as UTC)"""
+        response = requests.post(
+            f"{base_url}/messages/batch",
+            json={
+                "messages": [
+                    {"content": "Written offline", "created_at": "2024-03-01T10:00:00"},
+                    {"content": "Also offline", "created_at": "2024-03-01T12:30:00+02:00"},
+                ],
+                "generate_replies": True,
+            },
+            headers=charlie_headers,
+        )
+        assert response.status_code == 200
+        result = response.json()
+        assert len(result["replies"]) == 2
+        assert [reply["created_at"] for reply in result["replies"]] == ["2024-03-01T10:00:00", "2024-03-01T10:30:00"]
+        assert all(not reply["is_from_user"] for reply in result["replies"])
+        assert result["replies"][0]["id"] > result["ids"][0], "Each reply should follow its message"
+
+    def test_future_timestamps_rejected(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that a message dated in the future rejects the whole batch; a small clock skew is accepted"""
+        # A thread of its own, so the slightly future message does not reorder the default thread
+        thread_id = requests.post(f"{base_url}/threads", json={"title": "Clocks"}, headers=charlie_headers).json()["id"]
+        now = datetime.now(timezone.utc)
+
+        def post(*created_ats: datetime) -> requests.Response:
+            messages = [{"content": "Dated", "created_at": created_at.isoformat()} for created_at in created_ats]
+            return requests.post(
+                f"{base_url}/messages/batch", json={"messages": messages, "thread_id": thread_id}, headers=charlie_headers
+            )
+
+        assert post(now, now + timedelta(days=1)).status_code == 422
+        assert requests.get(f"{base_url}/threads/{thread_id}", headers=charlie_headers).json()["messages"] == [], (
+            "Nothing of a rejected batch should be stored"
+        )
+        assert post(now + timedelta(seconds=10)).status_code == 200
+
+    def test_batch_size_limits(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that empty and oversized batches are rejected"""
+        response = requests.post(f"{base_url}/messages/batch", json={"messages": []}, headers=charlie_headers)
+        assert response.status_code == 422
+
+        too_many = [{"content": "x"}] * (settings.MESSAGE_BATCH_MAX + 1)
+        response = requests.post(f"{base_url}/messages/batch", json={"messages": too_many}, headers=charlie_headers)
+        assert response.status_code == 422
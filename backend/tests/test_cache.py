@@ -0,0 +1,76 @@
+"""
+Unit tests for the in-process TTL/LRU cache and the auth cache built on it
+"""
+
+from cache import TTLCache
+from auth_cache import AuthCache, CachedUser
+
+
+class FakeClock:
+    """Manually advanced monotonic clock"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestTTLCache:
+    """TTL expiry, LRU eviction and counters"""
+
+    def test_entries_expire_after_ttl(self):
+        """Test that an entry is a miss once its TTL has passed"""
+        clock = FakeClock()
+        cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+        cache.set("a", 1)
+
+        assert cache.lookup("a") == (True, 1), "Fresh entry should hit"
+        clock.now = 5.1
+        assert cache.lookup("a") == (False, None), "Expired entry should miss"
+        assert len(cache) == 0, "Expired entry should be dropped"
+
+    def test_least_recently_used_is_evicted(self):
+        """Test that the size bound evicts the least recently used key"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1, "Recently used key should survive"
+        assert cache.get("b") is None, "LRU key should be evicted"
+        assert cache.stats()["evictions"] == 1
+
+    def test_hit_and_miss_counters(self):
+        """Test that lookups are counted"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", None)
+        cache.lookup("a")
+        cache.lookup("missing")
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+
+class TestAuthCache:
+    """Negative caching and invalidation hooks"""
+
+    def test_invalid_keys_are_cached(self):
+        """Test that a known-invalid key is served from the cache"""
+        cache = AuthCache(maxsize=10, ttl=60, negative_ttl=5)
+        cache.store("bad", None)
+
+        assert cache.lookup("bad") == (True, None), "Invalid key should be a cached hit"
+        assert cache.stats()["negative_hits"] == 1
+
+    def test_invalidate_user_drops_their_keys(self):
+        """Test that invalidating a user forgets their cached key"""
+        cache = AuthCache(maxsize=10, ttl=60, negative_ttl=5)
+        cache.store("alice_key_123", CachedUser(1, "Alice", "alice_key_123"))
+        cache.store("bob_key_456", CachedUser(2, "Bob", "bob_key_456"))
+
+        assert cache.invalidate_user(1) == 1
+        assert cache.lookup("alice_key_123") == (False, None), "Alice should be forgotten"
+        assert cache.lookup("bob_key_456")[0], "Bob should still be cached"
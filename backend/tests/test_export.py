@@ -0,0 +1,204 @@
+"""
+Tests for the streaming thread export
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+import requests
+from sqlalchemy import text
+
+from export import export_chunks
+
+MILLION = 1_000_000
+BATCH_ROWS = 1000
+
+
+async def synthetic_thread(rows: int):
+    """Batches of message rows, like a server-side cursor over a ``rows``-message thread"""
+    start = datetime(2024, 1, 1)
+    for first in range(0, rows, BATCH_ROWS):
+        yield [
+            (i, f"Message number {i} of a very long thread", i % 2 == 0, start + timedelta(seconds=i))
+            for i in range(first, min(first + BATCH_ROWS, rows))
+        ]
+
+
+async def asgi_get(app, path: str, query: str, headers: Dict[str, str]) -> Tuple[int, int, int]:
+    """GET through the ASGI app in-process, discarding the body; returns (status, body bytes, body chunks)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    requested = False
+    done = asyncio.Event()
+    response = {"status": 0, "size": 0, "chunks": 0}
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["size"] += len(message.get("body", b""))
+            response["chunks"] += 1
+            if not message.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    return response["status"], response["size"], response["chunks"]
+
+
+def export_peak_memory(format: str, gzip_level: int) -> Tuple[int, int]:
+    """Export a million-row thread, discarding the body; returns (peak traced bytes, body bytes)"""
+
+    async def run():
+        size = 0
+        async for chunk in export_chunks(synthetic_thread(MILLION), format, gzip_level):
+            size += len(chunk)
+        return size
+
+    tracemalloc.start()
+    try:
+        size = asyncio.run(run())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, size
+
+
+class TestExportEncoding:
+    """Encoding of exports, no server needed"""
+
+    def test_formats_round_trip(self):
+        """Test that NDJSON and CSV exports decode back to the rows, header first"""
+
+        async def export(format: str, gzip_level: int = -1) -> bytes:
+            return b"".join([chunk async for chunk in export_chunks(synthetic_thread(2500), format, gzip_level)])
+
+        lines = asyncio.run(export("ndjson")).decode().splitlines()
+        assert len(lines) == 2500
+        assert json.loads(lines[1]) == {
+            "id": 1,
+            "content": "Message number 1 of a very long thread",
+            "is_from_user": False,
+            "created_at": "2024-01-01T00:00:01",
+        }
+
+        rows = list(csv.reader(io.StringIO(gzip.decompress(asyncio.run(export("csv", 6))).decode())))
+        assert rows[0] == ["id", "content", "is_from_user", "created_at"]
+        assert rows[1] == ["0", "Message number 0 of a very long thread", "true", "2024-01-01T00:00:00"]
+        assert len(rows) == 2501
+
+    def test_empty_csv_has_header(self):
+        """Test that an empty thread still exports the CSV header"""
+
+        async def export():
+            return b"".join([chunk async for chunk in export_chunks(synthetic_thread(0), "csv")])
+
+        assert asyncio.run(export()) == b"id,content,is_from_user,created_at\r\n"
+
+    def test_million_rows_in_constant_memory(self):
+        """Test that exporting a million-row thread never holds more than a few batches"""
+        peak, size = export_peak_memory("ndjson", gzip_level=6)
+
+        # Uncompressed, the body is about 120 MB; one batch of rows is a few hundred kilobytes
+        assert size > 5_000_000
+        assert peak < 5_000_000, f"Peak traced memory {peak / 1e6:.1f} MB"
+
+
+class TestThreadExport:
+    def test_endpoint_streams_from_database(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that GET /threads/me/export streams a large thread from the database in constant memory"""
+        # In-process, so the memory is traced where the rows are read
+        import db_engine
+        from main import app
+
+        rows = 200_000
+        thread_id = requests.post(f"{base_url}/threads", json={"title": "Export"}, headers=charlie_headers).json()["id"]
+
+        async def run():
+            async with db_engine.engine.begin() as connection:
+                await connection.execute(
+                    text(
+                        "INSERT INTO message (thread_id, content, is_from_user, created_at) "
+                        "SELECT :thread_id, 'Message number ' || i || ' of a very long thread', i % 2 = 0, "
+                        "now() - interval '1 hour' + i * interval '1 millisecond' "
+                        "FROM generate_series(1, :rows) AS i"
+                    ),
+                    {"thread_id": thread_id, "rows": rows},
+                )
+            try:
+                tracemalloc.start()
+                try:
+                    status, size, chunks = await asgi_get(
+                        app, "/threads/me/export", f"thread_id={thread_id}", charlie_headers
+                    )
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                return status, size, chunks, peak
+            finally:
+                async with db_engine.engine.begin() as connection:
+                    await connection.execute(text("DELETE FROM message WHERE thread_id = :id"), {"id": thread_id})
+                    await connection.execute(text("DELETE FROM thread WHERE id = :id"), {"id": thread_id})
+                await db_engine.engine.dispose()
+
+        status, size, chunks, peak = asyncio.run(run())
+        assert status == 200
+        assert chunks > 10, "The body should go out in many chunks, not all at once"
+        assert size > 20 * 1024 * 1024
+        assert peak < 8 * 1024 * 1024, f"Peak traced memory {peak} bytes for a {size}-byte body"
+
+    def test_export_matches_thread(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that the NDJSON export holds the thread's messages, oldest first"""
+        requests.post(f"{base_url}/messages", json={"content": "Export me"}, headers=charlie_headers)
+        thread = requests.get(f"{base_url}/threads/me", params={"limit": 200}, headers=charlie_headers).json()
+
+        response = requests.get(f"{base_url}/threads/me/export", headers=charlie_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert "attachment" in response.headers["content-disposition"]
+        exported = [json.loads(line) for line in response.text.splitlines()]
+        assert exported[-len(thread["messages"]):] == thread["messages"]
+
+    def test_gzip_csv_with_query_key(self, base_url: str, api_keys: Dict[str, str]):
+        """Test a compressed CSV export authenticated with the api_key query parameter"""
+        response = requests.get(
+            f"{base_url}/threads/me/export",
+            params={"format": "csv", "gzip": "true", "api_key": api_keys["bob"]},
+            stream=True,
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        raw = response.raw.read()
+        assert raw[:2] == b"\x1f\x8b"
+        assert gzip.decompress(raw).startswith(b"id,content,is_from_user,created_at\r\n")
+
+    def test_rejections(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that unknown formats and missing keys are refused"""
+        response = requests.get(f"{base_url}/threads/me/export", params={"format": "xml"}, headers=bob_headers)
+        assert response.status_code == 422
+        assert requests.get(f"{base_url}/threads/me/export").status_code == 401
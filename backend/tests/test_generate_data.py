@@ -0,0 +1,135 @@
+"""
+Tests for the synthetic data generator
+"""
+
+import asyncio
+import random
+import secrets
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import generate_data
+from db_engine import create_engine_from_settings
+
+
+def generated_counts(prefix: str):
+    """(users, threads, default threads, messages, threads whose summary disagrees with their messages)"""
+
+    async def run():
+        engine = create_engine_from_settings()
+        try:
+            async with engine.connect() as conn:
+                return tuple((await conn.execute(text("""
+                    WITH users AS (SELECT id FROM "user" WHERE left(api_key, length(:prefix) + 1) = :prefix || '_'),
+                    threads AS (SELECT * FROM thread WHERE user_id IN (SELECT id FROM users))
+                    SELECT
+                        (SELECT count(*) FROM users),
+                        (SELECT count(*) FROM threads),
+                        (SELECT count(*) FROM threads WHERE is_default),
+                        (SELECT count(*) FROM message WHERE thread_id IN (SELECT id FROM threads)),
+                        (SELECT count(*) FROM threads WHERE message_count
+                            <> (SELECT count(*) FROM message WHERE message.thread_id = threads.id))
+                """), {"prefix": prefix})).one())
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def delete_generated(prefix: str) -> None:
+    async def run():
+        engine = create_engine_from_settings()
+        try:
+            async with engine.begin() as conn:
+                users = """SELECT id FROM "user" WHERE left(api_key, length(:prefix) + 1) = :prefix || '_'"""
+                threads = f"SELECT id FROM thread WHERE user_id IN ({users})"
+                await conn.execute(text(f"DELETE FROM message WHERE thread_id IN ({threads})"), {"prefix": prefix})
+                await conn.execute(text(f"DELETE FROM thread WHERE user_id IN ({users})"), {"prefix": prefix})
+                await conn.execute(text(f'DELETE FROM "user" WHERE id IN ({users})'), {"prefix": prefix})
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+class TestDistributions:
+    """Row counts and shapes, no database needed"""
+
+    @pytest.mark.parametrize("dist", ["uniform", "zipf"])
+    def test_messages_per_thread_adds_up(self, dist: str):
+        """Test that every message is dealt to some thread"""
+        counts = generate_data.messages_per_thread(10_007, 13, dist)
+        assert len(counts) == 13
+        assert sum(counts) == 10_007
+        if dist == "zipf":
+            assert counts[0] > 5 * counts[-1]
+        else:
+            assert max(counts) - min(counts) <= 1
+
+    @pytest.mark.parametrize("dist", ["uniform", "bursty"])
+    def test_timestamps_are_increasing_within_span(self, dist: str):
+        """Test that a thread's timestamps are ordered and stay inside the requested span"""
+        start = datetime(2024, 1, 1)
+        end = start + timedelta(days=30)
+        timestamps = list(generate_data.message_timestamps(5000, start, end, dist, random.Random(1)))
+        assert len(timestamps) == 5000
+        assert timestamps == sorted(timestamps)
+        assert start <= timestamps[0] and timestamps[-1] <= end
+
+
+class TestGenerate:
+    @pytest.mark.parametrize("method", ["copy", "executemany"])
+    def test_generates_requested_rows(self, monkeypatch: pytest.MonkeyPatch, method: str):
+        """Test that a run creates exactly the requested users, threads and messages, with correct summaries"""
+        prefix = f"gentest_{secrets.token_hex(3)}"
+        monkeypatch.setattr(sys, "argv", [
+            "generate_data.py", "--users", "5", "--threads", "8", "--messages", "1234",
+            "--thread-dist", "zipf", "--days", "20", "--method", method, "--batch-size", "100",
+            "--prefix", prefix, "--seed", "7",
+        ])
+        try:
+            asyncio.run(generate_data.generate(generate_data.parse_args()))
+            users, threads, defaults, messages, stale_summaries = generated_counts(prefix)
+        finally:
+            delete_generated(prefix)
+
+        assert (users, threads, defaults, messages) == (5, 8, 5, 1234)
+        assert stale_summaries == 0
+
+    def test_only_generated_users_get_threads(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that users whose keys merely look like the prefix (as a LIKE pattern) are left alone"""
+        prefix = f"gentest_{secrets.token_hex(3)}"
+        # "_" in a LIKE pattern matches any character
+        decoy = prefix.replace("_", "X")
+        monkeypatch.setattr(sys, "argv", [
+            "generate_data.py", "--users", "2", "--messages", "10", "--days", "5", "--prefix", prefix, "--seed", "7",
+        ])
+
+        async def decoy_threads(create: bool) -> int:
+            engine = create_engine_from_settings()
+            try:
+                async with engine.begin() as conn:
+                    if create:
+                        await conn.execute(
+                            text("""INSERT INTO "user" (name, api_key) VALUES ('Decoy', :key || '_1')"""), {"key": decoy}
+                        )
+                    return (await conn.execute(text(
+                        """SELECT count(*) FROM thread JOIN "user" ON "user".id = thread.user_id WHERE api_key = :key || '_1'"""
+                    ), {"key": decoy})).scalar_one()
+            finally:
+                await engine.dispose()
+
+        asyncio.run(decoy_threads(create=True))
+        try:
+            asyncio.run(generate_data.generate(generate_data.parse_args()))
+            threads = asyncio.run(decoy_threads(create=False))
+            counts = generated_counts(prefix)
+        finally:
+            delete_generated(prefix)
+            delete_generated(decoy)
+
+        assert threads == 0
+        assert counts[:3] == (2, 2, 2)
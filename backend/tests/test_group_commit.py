@@ -0,0 +1,122 @@
+"""
+Unit tests for the group-commit message writer
+"""
+
+import asyncio
+
+import pytest
+
+from group_commit import GroupCommitWriter
+
+
+class FakeRow:
+    def __init__(self, id: int, thread_id: int, content: str):
+        self.id = id
+        self.thread_id = thread_id
+        self.content = content
+
+
+class FakeWrites:
+    """Stands in for the database: numbers rows, fails on content "bad" """
+
+    def __init__(self):
+        self.next_id = 1
+        self.transactions = []
+
+    async def __call__(self, engine, inserts):
+        rows = [(insert.thread_id, *row) for insert in inserts for row in insert.rows]
+        self.transactions.append(len(rows))
+        if any(row[1] == "bad" for row in rows):
+            raise ValueError("bad row")
+        inserted = []
+        for thread_id, content, _, _ in rows:
+            inserted.append(FakeRow(self.next_id, thread_id, content))
+            self.next_id += 1
+        return inserted
+
+
+def run_writer(writes: FakeWrites, requests, window: float = 0.01, max_rows: int = 100):
+    """Send ``(thread_id, contents)`` requests concurrently; returns their outcomes"""
+
+    async def run():
+        writer = GroupCommitWriter(None, window=window, max_rows=max_rows, write=writes)
+        await writer.start()
+        try:
+            return await asyncio.gather(
+                *(writer.insert(thread_id, [(content, True, None) for content in contents])
+                  for thread_id, contents in requests),
+                return_exceptions=True,
+            ), writer.stats()
+        finally:
+            await writer.stop()
+
+    return asyncio.run(run())
+
+
+class TestGroupCommitWriter:
+    def test_concurrent_requests_share_a_commit(self):
+        """Test that concurrent inserts are written together and each gets its own rows back"""
+        writes = FakeWrites()
+        results, stats = run_writer(writes, [(1, ["a1", "a2"]), (2, ["b1"]), (1, ["a3"])])
+
+        assert writes.transactions == [4]
+        assert [[row.content for row in rows] for rows in results] == [["a1", "a2"], ["b1"], ["a3"]]
+        assert [row.thread_id for row in results[1]] == [2]
+        assert stats["batches"] == 1 and stats["rows_written"] == 4
+
+    def test_batches_respect_max_rows(self):
+        """Test that a batch stops at max_rows, without splitting a request"""
+        writes = FakeWrites()
+        results, _ = run_writer(writes, [(1, ["a", "b"]), (2, ["c", "d"]), (3, ["e"])], max_rows=3)
+
+        assert writes.transactions == [2, 3]
+        assert [row.id for rows in results for row in rows] == [1, 2, 3, 4, 5]
+
+    def test_failing_request_fails_alone(self):
+        """Test that a failed batch is retried per request, so only the bad one fails"""
+        writes = FakeWrites()
+        results, stats = run_writer(writes, [(1, ["fine"]), (2, ["bad"]), (3, ["also fine"])])
+
+        assert writes.transactions == [3, 1, 1, 1]
+        assert [row.content for row in results[0]] == ["fine"]
+        assert isinstance(results[1], ValueError)
+        assert [row.content for row in results[2]] == ["also fine"]
+        assert stats["isolated_failures"] == 1
+
+    def test_insert_requires_start(self):
+        """Test that a writer that is not running refuses inserts instead of hanging"""
+        writer = GroupCommitWriter(None, window=0.01, max_rows=10, write=FakeWrites())
+        with pytest.raises(RuntimeError):
+            asyncio.run(writer.insert(1, [("a", True, None)]))
+
+    def test_stop_waits_for_batch_being_written(self):
+        """Test that stop() returns only once the batch in progress, and anything queued behind it, is written"""
+        events = []
+        futures = []
+        writing = None
+
+        async def slow_writes(engine, inserts):
+            futures.extend(insert.future for insert in inserts)
+            events.append("write start")
+            writing.set()
+            await asyncio.sleep(0.3)
+            events.append("write done")
+            return [FakeRow(i, insert.thread_id, row[0]) for i, insert in enumerate(inserts) for row in insert.rows]
+
+        async def run():
+            nonlocal writing
+            writing = asyncio.Event()
+            writer = GroupCommitWriter(None, window=0, max_rows=10, write=slow_writes)
+            await writer.start()
+            first = asyncio.ensure_future(writer.insert(1, [("a", True, None)]))
+            await writing.wait()
+            queued = asyncio.ensure_future(writer.insert(2, [("b", True, None)]))
+            await asyncio.sleep(0)
+            await writer.stop()
+            events.append("stop returned")
+            return all(future.done() for future in futures), [row.content for row in await first + await queued]
+
+        done, contents = asyncio.run(run())
+        assert events == ["write start", "write done", "write start", "write done", "stop returned"]
+        assert done, "Every caller's future should be resolved when stop() returns"
+        assert contents == ["a", "b"]
@@ -0,0 +1,189 @@
+"""
+Tests for Idempotency-Key support on POST /messages
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import pytest
+import requests
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_engine import create_engine_from_settings
+from idempotency import IdempotencyStore
+
+
+def post_message(base_url: str, headers: Dict[str, str], key: str, content: str, **params) -> requests.Response:
+    return requests.post(
+        f"{base_url}/messages",
+        json={"content": content},
+        headers={**headers, "Idempotency-Key": key},
+        params=params,
+    )
+
+
+def newest_message_id(base_url: str, headers: Dict[str, str]) -> int:
+    return requests.get(f"{base_url}/threads/me", params={"limit": 1}, headers=headers).json()["messages"][-1]["id"]
+
+
+class TestIdempotencyKeys:
+    def test_retry_replays_first_response(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that a retry gets the first response back without storing anything"""
+        key = str(uuid.uuid4())
+        first = post_message(base_url, bob_headers, key, "Sent twice")
+        assert first.status_code == 200
+        assert "Idempotent-Replayed" not in first.headers
+        newest = newest_message_id(base_url, bob_headers)
+
+        retry = post_message(base_url, bob_headers, key, "Sent twice")
+        assert retry.status_code == 200
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.json() == first.json()
+        assert newest_message_id(base_url, bob_headers) == newest
+
+    def test_streamed_retry(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that a streaming retry replays the stored messages as NDJSON events"""
+        key = str(uuid.uuid4())
+        first = post_message(base_url, bob_headers, key, "Streamed twice").json()
+
+        retry = post_message(base_url, bob_headers, key, "Streamed twice", stream="true")
+        events = [json.loads(line) for line in retry.text.splitlines()]
+        assert events == [
+            {"type": "user_message", "message": first["user_message"]},
+            {"type": "bot_message", "message": first["bot_message"]},
+        ]
+
+    def test_concurrent_duplicates_store_once(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that duplicates sent at the same time wait for one request instead of racing it"""
+        key = str(uuid.uuid4())
+        newest = newest_message_id(base_url, charlie_headers)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(
+                lambda _: post_message(base_url, charlie_headers, key, "Sent by an impatient client"), range(8)
+            ))
+
+        assert all(response.status_code == 200 for response in responses)
+        bodies = [response.json() for response in responses]
+        assert all(body == bodies[0] for body in bodies)
+        assert sum("Idempotent-Replayed" not in response.headers for response in responses) == 1
+
+        added = requests.get(
+            f"{base_url}/threads/me", params={"since_id": newest}, headers=charlie_headers
+        ).json()["messages"]
+        assert [message["id"] for message in added] == [
+            bodies[0]["user_message"]["id"], bodies[0]["bot_message"]["id"]
+        ]
+
+    def test_invalid_keys(self, base_url: str, alice_headers: Dict[str, str], bob_headers: Dict[str, str]):
+        """Test that a key reused for another message, or too long, is rejected"""
+        key = str(uuid.uuid4())
+        assert post_message(base_url, alice_headers, key, "Original").status_code == 200
+        assert post_message(base_url, alice_headers, key, "Something else").status_code == 422
+        # Keys belong to one user
+        assert post_message(base_url, bob_headers, key, "Something else").status_code == 200
+
+        assert post_message(base_url, alice_headers, "k" * 256, "Too long a key").status_code == 422
+
+    def test_abandoned_claim_is_taken_over(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that a claim whose request died is taken over instead of answered with 409"""
+        user_id = requests.get(f"{base_url}/users/me", headers=bob_headers).json()["id"]
+        key = str(uuid.uuid4())
+
+        async def run():
+            engine = create_engine_from_settings()
+            # Two workers; the first one claims the key and dies before storing a response
+            dead, alive = (
+                IdempotencyStore(engine, ttl=60, cache_size=10, wait=10, abandon_after=0.5) for _ in range(2)
+            )
+            try:
+                async with AsyncSession(engine) as session:
+                    assert await dead.begin(session, user_id, key, "request") is None
+                    await session.commit()
+
+                started = time.monotonic()
+                async with AsyncSession(engine) as session:
+                    claimed = await alive.begin(session, user_id, key, "request")
+                    await session.commit()
+                alive.release(user_id, key)
+                await alive.stop()
+                return claimed, time.monotonic() - started, alive.stats()
+            finally:
+                await engine.dispose()
+
+        claimed, waited, stats = asyncio.run(run())
+        assert claimed is None, "The abandoned claim should be taken over"
+        assert waited < 5
+        assert stats["claims"] == 1 and stats["waits"] == 1
+
+    def test_request_cancelled_while_publishing_gives_back_key_and_reply_slot(
+        self, monkeypatch: pytest.MonkeyPatch, bob_headers: Dict[str, str]
+    ):
+        """Test that a request cancelled after storing its message releases its reply slot and its key"""
+        # In-process, so the request can be cancelled at a known point
+        import main
+
+        key = str(uuid.uuid4())
+        publishing = None
+
+        async def stuck_publish(channel, events):
+            publishing.set()
+            await asyncio.Event().wait()
+
+        monkeypatch.setattr(main.event_backend, "publish", stuck_publish)
+
+        async def run():
+            nonlocal publishing
+            publishing = asyncio.Event()
+            body = json.dumps({"content": "Cancelled while publishing"}).encode()
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "POST",
+                "scheme": "http",
+                "path": "/messages",
+                "raw_path": b"/messages",
+                "query_string": b"",
+                "root_path": "",
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"x-api-key", bob_headers["X-API-Key"].encode()),
+                    (b"idempotency-key", key.encode()),
+                ],
+                "client": ("127.0.0.1", 50000),
+                "server": ("testserver", 80),
+            }
+            received = False
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                await asyncio.Event().wait()
+
+            async def send(message):
+                pass
+
+            pending = main.responder_pool.stats()["pending"]
+            request = asyncio.ensure_future(main.app(scope, receive, send))
+            try:
+                await asyncio.wait_for(publishing.wait(), 10)
+                in_flight = main.idempotency.stats()["in_flight"]
+                request.cancel()
+                await asyncio.gather(request, return_exceptions=True)
+                # Let the release delete the claim
+                await main.idempotency.stop()
+                return pending, in_flight, main.responder_pool.stats()["pending"], main.idempotency.stats()
+            finally:
+                await main.engine.dispose()
+
+        before, in_flight, after, stats = asyncio.run(run())
+        assert in_flight == 1
+        assert after == before, "The reserved reply slot should be given back"
+        assert stats["in_flight"] == 0 and stats["released"] == 1
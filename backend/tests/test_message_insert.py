@@ -0,0 +1,102 @@
+"""
+Tests for the single-statement message insert and the atomic default-thread upsert
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from db_engine import create_engine_from_settings
+from models import Thread, User
+from queries import get_or_create_thread_id, insert_messages
+
+
+async def create_user(engine: AsyncEngine) -> int:
+    async with AsyncSession(engine) as session:
+        user = User(name="Insert probe", api_key=f"insert_{uuid.uuid4().hex[:20]}")
+        session.add(user)
+        await session.flush()
+        user_id = user.id
+        await session.commit()
+        return user_id
+
+
+async def delete_user(engine: AsyncEngine, user_id: int) -> None:
+    async with engine.begin() as conn:
+        await conn.execute(
+            text("DELETE FROM message WHERE thread_id IN (SELECT id FROM thread WHERE user_id = :id)"), {"id": user_id}
+        )
+        await conn.execute(text("DELETE FROM thread WHERE user_id = :id"), {"id": user_id})
+        await conn.execute(text('DELETE FROM "user" WHERE id = :id'), {"id": user_id})
+
+
+class TestMessageInsert:
+    def test_messages_and_summary_in_one_statement(self):
+        """Test that a user message and its reply are inserted, and the summary updated, by one statement"""
+        statements: List[str] = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        async def run():
+            engine = create_engine_from_settings()
+            user_id = await create_user(engine)
+            try:
+                async with AsyncSession(engine) as session:
+                    thread_id = await get_or_create_thread_id(session, user_id)
+                    now = datetime.utcnow()
+                    rows = [("Question", True, now), ("Answer", False, now + timedelta(milliseconds=1))]
+
+                    event.listen(engine.sync_engine, "before_cursor_execute", record)
+                    inserted = await insert_messages(session, thread_id, rows)
+                    event.remove(engine.sync_engine, "before_cursor_execute", record)
+                    await session.commit()
+
+                    summary = (
+                        await session.execute(
+                            select(Thread.message_count, Thread.last_message_at, Thread.last_message_preview)
+                            .where(Thread.id == thread_id)
+                        )
+                    ).one()
+                return rows, inserted, summary
+            finally:
+                await delete_user(engine, user_id)
+                await engine.dispose()
+
+        rows, inserted, summary = asyncio.run(run())
+        assert len(statements) == 1, statements
+        assert [(row.content, row.is_from_user) for row in inserted] == [("Question", True), ("Answer", False)]
+        assert inserted[0].id < inserted[1].id
+        assert tuple(summary) == (2, rows[1][2], "Answer")
+
+    def test_concurrent_first_messages_share_one_thread(self):
+        """Test that racing get-or-creates of a new user's default thread all get the same single thread"""
+
+        async def run():
+            engine = create_engine_from_settings()
+            user_id = await create_user(engine)
+            try:
+
+                async def get_or_create() -> int:
+                    async with AsyncSession(engine) as session:
+                        return await get_or_create_thread_id(session, user_id)
+
+                thread_ids = await asyncio.gather(*(get_or_create() for _ in range(8)))
+                async with AsyncSession(engine) as session:
+                    defaults = (
+                        await session.execute(
+                            select(func.count()).where(Thread.user_id == user_id, Thread.is_default)
+                        )
+                    ).scalar_one()
+                return thread_ids, defaults
+            finally:
+                await delete_user(engine, user_id)
+                await engine.dispose()
+
+        thread_ids, defaults = asyncio.run(run())
+        assert len(set(thread_ids)) == 1
+        assert defaults == 1
@@ -0,0 +1,53 @@
+"""
+Tests for request metrics, /metrics and the Server-Timing header
+"""
+
+import requests
+from typing import Dict
+
+from metrics import Metrics, RequestStats
+
+
+class TestMetricsRegistry:
+    """Unit tests for the Prometheus rendering, no server needed"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that each bucket counts every observation at or below its bound"""
+        metrics = Metrics(query_budget=0)
+        for duration in (0.001, 0.02, 3.0):
+            metrics.record_request("GET", "/users", 200, duration, RequestStats())
+
+        text = metrics.render()
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/users",le="0.005"} 1' in text
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/users",le="0.025"} 2' in text
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/users",le="+Inf"} 3' in text
+        assert 'http_requests_total{method="GET",route="/users",status="200"} 3' in text
+
+    def test_query_budget_flags_request(self):
+        """Test that requests over the query budget are counted"""
+        metrics = Metrics(query_budget=3)
+        stats = RequestStats()
+        stats.queries = 4
+        metrics.record_request("GET", "/threads/me", 200, 0.01, stats)
+        metrics.record_request("GET", "/threads/me", 200, 0.01, RequestStats())
+
+        assert 'http_requests_over_query_budget_total{method="GET",route="/threads/me"} 1' in metrics.render()
+
+
+class TestMetricsEndpoint:
+    """Metrics collected by the running server"""
+
+    def test_server_timing_and_metrics(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that responses carry Server-Timing and routes show up in /metrics by template"""
+        response = requests.get(f"{base_url}/threads/me", params={"limit": 1}, headers=alice_headers)
+        assert response.status_code == 200
+        timing = response.headers.get("Server-Timing", "")
+        assert timing.startswith("db;dur="), "Should report database time"
+        assert "queries" in timing, "Should report the query count"
+
+        response = requests.get(f"{base_url}/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'http_requests_total{method="GET",route="/threads/me",status="200"}' in response.text
+        assert "db_query_duration_seconds_count" in response.text
+        assert "db_pool_checked_out" in response.text
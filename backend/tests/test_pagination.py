@@ -0,0 +1,78 @@
+"""
+Keyset pagination tests for /threads/me
+"""
+
+import time
+
+import pytest
+import requests
+from typing import Dict
+
+from pagination import encode_cursor
+
+
+def get_page(url: str, params: Dict, headers: Dict[str, str]) -> requests.Response:
+    """GET a page, waiting out the read rate limit: walking a long history takes many requests"""
+    while True:
+        response = requests.get(url, params=params, headers=headers)
+        if response.status_code != 429:
+            return response
+        time.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+class TestThreadPagination:
+    """Cursor-based paging through a thread's message history"""
+
+    def test_limit_returns_newest_page(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that a limited page holds the newest messages in chronological order"""
+        requests.post(f"{base_url}/messages", json={"content": "Pagination probe"}, headers=alice_headers)
+
+        response = requests.get(f"{base_url}/threads/me", params={"limit": 2}, headers=alice_headers)
+        assert response.status_code == 200, "Should be able to fetch a page"
+
+        page = response.json()
+        assert len(page["messages"]) == 2, "Page should respect the limit"
+        assert page["messages"][0]["content"] == "Pagination probe", "Page should end with the newest exchange"
+        assert page["next_cursor"] is not None, "Older messages should be reachable through a cursor"
+
+    def test_pages_do_not_overlap(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that walking the cursor visits every message exactly once, oldest page last"""
+        full = requests.get(f"{base_url}/threads/me", params={"limit": 200}, headers=bob_headers).json()
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 3}
+            if cursor:
+                params["before"] = cursor
+            page = get_page(f"{base_url}/threads/me", params, bob_headers).json()
+            seen = page["messages"] + seen
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        expected = [msg["id"] for msg in full["messages"]]
+        assert [msg["id"] for msg in seen][-len(expected):] == expected, "Pages should stitch into the full history"
+        assert len({msg["id"] for msg in seen}) == len(seen), "No message should appear twice"
+
+    def test_invalid_cursor_rejected(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that a malformed cursor is a client error"""
+        response = requests.get(f"{base_url}/threads/me", params={"before": "not-a-cursor"}, headers=alice_headers)
+        assert response.status_code == 400, "Should reject malformed cursor"
+
+    @pytest.mark.parametrize("key", [
+        ("2030-01-01T00:00:00+00:00", 5),
+        ("2030-01-01T00:00:00", 1099511627776),
+    ])
+    def test_out_of_range_cursor_rejected(self, base_url: str, alice_headers: Dict[str, str], key):
+        """Test that a well-formed cursor the database could not compare against is a client error"""
+        response = requests.get(
+            f"{base_url}/threads/me", params={"before": encode_cursor(*key)}, headers=alice_headers
+        )
+        assert response.status_code == 400, "Should reject an aware timestamp or an id beyond INTEGER"
+
+    @pytest.mark.parametrize("limit", [0, 10_000])
+    def test_limit_bounds(self, base_url: str, alice_headers: Dict[str, str], limit: int):
+        """Test that out-of-range limits are rejected"""
+        response = requests.get(f"{base_url}/threads/me", params={"limit": limit}, headers=alice_headers)
+        assert response.status_code == 422, "Should reject out-of-range limit"
@@ -0,0 +1,31 @@
+"""
+Unit tests for monthly message partition naming and month arithmetic
+"""
+
+from datetime import date
+
+from partitions import add_months, months_between, partition_month, partition_name
+
+
+class TestPartitionMonths:
+    """Pure helpers, no database needed"""
+
+    def test_add_months_crosses_years(self):
+        """Test that month arithmetic wraps around year boundaries both ways"""
+        assert add_months(date(2024, 11, 1), 2) == date(2025, 1, 1)
+        assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+        assert add_months(date(2024, 5, 1), -17) == date(2022, 12, 1)
+
+    def test_months_between_includes_both_ends(self):
+        """Test that a range of months starts and ends at the months of its dates"""
+        assert months_between(date(2024, 11, 20), date(2025, 2, 3)) == [
+            date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1), date(2025, 2, 1),
+        ]
+        assert months_between(date(2025, 2, 1), date(2025, 1, 31)) == []
+
+    def test_partition_names_round_trip(self):
+        """Test that partition names sort by month and map back to it"""
+        assert partition_name(date(2024, 3, 1)) == "message_p2024_03"
+        assert partition_month("message_p2024_03") == date(2024, 3, 1)
+        assert partition_month("message_default") is None
+        assert partition_month("message_p2024_03_old") is None
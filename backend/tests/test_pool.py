@@ -0,0 +1,72 @@
+"""
+Tests for the settings-driven engine factory and its pool statistics
+"""
+
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import settings
+from db_engine import InstrumentedAsyncQueuePool, create_engine_from_settings, pool_status
+
+
+class TestEnginePool:
+    def test_settings_reach_pool_and_driver(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that the pool and statement cache settings are the ones the engine uses"""
+        for name, value in {
+            "DB_POOL_SIZE": 3,
+            "DB_MAX_OVERFLOW": 2,
+            "DB_POOL_TIMEOUT": 7.5,
+            "DB_POOL_PRE_PING": True,
+            "DB_POOL_RECYCLE": 600,
+            "DB_PREPARED_STATEMENT_CACHE_SIZE": 17,
+            "DB_STATEMENT_CACHE_SIZE": 23,
+        }.items():
+            monkeypatch.setattr(settings, name, value)
+
+        async def run():
+            engine = create_engine_from_settings()
+            try:
+                async with engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    caches = (raw.dbapi_connection._prepared_statement_cache.capacity,
+                              raw.driver_connection._stmt_cache.get_max_size())
+                    status = pool_status(engine)
+                return engine.pool, caches, status
+            finally:
+                await engine.dispose()
+
+        pool, caches, status = asyncio.run(run())
+        assert isinstance(pool, InstrumentedAsyncQueuePool)
+        assert (pool.size(), pool._max_overflow, pool.timeout()) == (3, 2, 7.5)
+        assert pool._pre_ping and pool._recycle == 600
+        assert caches == (17, 23)
+        assert status["size"] == 3 and status["max_overflow"] == 2
+        assert status["checked_out"] == 1 and status["checkouts"] == 1
+
+    def test_exhausted_pool_times_out_and_is_counted(self, monkeypatch: pytest.MonkeyPatch):
+        """Test that a checkout beyond size + overflow fails after DB_POOL_TIMEOUT and shows up in the stats"""
+        monkeypatch.setattr(settings, "DB_POOL_SIZE", 1)
+        monkeypatch.setattr(settings, "DB_MAX_OVERFLOW", 0)
+        monkeypatch.setattr(settings, "DB_POOL_TIMEOUT", 0.2)
+
+        async def run():
+            engine = create_engine_from_settings()
+            try:
+                async with engine.connect():
+                    started = time.monotonic()
+                    with pytest.raises(PoolTimeoutError):
+                        async with engine.connect():
+                            pass
+                    waited = time.monotonic() - started
+                return waited, pool_status(engine)
+            finally:
+                await engine.dispose()
+
+        waited, status = asyncio.run(run())
+        assert 0.15 < waited < 2
+        assert status["timeouts"] == 1
+        assert status["checkouts"] == 1
+        assert status["checked_out"] == 0 and status["idle"] == 1
@@ -0,0 +1,126 @@
+"""
+Tests for token-bucket rate limiting and admission control
+"""
+
+import asyncio
+
+import pytest
+import requests
+from typing import Dict
+
+from ratelimit import AdmissionControl, AdmissionRejected, MemoryBucketStore, RateLimit, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FailingStore:
+    async def take(self, key, limit, cost=1.0):
+        raise ConnectionError("store unavailable")
+
+
+class TestTokenBuckets:
+    """Bucket arithmetic and limiter behaviour, no server needed"""
+
+    def test_burst_then_refill(self):
+        """Test that a bucket allows its capacity at once, then the refill rate"""
+        clock = FakeClock()
+        store = MemoryBucketStore(clock=clock)
+        limit = RateLimit(capacity=3, refill_per_second=2)
+
+        async def take():
+            return await store.take("alice", limit)
+
+        decisions = [asyncio.run(take()) for _ in range(4)]
+        assert [d.allowed for d in decisions] == [True, True, True, False]
+        assert decisions[-1].retry_after == pytest.approx(0.5)
+
+        clock.now = 0.5
+        assert asyncio.run(take()).allowed, "Half a second refills one token"
+        assert not asyncio.run(take()).allowed
+
+        clock.now = 100.0
+        assert [asyncio.run(take()).allowed for _ in range(4)] == [True, True, True, False], \
+            "Refill stops at the capacity"
+
+    def test_cost_beyond_capacity_leaves_debt(self):
+        """Test that a request costing more than the capacity drains the bucket below zero"""
+        clock = FakeClock()
+        store = MemoryBucketStore(clock=clock)
+        limit = RateLimit(capacity=3, refill_per_second=2)
+
+        async def take(cost):
+            return await store.take("alice", limit, cost)
+
+        batch = asyncio.run(take(5))
+        assert batch.allowed and batch.remaining == pytest.approx(-2)
+
+        refused = asyncio.run(take(1))
+        assert not refused.allowed
+        assert refused.retry_after == pytest.approx(1.5), "The debt is paid back before the next token"
+
+        clock.now = 1.5
+        assert asyncio.run(take(1)).allowed
+
+    def test_read_and_write_budgets_are_separate(self):
+        """Test that spending the write budget leaves reads and other users alone"""
+        limiter = RateLimiter(
+            MemoryBucketStore(clock=FakeClock()),
+            read=RateLimit(capacity=5, refill_per_second=1),
+            write=RateLimit(capacity=1, refill_per_second=1),
+        )
+
+        async def run():
+            return [
+                (await limiter.check("user:1", write=True)).allowed,
+                (await limiter.check("user:1", write=True)).allowed,
+                (await limiter.check("user:1", write=False)).allowed,
+                (await limiter.check("user:2", write=True)).allowed,
+            ]
+
+        assert asyncio.run(run()) == [True, False, True, True]
+        assert limiter.limited == 1
+
+    def test_store_failure_lets_requests_through(self):
+        """Test that the limiter fails open when its store is down"""
+        limiter = RateLimiter(FailingStore(), read=RateLimit(1, 1), write=RateLimit(1, 1))
+        assert asyncio.run(limiter.check("user:1", write=True)).allowed
+        assert limiter.errors == 1
+
+
+class TestAdmissionControl:
+    def test_rejects_when_full(self):
+        """Test that requests beyond the cap wait, then get rejected"""
+        control = AdmissionControl(max_in_flight=2, wait=0.05)
+
+        async def run():
+            first = await control.acquire()
+            await control.acquire()
+            with pytest.raises(AdmissionRejected):
+                await control.acquire()
+            first.release()
+            first.release()  # releasing twice gives back one slot only
+            await control.acquire()
+            with pytest.raises(AdmissionRejected):
+                await control.acquire()
+
+        asyncio.run(run())
+        assert control.stats()["rejected"] == 2
+        assert control.stats()["in_flight"] == 2
+
+
+class TestRateLimitEndpoint:
+    def test_rate_limit_stats(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that authenticated requests are counted by the limiter and admission control"""
+        requests.get(f"{base_url}/users/me", headers=alice_headers)
+        response = requests.get(f"{base_url}/debug/rate-limit")
+        assert response.status_code == 200
+        stats = response.json()
+        assert stats["admission"]["admitted"] >= 1
+        if stats["rate_limit"] is not None:
+            assert stats["rate_limit"]["allowed"] >= 1
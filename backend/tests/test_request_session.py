@@ -0,0 +1,41 @@
+"""
+Round-trips of the authenticated endpoints, read from the Server-Timing header
+"""
+
+import re
+import requests
+from typing import Dict
+
+
+def query_count(response: requests.Response) -> int:
+    match = re.search(r'desc="(\d+) queries"', response.headers.get("Server-Timing", ""))
+    assert match, "Response should report its query count"
+    return int(match.group(1))
+
+
+class TestRequestQueries:
+    """With the API key cached, handlers go straight to their own statements"""
+
+    def test_thread_read_queries(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that /threads/me runs only the version and page queries"""
+        requests.get(f"{base_url}/users/me", headers=bob_headers)
+
+        response = requests.get(f"{base_url}/threads/me", headers=bob_headers)
+        assert response.status_code == 200
+        assert query_count(response) == 2, "Thread version + one page of messages"
+
+    def test_not_modified_runs_one_query(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that a 304 costs a single query"""
+        etag = requests.get(f"{base_url}/threads/me", headers=bob_headers).headers["ETag"]
+
+        response = requests.get(f"{base_url}/threads/me", headers={**bob_headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert query_count(response) == 1
+
+    def test_post_message_runs_one_statement(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that the request itself runs a single INSERT (the reply is stored by the responder pool)"""
+        requests.get(f"{base_url}/users/me", headers=bob_headers)
+
+        response = requests.post(f"{base_url}/messages", json={"content": "Round-trip probe"}, headers=bob_headers)
+        assert response.status_code == 200
+        assert query_count(response) == 1
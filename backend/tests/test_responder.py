@@ -0,0 +1,133 @@
+"""
+Unit tests for the bounded reply-generation pool
+"""
+
+import asyncio
+
+import pytest
+
+from responder import FALLBACK_REPLY, ResponderBusy, ResponderPool, ResponderStopped
+
+
+class ScriptedResponder:
+    """Yields fixed tokens, optionally waiting on an event or failing midway"""
+
+    def __init__(self, tokens, gate=None, fail=False):
+        self.tokens = tokens
+        self.gate = gate
+        self.fail = fail
+
+    async def generate(self, prompt):
+        for token in self.tokens:
+            if self.gate is not None:
+                await self.gate.wait()
+            yield token
+        if self.fail:
+            raise RuntimeError("model crashed")
+
+
+def test_tokens_stream_and_reply_is_stored():
+    """Test that tokens reach the caller and the joined reply is passed to on_complete"""
+    async def scenario():
+        pool = ResponderPool(ScriptedResponder(["Hello", " there"]), workers=1, queue_size=0, timeout=5)
+        await pool.start()
+        stored = []
+
+        async def store(reply):
+            stored.append(reply)
+            return {"content": reply}
+
+        pool.reserve()
+        job = pool.submit("hi", on_complete=store)
+        tokens = [token async for token in job.tokens()]
+        result = await job.result
+        await pool.stop()
+        return tokens, stored, result
+
+    tokens, stored, result = asyncio.run(scenario())
+    assert tokens == ["Hello", " there"]
+    assert stored == ["Hello there"]
+    assert result == {"content": "Hello there"}
+
+
+def test_saturated_pool_rejects():
+    """Test that reserve fails once workers and backlog are all taken, and recovers after"""
+    async def scenario():
+        gate = asyncio.Event()
+        pool = ResponderPool(ScriptedResponder(["x"], gate=gate), workers=1, queue_size=1, timeout=5)
+        await pool.start()
+
+        async def store(reply):
+            return reply
+
+        jobs = []
+        for _ in range(2):
+            pool.reserve()
+            jobs.append(pool.submit("hi", on_complete=store))
+        with pytest.raises(ResponderBusy):
+            pool.reserve()
+
+        gate.set()
+        await asyncio.gather(*(job.result for job in jobs))
+        pool.reserve()
+        pool.release()
+        await pool.stop()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 2
+    assert stats["pending"] == 0
+
+
+def test_failed_generation_stores_fallback():
+    """Test that a crashing responder still produces a stored reply"""
+    async def scenario():
+        pool = ResponderPool(ScriptedResponder(["partial"], fail=True), workers=1, queue_size=0, timeout=5)
+        await pool.start()
+
+        async def store(reply):
+            return reply
+
+        pool.reserve()
+        job = pool.submit("hi", on_complete=store)
+        result = await job.result
+        await pool.stop()
+        return result, pool.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == FALLBACK_REPLY
+    assert stats["failed"] == 1
+
+
+def test_stopping_pool_fails_unfinished_jobs():
+    """Test that jobs running or queued when the pool stops end instead of hanging their callers"""
+    async def scenario():
+        gate = asyncio.Event()
+        pool = ResponderPool(ScriptedResponder(["never"], gate=gate), workers=1, queue_size=1, timeout=5)
+        await pool.start()
+
+        async def store(reply):
+            return reply
+
+        jobs = []
+        for _ in range(2):
+            pool.reserve()
+            jobs.append(pool.submit("hi", on_complete=store))
+        await asyncio.sleep(0)
+        await pool.stop(timeout=0.05)
+
+        outcomes = await asyncio.wait_for(
+            asyncio.gather(*(job.result for job in jobs), return_exceptions=True), 1
+        )
+
+        async def read_tokens(job):
+            return [token async for token in job.tokens()]
+
+        tokens = await asyncio.wait_for(asyncio.gather(*(read_tokens(job) for job in jobs)), 1)
+        return outcomes, tokens, pool.stats()
+
+    outcomes, tokens, stats = asyncio.run(scenario())
+    assert all(isinstance(outcome, ResponderStopped) for outcome in outcomes)
+    assert tokens == [[], []]
+    assert stats["pending"] == 0
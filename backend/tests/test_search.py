@@ -0,0 +1,82 @@
+"""
+Tests for full-text message search
+"""
+
+import uuid
+
+import requests
+from typing import Dict
+
+
+def unique_word() -> str:
+    # Letters only, so the text search parser keeps it as one word
+    return "zq" + "".join(chr(ord("a") + int(c, 16) % 26) for c in uuid.uuid4().hex[:10])
+
+
+class TestMessageSearch:
+    """/messages/search ranking, highlighting, scoping and paging"""
+
+    def test_finds_and_highlights_own_messages(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that a searched word is found in the caller's thread and highlighted"""
+        word = unique_word()
+        requests.post(f"{base_url}/messages", json={"content": f"Where is my {word} parcel?"}, headers=alice_headers)
+
+        response = requests.get(f"{base_url}/messages/search", params={"q": word}, headers=alice_headers)
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert len(results) == 1
+        assert results[0]["content"] == f"Where is my {word} parcel?"
+        assert f"<mark>{word}</mark>" in results[0]["highlight"]
+        assert results[0]["rank"] > 0
+
+    def test_highlight_escapes_content(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that markup in a message comes back escaped in the highlight, with only <mark> as HTML"""
+        word = unique_word()
+        content = f"<img src=x onerror=alert(1)> {word} & \"friends\""
+        requests.post(f"{base_url}/messages/batch", json={"messages": [{"content": content}]}, headers=alice_headers)
+
+        hit = requests.get(f"{base_url}/messages/search", params={"q": word}, headers=alice_headers).json()["results"][0]
+        assert hit["content"] == content
+        assert f"&gt; <mark>{word}</mark> &amp; &quot;friends" in hit["highlight"]
+        text = hit["highlight"].replace("<mark>", "").replace("</mark>", "")
+        assert not set("<>\"") & set(text), "Nothing but the <mark> tags should be markup"
+
+    def test_search_is_scoped_to_caller(self, base_url: str, alice_headers: Dict[str, str], bob_headers: Dict[str, str]):
+        """Test that other users' messages never match"""
+        word = unique_word()
+        requests.post(f"{base_url}/messages", json={"content": f"Secret {word}"}, headers=alice_headers)
+
+        response = requests.get(f"{base_url}/messages/search", params={"q": word}, headers=bob_headers)
+        assert response.status_code == 200
+        assert response.json()["results"] == []
+
+    def test_keyset_pages(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that following next_cursor visits every match once, best rank first"""
+        word = unique_word()
+        contents = [f"{word}", f"{word} {word} again", f"{word} once more, then other words entirely"]
+        requests.post(
+            f"{base_url}/messages/batch",
+            json={"messages": [{"content": content} for content in contents]},
+            headers=alice_headers,
+        )
+
+        seen = []
+        params = {"q": word, "limit": 2}
+        while True:
+            page = requests.get(f"{base_url}/messages/search", params=params, headers=alice_headers).json()
+            seen.extend(page["results"])
+            if page["next_cursor"] is None:
+                break
+            params["after"] = page["next_cursor"]
+
+        assert sorted(hit["content"] for hit in seen) == sorted(contents)
+        ranks = [hit["rank"] for hit in seen]
+        assert ranks == sorted(ranks, reverse=True), "Results should be ordered by rank"
+
+    def test_invalid_requests(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that a missing query or malformed cursor is rejected"""
+        assert requests.get(f"{base_url}/messages/search", headers=alice_headers).status_code == 422
+        response = requests.get(
+            f"{base_url}/messages/search", params={"q": "hello", "after": "nope"}, headers=alice_headers
+        )
+        assert response.status_code == 400
@@ -0,0 +1,26 @@
+"""
+Unit tests for the fast message serialization path
+"""
+
+import json
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from main import MessageRead
+from serialization import FastJSONResponse, message_rows_to_dicts
+
+
+def test_fast_path_matches_pydantic_output():
+    """Test that row tuples encode to the same JSON as MessageRead models"""
+    rows = [
+        (1, "Hello é  \"quoted\"", True, datetime(2024, 1, 1, 12, 0, 0)),
+        (2, "Reply", False, datetime(2024, 1, 1, 12, 0, 1, 500)),
+    ]
+    expected = [
+        jsonable_encoder(MessageRead(id=id_, content=content, is_from_user=is_from_user, created_at=created_at))
+        for id_, content, is_from_user, created_at in rows
+    ]
+
+    body = FastJSONResponse({"messages": message_rows_to_dicts(rows)}).body
+    assert json.loads(body)["messages"] == expected
@@ -0,0 +1,72 @@
+"""
+Real-time message streaming tests for /messages/stream
+"""
+
+import json
+import requests
+from typing import Dict, Iterator, List
+
+
+def read_events(response: requests.Response) -> Iterator[Dict[str, str]]:
+    """Parse a Server-Sent Events response into dicts of fields"""
+    event: Dict[str, str] = {}
+    for line in response.iter_lines(decode_unicode=True):
+        if line == "":
+            if event:
+                yield event
+            event = {}
+        elif not line.startswith(":"):
+            field, _, value = line.partition(": ")
+            event[field] = value
+
+
+def collect_messages(response: requests.Response, count: int) -> List[Dict]:
+    messages = []
+    for event in read_events(response):
+        if event.get("event") == "message":
+            messages.append({"id": int(event["id"]), **json.loads(event["data"])})
+            if len(messages) == count:
+                break
+    return messages
+
+
+class TestMessageStream:
+    """Server-Sent Events delivery of new messages"""
+
+    def test_stream_requires_api_key(self, base_url: str):
+        """Test that an unauthenticated stream is rejected"""
+        response = requests.get(f"{base_url}/messages/stream", timeout=5)
+        assert response.status_code == 401, "Should reject missing API key"
+
+    def test_new_messages_are_streamed(self, base_url: str, api_keys: Dict[str, str], charlie_headers: Dict[str, str]):
+        """Test that a posted message and its bot reply arrive on the stream"""
+        with requests.get(
+            f"{base_url}/messages/stream",
+            params={"api_key": api_keys["charlie"]},
+            stream=True,
+            timeout=10,
+        ) as stream:
+            assert stream.status_code == 200, "Should open the stream"
+            assert stream.headers["content-type"].startswith("text/event-stream")
+
+            sent = requests.post(f"{base_url}/messages", json={"content": "Streamed hello"}, headers=charlie_headers).json()
+            messages = collect_messages(stream, 2)
+
+        assert [msg["id"] for msg in messages] == [sent["user_message"]["id"], sent["bot_message"]["id"]]
+        assert messages[0]["content"] == "Streamed hello"
+        assert messages[1]["is_from_user"] is False
+
+    def test_resume_replays_missed_messages(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that Last-Event-ID replays messages committed while disconnected"""
+        first = requests.post(f"{base_url}/messages", json={"content": "Before disconnect"}, headers=charlie_headers).json()
+        missed = requests.post(f"{base_url}/messages", json={"content": "While away"}, headers=charlie_headers).json()
+
+        with requests.get(
+            f"{base_url}/messages/stream",
+            headers={**charlie_headers, "Last-Event-ID": str(first["bot_message"]["id"])},
+            stream=True,
+            timeout=10,
+        ) as stream:
+            messages = collect_messages(stream, 2)
+
+        assert [msg["id"] for msg in messages] == [missed["user_message"]["id"], missed["bot_message"]["id"]]
@@ -0,0 +1,86 @@
+"""
+Conditional and incremental fetching of /threads/me
+"""
+
+import asyncio
+import re
+from typing import Dict, List
+
+import requests
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_engine import create_engine_from_settings
+from queries import get_thread_version
+
+
+class TestThreadSync:
+    """ETag/If-None-Match and since_id deltas"""
+
+    def test_unchanged_thread_returns_304(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that repeating a request with the returned ETag is answered with 304"""
+        first = requests.get(f"{base_url}/threads/me", headers=charlie_headers)
+        etag = first.headers.get("ETag")
+        assert etag, "Response should carry an ETag"
+
+        second = requests.get(f"{base_url}/threads/me", headers={**charlie_headers, "If-None-Match": etag})
+        assert second.status_code == 304, "Unchanged thread should not be re-sent"
+        assert second.headers.get("ETag") == etag
+        assert not second.content
+
+    def test_new_message_changes_etag(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that posting a message invalidates the previous ETag"""
+        etag = requests.get(f"{base_url}/threads/me", headers=charlie_headers).headers["ETag"]
+        requests.post(f"{base_url}/messages", json={"content": "Version bump"}, headers=charlie_headers)
+
+        response = requests.get(f"{base_url}/threads/me", headers={**charlie_headers, "If-None-Match": etag})
+        assert response.status_code == 200, "Changed thread should be sent again"
+        assert response.headers["ETag"] != etag
+
+    def test_since_id_returns_only_newer_messages(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that since_id returns just the messages after it, oldest first"""
+        thread = requests.get(f"{base_url}/threads/me", headers=charlie_headers).json()
+        last_id = thread["messages"][-1]["id"]
+
+        sent = requests.post(f"{base_url}/messages", json={"content": "Delta probe"}, headers=charlie_headers).json()
+
+        delta = requests.get(f"{base_url}/threads/me", params={"since_id": last_id}, headers=charlie_headers).json()
+        assert [msg["id"] for msg in delta["messages"]] == [
+            sent["user_message"]["id"], sent["bot_message"]["id"]
+        ], "Delta should hold exactly the new exchange"
+        assert delta["next_cursor"] is None
+
+    def test_since_id_and_before_are_exclusive(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that since_id cannot be combined with a before cursor"""
+        response = requests.get(
+            f"{base_url}/threads/me", params={"since_id": 1, "before": "x"}, headers=charlie_headers
+        )
+        assert response.status_code == 400
+
+    def test_since_id_out_of_range(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that a since_id beyond the id column's range is a validation error"""
+        response = requests.get(
+            f"{base_url}/threads/me", params={"since_id": 1099511627776}, headers=charlie_headers
+        )
+        assert response.status_code == 422
+
+    def test_version_is_read_without_touching_messages(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that the ETag version comes from the thread row alone, whatever the thread's size"""
+        thread_id = requests.get(f"{base_url}/threads/me", params={"limit": 1}, headers=charlie_headers).json()["id"]
+        statements: List[str] = []
+
+        async def run():
+            engine = create_engine_from_settings()
+            event.listen(
+                engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+            )
+            try:
+                async with AsyncSession(engine) as session:
+                    return await get_thread_version(session, thread_id)
+            finally:
+                await engine.dispose()
+
+        version = asyncio.run(run())
+        assert version is not None
+        assert statements
+        assert not any(re.search(r"\bmessage\b", statement) for statement in statements), statements
@@ -0,0 +1,110 @@
+"""
+Tests for multiple threads per user and their summaries
+"""
+
+import requests
+from typing import Dict
+
+
+class TestThreads:
+    """/threads listing, creation and per-thread history"""
+
+    def test_default_thread_is_listed(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that the thread behind /threads/me appears in the list as the default"""
+        me = requests.get(f"{base_url}/threads/me", headers=alice_headers).json()
+        threads = requests.get(f"{base_url}/threads", params={"limit": 100}, headers=alice_headers).json()["threads"]
+
+        defaults = [thread for thread in threads if thread["is_default"]]
+        assert [thread["id"] for thread in defaults] == [me["id"]]
+
+    def test_message_updates_summary_and_order(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that posting to a new thread fills its summary and moves it to the top"""
+        created = requests.post(f"{base_url}/threads", json={"title": " Trip plans "}, headers=alice_headers)
+        assert created.status_code == 201
+        thread = created.json()
+        assert thread["title"] == "Trip plans"
+        assert not thread["is_default"]
+        assert thread["message_count"] == 0
+        assert thread["last_message_preview"] is None
+
+        sent = requests.post(
+            f"{base_url}/messages", json={"content": "Where to next?", "thread_id": thread["id"]}, headers=alice_headers
+        )
+        assert sent.status_code == 200
+
+        top = requests.get(f"{base_url}/threads", params={"limit": 1}, headers=alice_headers).json()
+        assert top["next_cursor"] is not None
+        summary = top["threads"][0]
+        assert summary["id"] == thread["id"]
+        # The user's message and the bot reply
+        assert summary["message_count"] == 2
+        assert summary["last_message_preview"] == sent.json()["bot_message"]["content"][:200]
+
+        history = requests.get(f"{base_url}/threads/{thread['id']}", headers=alice_headers).json()
+        assert [msg["content"] for msg in history["messages"]][:1] == ["Where to next?"]
+
+    def test_pages_cover_all_threads(self, base_url: str, bob_headers: Dict[str, str]):
+        """Test that following next_cursor lists every thread once, most recently active first"""
+        for _ in range(3):
+            requests.post(f"{base_url}/threads", json={}, headers=bob_headers)
+
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"before": cursor} if cursor else {})}
+            page = requests.get(f"{base_url}/threads", params=params, headers=bob_headers).json()
+            seen.extend(page["threads"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        keys = [(thread["last_message_at"], thread["id"]) for thread in seen]
+        assert len(set(keys)) == len(keys)
+        assert keys == sorted(keys, reverse=True)
+
+    def test_other_users_thread_is_not_found(
+        self, base_url: str, alice_headers: Dict[str, str], bob_headers: Dict[str, str]
+    ):
+        """Test that a thread cannot be read, posted to or streamed by another user"""
+        thread_id = requests.post(f"{base_url}/threads", json={}, headers=alice_headers).json()["id"]
+
+        assert requests.get(f"{base_url}/threads/{thread_id}", headers=bob_headers).status_code == 404
+        posted = requests.post(
+            f"{base_url}/messages", json={"content": "Intruding", "thread_id": thread_id}, headers=bob_headers
+        )
+        assert posted.status_code == 404
+        batch = requests.post(
+            f"{base_url}/messages/batch",
+            json={"messages": [{"content": "Intruding"}], "thread_id": thread_id},
+            headers=bob_headers,
+        )
+        assert batch.status_code == 404
+        streamed = requests.get(
+            f"{base_url}/messages/stream", params={"thread_id": thread_id}, headers=bob_headers, stream=True
+        )
+        assert streamed.status_code == 404
+        streamed.close()
+
+    def test_thread_id_out_of_range(self, base_url: str, alice_headers: Dict[str, str]):
+        """Test that a thread id beyond the id column's range is a validation error"""
+        too_big = 99999999999
+        assert requests.get(f"{base_url}/threads/{too_big}", headers=alice_headers).status_code == 422
+        posted = requests.post(
+            f"{base_url}/messages", json={"content": "Nowhere", "thread_id": too_big}, headers=alice_headers
+        )
+        assert posted.status_code == 422
+
+    def test_thread_etag_changes_with_messages(self, base_url: str, charlie_headers: Dict[str, str]):
+        """Test that a thread's ETag survives reads and changes when messages are added"""
+        thread_id = requests.post(f"{base_url}/threads", json={}, headers=charlie_headers).json()["id"]
+        url = f"{base_url}/threads/{thread_id}"
+        etag = requests.get(url, headers=charlie_headers).headers["ETag"]
+        assert requests.get(url, headers={**charlie_headers, "If-None-Match": etag}).status_code == 304
+
+        requests.post(
+            f"{base_url}/messages/batch",
+            json={"messages": [{"content": "Offline note"}], "thread_id": thread_id},
+            headers=charlie_headers,
+        )
+        changed = requests.get(url, headers={**charlie_headers, "If-None-Match": etag})
+        assert changed.status_code == 200
+        assert [msg["content"] for msg in changed.json()["messages"]] == ["Offline note"]
@@ -0,0 +1,82 @@
+"""
+Tests for the paginated, cached /users listing
+"""
+
+import asyncio
+
+import requests
+from sqlalchemy import text
+
+from bootstrap import initialize_database
+from db_engine import create_engine_from_settings
+from queries import prefix_upper_bound
+
+USER_CHANGED_TRIGGER_COUNT = text(
+    """SELECT count(*) FROM pg_trigger WHERE tgname = 'user_changed' AND tgrelid = '"user"'::regclass"""
+)
+
+
+class TestUserList:
+    """Keyset pages, name-prefix search and the page cache"""
+
+    def test_prefix_upper_bound(self):
+        """Test that the bound sorts after every name with the prefix and before the next prefix"""
+        bound = prefix_upper_bound("ali")
+        assert bound == "alj"
+        assert "ali" < "alice" < "aliz\U0010ffff" < bound <= "alj"
+
+    def test_pages_are_ordered_without_overlap(self, base_url: str):
+        """Test that following X-Next-Cursor continues in name order without repeating users"""
+        seen, cursor = [], None
+        for _ in range(3):
+            params = {"limit": 5, **({"after": cursor} if cursor else {})}
+            response = requests.get(f"{base_url}/users", params=params)
+            assert response.status_code == 200
+            seen.extend(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+
+        keys = [(user["name"].lower(), user["id"]) for user in seen]
+        assert len(set(keys)) == len(keys)
+        assert keys == sorted(keys)
+
+    def test_name_prefix_ignores_case(self, base_url: str):
+        """Test that q keeps only the users whose name starts with it, in any case"""
+        users = requests.get(f"{base_url}/users", params={"q": "ALI"}).json()
+        assert "Alice" in [user["name"] for user in users]
+        assert all(user["name"].lower().startswith("ali") for user in users)
+
+        assert requests.get(f"{base_url}/users", params={"q": "no such user"}).json() == []
+
+    def test_invalid_cursor(self, base_url: str):
+        """Test that a malformed cursor is rejected"""
+        response = requests.get(f"{base_url}/users", params={"after": "not-a-cursor"})
+        assert response.status_code == 400
+
+    def test_repeated_page_is_cached(self, base_url: str):
+        """Test that asking for the same page again is served from the cache"""
+        requests.get(f"{base_url}/users", params={"q": "bo", "limit": 3})
+        hits = requests.get(f"{base_url}/debug/users-cache").json()["hits"]
+
+        requests.get(f"{base_url}/users", params={"q": "bo", "limit": 3})
+        assert requests.get(f"{base_url}/debug/users-cache").json()["hits"] == hits + 1
+
+    def test_startup_installs_change_trigger_on_existing_database(self):
+        """Test that bootstrapping a database whose user table lacks the trigger installs it, once"""
+
+        async def run():
+            engine = create_engine_from_settings()
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(text('DROP TRIGGER IF EXISTS user_changed ON "user"'))
+                counts = []
+                for _ in range(2):
+                    await initialize_database(engine, seed=False)
+                    async with engine.connect() as conn:
+                        counts.append((await conn.execute(USER_CHANGED_TRIGGER_COUNT)).scalar_one())
+                return counts
+            finally:
+                await engine.dispose()
+
+        assert asyncio.run(run()) == [1, 1]
@@ -0,0 +1,51 @@
+"""
+Tests for worker warm-up, readiness and draining
+"""
+
+import asyncio
+import signal
+import time
+
+import requests
+import uvicorn
+
+from serve import DrainingServer
+from warmup import DRAINING, READY, WARMING, Readiness
+
+
+class TestReadiness:
+    def test_draining_is_final(self):
+        """Test that a draining worker never reports ready again"""
+        readiness = Readiness()
+        assert not readiness.is_ready
+        readiness.set(WARMING)
+        readiness.set(READY)
+        assert readiness.is_ready
+
+        readiness.set(DRAINING)
+        readiness.set(READY)
+        assert readiness.to_dict()["status"] == DRAINING
+
+    def test_first_signal_drains(self):
+        """Test that the server keeps running through the drain period, then exits"""
+        server = DrainingServer(uvicorn.Config("main:app"), drain_seconds=0.2)
+        server.handle_exit(signal.SIGTERM, None)
+        assert not asyncio.run(server.on_tick(1))
+
+        time.sleep(0.25)
+        assert asyncio.run(server.on_tick(2))
+
+    def test_second_signal_cuts_drain_short(self):
+        """Test that another signal during the drain stops the server right away"""
+        server = DrainingServer(uvicorn.Config("main:app"), drain_seconds=60)
+        server.handle_exit(signal.SIGTERM, None)
+        server.handle_exit(signal.SIGTERM, None)
+        assert asyncio.run(server.on_tick(1))
+
+    def test_ready_after_warm_up(self, base_url: str):
+        """Test that a serving worker reports ready, with what its warm-up did"""
+        response = requests.get(f"{base_url}/ready")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["status"] == READY
+        assert body["warmup"]["primary"]["connections"] > 0
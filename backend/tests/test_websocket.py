@@ -0,0 +1,140 @@
+"""
+Tests for the /ws/chat WebSocket
+"""
+
+import asyncio
+import json
+
+import pytest
+import requests
+from typing import Dict, List
+from websockets.exceptions import InvalidStatus
+from websockets.sync.client import connect
+
+from chat_socket import CLOSE_GOING_AWAY, CLOSE_TRY_AGAIN_LATER, ChatSocket
+
+WS_URL = "ws://localhost:8000/ws/chat"
+
+
+def receive_until(ws, done, timeout: float = 5.0) -> List[dict]:
+    """Collect frames (skipping pings) until ``done(frames)`` holds"""
+    frames = []
+    while not done(frames):
+        frame = json.loads(ws.recv(timeout=timeout))
+        if frame["type"] != "ping":
+            frames.append(frame)
+    return frames
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = (code, reason)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestChatSocket:
+    """Send buffering and heartbeats, no server needed"""
+
+    def test_full_buffer_closes_connection(self):
+        """Test that a client falling behind the buffer is disconnected instead of buffered"""
+        websocket = FakeWebSocket()
+
+        async def run():
+            socket = ChatSocket(websocket, max_buffered=2, heartbeat=1.0)
+            for i in range(3):
+                socket.send({"type": "token", "id": i})
+            socket.send({"type": "token", "id": "late"})
+            await socket.run_writer()
+
+        asyncio.run(run())
+        assert websocket.sent == []
+        assert websocket.closed_with == (CLOSE_TRY_AGAIN_LATER, "Send buffer full")
+
+    def test_silent_client_times_out(self):
+        """Test that heartbeats ping a live client and close a silent one"""
+        websocket = FakeWebSocket()
+        clock = FakeClock()
+
+        async def run():
+            socket = ChatSocket(websocket, max_buffered=10, heartbeat=0.01, clock=clock)
+            writer = asyncio.ensure_future(socket.run_writer())
+            heartbeat = asyncio.ensure_future(socket.run_heartbeat())
+            await asyncio.sleep(0.015)
+            clock.now = 1.0
+            await asyncio.wait_for(asyncio.gather(writer, heartbeat), 1.0)
+
+        asyncio.run(run())
+        assert websocket.sent and websocket.sent[0] == {"type": "ping"}
+        assert websocket.closed_with == (CLOSE_GOING_AWAY, "Heartbeat timeout")
+
+
+class TestChatWebSocket:
+    def test_pipelined_sends(self, api_keys: Dict[str, str]):
+        """Test that messages sent without waiting are acked in order, each with its reply"""
+        with connect(f"{WS_URL}?api_key={api_keys['charlie']}&tokens=false") as ws:
+            for i in range(5):
+                ws.send(json.dumps({"type": "send", "id": f"m{i}", "content": f"Pipelined {i}"}))
+            frames = receive_until(ws, lambda frames: sum(f["type"] == "reply" for f in frames) == 5)
+
+        acks = [f for f in frames if f["type"] == "ack"]
+        assert [f["id"] for f in acks] == [f"m{i}" for i in range(5)]
+        assert [f["message"]["content"] for f in acks] == [f"Pipelined {i}" for i in range(5)]
+        ack_ids = [f["message"]["id"] for f in acks]
+        assert ack_ids == sorted(ack_ids)
+
+        replies = {f["id"]: f["message"] for f in frames if f["type"] == "reply"}
+        assert set(replies) == {f"m{i}" for i in range(5)}
+        assert all(not reply["is_from_user"] for reply in replies.values())
+        assert not [f for f in frames if f["type"] == "message"], "Own messages are not echoed back"
+
+    def test_tokens_and_ping(self, api_keys: Dict[str, str]):
+        """Test that replies stream as tokens and that pings and bad frames are answered"""
+        with connect(f"{WS_URL}?api_key={api_keys['charlie']}") as ws:
+            ws.send(json.dumps({"type": "ping"}))
+            ws.send("not json")
+            ws.send(json.dumps({"type": "send", "id": 7, "content": "Stream it"}))
+            frames = receive_until(ws, lambda frames: any(f["type"] == "reply" for f in frames))
+
+        assert frames[0] == {"type": "pong"}
+        assert frames[1]["type"] == "error" and frames[1]["status"] == 400
+        tokens = [f["text"] for f in frames if f["type"] == "token"]
+        assert "".join(tokens) == frames[-1]["message"]["content"]
+        assert frames[-1]["id"] == 7
+
+    def test_messages_from_other_devices(self, base_url: str, api_keys: Dict[str, str]):
+        """Test that messages stored elsewhere are pushed down the socket"""
+        with connect(f"{WS_URL}?api_key={api_keys['charlie']}") as ws:
+            ws.send(json.dumps({"type": "ping"}))
+            receive_until(ws, lambda frames: frames)  # subscribed by now
+
+            sent = requests.post(
+                f"{base_url}/messages", json={"content": "From my phone"}, headers={"X-API-Key": api_keys["charlie"]}
+            ).json()
+            frames = receive_until(ws, lambda frames: len(frames) == 2)
+
+        assert [f["type"] for f in frames] == ["message", "message"]
+        assert [f["message"]["id"] for f in frames] == [sent["user_message"]["id"], sent["bot_message"]["id"]]
+
+    def test_handshake_rejections(self, api_keys: Dict[str, str], bob_headers: Dict[str, str], base_url: str):
+        """Test that bad keys and other users' threads are refused at the handshake"""
+        with pytest.raises(InvalidStatus) as refused:
+            connect(f"{WS_URL}?api_key=invalid_key")
+        assert refused.value.response.status_code == 403
+
+        bobs_thread = requests.get(f"{base_url}/threads/me", headers=bob_headers).json()["id"]
+        with pytest.raises(InvalidStatus):
+            connect(f"{WS_URL}?api_key={api_keys['alice']}&thread_id={bobs_thread}")
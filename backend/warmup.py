@@ -0,0 +1,85 @@
+"""
+Worker warm-up and readiness.
+
+A fresh worker has an empty connection pool, and every connection starts
+with an empty prepared-statement cache, so the first requests after a
+deploy pay for connecting, for SQLAlchemy compiling their statements and
+for Postgres planning them. Before the app serves anything, its startup
+calls ``warm_up_engine``: it opens several pooled connections at once and
+runs the hot statements on each of them, rolling back, so those costs are
+paid before the worker takes traffic.
+
+``readiness`` tracks where the worker is in its life. GET /ready answers
+200 only while it is ``ready``: not while it is starting or warming up, and
+not once it is draining for shutdown (see serve.py), so that a load balancer
+stops sending it requests before it stops accepting them.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Awaitable, Callable, Dict
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+WARMING = "warming"
+READY = "ready"
+DRAINING = "draining"
+
+
+class Readiness:
+    """The worker's lifecycle state, and what its warm-up did"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.state = STARTING
+        self.changed_at = clock()
+        self.warmup: Dict[str, Any] = {}
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == READY
+
+    def set(self, state: str) -> None:
+        # Draining is final: a worker never becomes ready again
+        if self.state != DRAINING:
+            self.state = state
+            self.changed_at = self._clock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.state,
+            "seconds_in_state": round(self._clock() - self.changed_at, 3),
+            "warmup": self.warmup,
+        }
+
+
+# The worker process's state; shared by the app and the server running it
+readiness = Readiness()
+
+
+async def warm_up_engine(
+    engine: AsyncEngine, connections: int, run_queries: Callable[[AsyncSession], Awaitable[None]]
+) -> Dict[str, Any]:
+    """Open up to ``connections`` pooled connections at once and run ``run_queries`` on each.
+
+    The connections are all checked out together, so that each is a
+    separate one the pool keeps afterwards; more than the pool size would
+    only be closed again. Everything ``run_queries`` does is rolled back.
+    """
+    connections = min(connections, engine.pool.size())
+    started = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        opened = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(connections)))
+
+        async def warm(connection) -> None:
+            async with AsyncSession(bind=connection) as session:
+                await run_queries(session)
+                await session.rollback()
+
+        await asyncio.gather(*(warm(connection) for connection in opened))
+    return {"connections": connections, "seconds": round(time.perf_counter() - started, 3)}
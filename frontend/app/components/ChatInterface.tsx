@@ -1,9 +1,60 @@
 "use client";
 
-import { useState, useEffect, useRef } from "react";
+import { useState, useEffect, useLayoutEffect, useRef } from "react";
 import { User, Message, Thread } from "../types";
 import { api, ApiError } from "../utils/api";
 
+// Append messages that are not in the thread yet (the stream and POST responses overlap)
+function appendMessages(thread: Thread, messages: Message[]): Thread {
+  const known = new Set(thread.messages.map((message) => message.id));
+  const fresh = messages.filter((message) => !known.has(message.id));
+  return fresh.length ? { ...thread, messages: [...thread.messages, ...fresh] } : thread;
+}
+
+// Largest delta fetched on load; a thread that grew more than this is reloaded instead
+const SYNC_LIMIT = 200;
+
+// The last loaded thread of each user survives reloads and user switches, so
+// coming back only fetches what changed since
+function threadCacheKey(apiKey: string): string {
+  return `thread:${apiKey}`;
+}
+
+function loadCachedThread(apiKey: string): Thread | null {
+  try {
+    const raw = sessionStorage.getItem(threadCacheKey(apiKey));
+    return raw ? JSON.parse(raw) : null;
+  } catch {
+    return null;
+  }
+}
+
+function saveCachedThread(apiKey: string, thread: Thread) {
+  try {
+    sessionStorage.setItem(threadCacheKey(apiKey), JSON.stringify(thread));
+  } catch {
+    // Storage full or unavailable: the next load is simply a full fetch
+  }
+}
+
+// Bring a cached thread up to date: O(new messages) instead of O(thread)
+async function syncThread(apiKey: string): Promise<Thread> {
+  const cached = loadCachedThread(apiKey);
+  const lastId = cached?.messages[cached.messages.length - 1]?.id;
+  if (!cached || lastId === undefined) {
+    return api.getThread(apiKey);
+  }
+
+  const changes = await api.getThreadChanges(apiKey, lastId, { etag: cached.etag, limit: SYNC_LIMIT });
+  if (changes === null) {
+    return cached;
+  }
+  if (changes.messages.length >= SYNC_LIMIT) {
+    return api.getThread(apiKey);
+  }
+  return { ...appendMessages(cached, changes.messages), etag: changes.etag };
+}
+
 interface ChatInterfaceProps {
   user: User;
   onSwitchUser: () => void;
@@ -15,7 +66,18 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
   const [isLoading, setIsLoading] = useState(false);
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  // Separate from isLoading so the conversation stays on screen while a reply streams in
+  const [isSending, setIsSending] = useState(false);
+  const [streamGeneration, setStreamGeneration] = useState(0);
+  // Bot reply text received so far while it is being generated
+  const [pendingReply, setPendingReply] = useState<string | null>(null);
+  // Idempotency key of the message being sent, kept until it goes through
+  const pendingSend = useRef<{ content: string; key: string } | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const messagesContainerRef = useRef<HTMLDivElement>(null);
+  // Scroll height captured before older messages are prepended
+  const scrollHeightBeforePrependRef = useRef<number | null>(null);
 
   // Fetch thread data when user is selected
   useEffect(() => {
@@ -24,7 +86,7 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
         setIsLoading(true);
         setError(null);
         
-        const threadData = await api.getThread(user.api_key);
+        const threadData = await syncThread(user.api_key);
         setThread(threadData);
         setIsAuthenticated(true);
       } catch (err) {
@@ -43,25 +105,108 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
     fetchThread();
   }, [user]);
 
-  // Auto-scroll to bottom when new messages arrive
+  useEffect(() => {
+    if (thread) saveCachedThread(user.api_key, thread);
+  }, [user, thread]);
+
+  const lastMessageId = thread?.messages[thread.messages.length - 1]?.id;
+  const lastMessageIdRef = useRef<number | undefined>(undefined);
+  lastMessageIdRef.current = lastMessageId;
+
+  // Receive new messages (e.g. sent from another tab or device) as they are stored
+  useEffect(() => {
+    if (!isAuthenticated) return;
+
+    const source = new EventSource(api.messageStreamUrl(user.api_key, lastMessageIdRef.current));
+    source.onmessage = (event) => {
+      const message: Message = JSON.parse(event.data);
+      setThread((current) => (current ? appendMessages(current, [message]) : current));
+    };
+    // The server could not replay everything we missed: reload and reconnect
+    source.addEventListener("reset", async () => {
+      source.close();
+      try {
+        setThread(await api.getThread(user.api_key));
+      } catch (err) {
+        console.error("Error reloading thread:", err);
+      }
+      setStreamGeneration((generation) => generation + 1);
+    });
+
+    return () => source.close();
+  }, [user, isAuthenticated, streamGeneration]);
+
+  // Auto-scroll to bottom when new messages arrive (not when older ones are prepended)
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
+  }, [lastMessageId]);
+
+  // Keep the viewport anchored on the same message after prepending an older page
+  useLayoutEffect(() => {
+    const container = messagesContainerRef.current;
+    const previousHeight = scrollHeightBeforePrependRef.current;
+    if (container && previousHeight !== null) {
+      container.scrollTop += container.scrollHeight - previousHeight;
+      scrollHeightBeforePrependRef.current = null;
+    }
   }, [thread?.messages]);
 
+  const loadOlderMessages = async () => {
+    if (!thread?.next_cursor || isLoadingOlder) return;
+
+    setIsLoadingOlder(true);
+    try {
+      const olderPage = await api.getThread(user.api_key, { before: thread.next_cursor });
+      scrollHeightBeforePrependRef.current = messagesContainerRef.current?.scrollHeight ?? null;
+      setThread((current) =>
+        current
+          ? {
+              ...current,
+              messages: [...olderPage.messages, ...current.messages],
+              next_cursor: olderPage.next_cursor,
+            }
+          : current
+      );
+    } catch (err) {
+      setError("Error loading older messages");
+      console.error("Error loading older messages:", err);
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
+  const handleScroll = (e: React.UIEvent<HTMLDivElement>) => {
+    if (e.currentTarget.scrollTop < 80) {
+      loadOlderMessages();
+    }
+  };
+
   const sendMessage = async () => {
-    if (!newMessage.trim() || isLoading) return;
+    if (!newMessage.trim() || isSending) return;
+
+    // Sending the same text again after a failure reuses its key, so a
+    // message the server did store is not stored twice
+    const send =
+      pendingSend.current?.content === newMessage
+        ? pendingSend.current
+        : { content: newMessage, key: crypto.randomUUID() };
+    pendingSend.current = send;
 
-    setIsLoading(true);
+    setIsSending(true);
     try {
-      const data = await api.sendMessage(newMessage, user.api_key);
+      setPendingReply("");
+      const data = await api.sendMessageStreaming(
+        newMessage,
+        user.api_key,
+        (text) => setPendingReply((reply) => (reply ?? "") + text),
+        send.key
+      );
+      pendingSend.current = null;
       
       // Update thread with new messages
-      if (thread) {
-        setThread({
-          ...thread,
-          messages: [...thread.messages, data.user_message, data.bot_message],
-        });
-      }
+      setThread((current) =>
+        current ? appendMessages(current, [data.user_message, data.bot_message]) : current
+      );
       
       setNewMessage("");
     } catch (err) {
@@ -72,7 +217,8 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
       }
       console.error("Error sending message:", err);
     } finally {
-      setIsLoading(false);
+      setPendingReply(null);
+      setIsSending(false);
     }
   };
 
@@ -127,7 +273,14 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
       </div>
 
       {/* Messages Container */}
-      <div className="flex-1 overflow-y-auto p-6 space-y-4">
+      <div
+        ref={messagesContainerRef}
+        onScroll={handleScroll}
+        className="flex-1 overflow-y-auto p-6 space-y-4"
+      >
+        {isLoadingOlder && (
+          <div className="text-center text-xs text-gray-500">Loading older messages...</div>
+        )}
         {thread.messages.map((message) => (
           <div
             key={message.id}
@@ -149,6 +302,13 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
             </div>
           </div>
         ))}
+        {pendingReply !== null && (
+          <div className="flex justify-start">
+            <div className="max-w-xs lg:max-w-md px-4 py-2 rounded-lg bg-gray-100 border border-gray-300 text-black">
+              <p className="text-sm font-medium">{pendingReply || "..."}</p>
+            </div>
+          </div>
+        )}
         <div ref={messagesEndRef} />
       </div>
 
@@ -163,15 +323,15 @@ export default function ChatInterface({ user, onSwitchUser }: ChatInterfaceProps
               placeholder="Type your message..."
               className="w-full px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent resize-none text-black placeholder-gray-500"
               rows={1}
-              disabled={isLoading}
+              disabled={isSending}
             />
           </div>
           <button
             onClick={sendMessage}
-            disabled={!newMessage.trim() || isLoading}
+            disabled={!newMessage.trim() || isSending}
             className="px-6 py-2 bg-blue-500 text-white rounded-lg hover:bg-blue-600 focus:ring-2 focus:ring-blue-500 focus:ring-offset-2 disabled:opacity-50 disabled:cursor-not-allowed"
           >
-            {isLoading ? "Sending..." : "Send"}
+            {isSending ? "Sending..." : "Send"}
           </button>
         </div>
         {error && (
@@ -9,33 +9,64 @@ interface UserSelectorProps {
   isLoading?: boolean;
 }
 
+const PAGE_SIZE = 20;
+// Wait for typing to pause before searching
+const SEARCH_DELAY_MS = 300;
+
 export default function UserSelector({ onUserSelect, isLoading = false }: UserSelectorProps) {
   const [users, setUsers] = useState<User[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [search, setSearch] = useState("");
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
+  const reportError = (err: unknown) => {
+    if (err instanceof ApiError) {
+      setError(`Failed to fetch users: ${err.message}`);
+    } else {
+      setError("Error connecting to server");
+    }
+    console.error("Error fetching users:", err);
+  };
+
+  // First page of the users matching the search, re-fetched as it changes
   useEffect(() => {
-    const fetchUsers = async () => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
       try {
-        setLoading(true);
         setError(null);
-        
-        const usersData = await api.getUsers();
-        setUsers(usersData);
-      } catch (err) {
-        if (err instanceof ApiError) {
-          setError(`Failed to fetch users: ${err.message}`);
-        } else {
-          setError("Error connecting to server");
+        const page = await api.getUsers({ query: search.trim(), limit: PAGE_SIZE });
+        if (!cancelled) {
+          setUsers(page.users);
+          setNextCursor(page.nextCursor);
         }
-        console.error("Error fetching users:", err);
+      } catch (err) {
+        if (!cancelled) reportError(err);
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
+    }, search ? SEARCH_DELAY_MS : 0);
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
     };
+  }, [search]);
 
-    fetchUsers();
-  }, []);
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const page = await api.getUsers({ query: search.trim(), after: nextCursor, limit: PAGE_SIZE });
+      setUsers((previous) => [...previous, ...page.users]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      reportError(err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   if (loading) {
     return (
@@ -77,9 +108,18 @@ export default function UserSelector({ onUserSelect, isLoading = false }: UserSe
           Please select a user to start chatting:
         </p>
         
+        <input
+          type="search"
+          value={search}
+          onChange={(e) => setSearch(e.target.value)}
+          placeholder="Search by name"
+          maxLength={30}
+          className="w-full mb-4 p-3 border border-gray-300 rounded-lg text-gray-900 focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+        />
+        
         {users.length === 0 ? (
           <div className="text-center text-gray-500">
-            No users available
+            {search ? "No matching users" : "No users available"}
           </div>
         ) : (
           <div className="space-y-3">
@@ -100,6 +140,15 @@ export default function UserSelector({ onUserSelect, isLoading = false }: UserSe
                 </div>
               </button>
             ))}
+            {nextCursor && (
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="w-full p-2 text-sm text-blue-600 hover:text-blue-800 disabled:opacity-50"
+              >
+                {loadingMore ? "Loading..." : "Show more users"}
+              </button>
+            )}
           </div>
         )}
         
@@ -4,6 +4,12 @@ export type User = {
   api_key: string;
 };
 
+export type UserPage = {
+  users: User[];
+  // Cursor for the next page; null on the last page
+  nextCursor: string | null;
+};
+
 export type Message = {
   id: number;
   content: string;
@@ -14,6 +20,10 @@ export type Message = {
 export type Thread = {
   id: number;
   messages: Message[];
+  // Cursor for the next older page; null once the oldest message is loaded
+  next_cursor?: string | null;
+  // Thread version from the ETag response header, for conditional re-fetches
+  etag?: string | null;
 };
 
 export type ApiResponse<T> = {
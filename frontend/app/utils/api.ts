@@ -1,4 +1,4 @@
-import { User, Thread } from "../types";
+import { User, UserPage, Thread, Message } from "../types";
 
 const apiUrl = process.env.API_URL || "http://localhost:8000";
 
@@ -9,21 +9,46 @@ export class ApiError extends Error {
   }
 }
 
+function messageHeaders(apiKey: string, idempotencyKey?: string): Record<string, string> {
+  const headers: Record<string, string> = {
+    "Content-Type": "application/json",
+    "X-API-Key": apiKey,
+  };
+  if (idempotencyKey) headers["Idempotency-Key"] = idempotencyKey;
+  return headers;
+}
+
 export const api = {
-  // Fetch all users
-  async getUsers(): Promise<User[]> {
-    const response = await fetch(`${apiUrl}/users`);
+  // Fetch a page of users by name, optionally only names starting with `query`
+  async getUsers(
+    options: { query?: string; after?: string | null; limit?: number } = {}
+  ): Promise<UserPage> {
+    const params = new URLSearchParams();
+    if (options.query) params.set("q", options.query);
+    if (options.after) params.set("after", options.after);
+    if (options.limit) params.set("limit", String(options.limit));
+    const query = params.toString();
+
+    const response = await fetch(`${apiUrl}/users${query ? `?${query}` : ""}`);
     
     if (!response.ok) {
       throw new ApiError("Failed to fetch users", response.status);
     }
     
-    return response.json();
+    return { users: await response.json(), nextCursor: response.headers.get("X-Next-Cursor") };
   },
 
-  // Get user's thread
-  async getThread(apiKey: string): Promise<Thread> {
-    const response = await fetch(`${apiUrl}/threads/me`, {
+  // Get a page of the user's thread (newest page unless `before` is given)
+  async getThread(
+    apiKey: string,
+    options: { before?: string; limit?: number } = {}
+  ): Promise<Thread> {
+    const params = new URLSearchParams();
+    if (options.before) params.set("before", options.before);
+    if (options.limit) params.set("limit", String(options.limit));
+    const query = params.toString();
+
+    const response = await fetch(`${apiUrl}/threads/me${query ? `?${query}` : ""}`, {
       headers: {
         "X-API-Key": apiKey,
       },
@@ -33,20 +58,46 @@ export const api = {
       throw new ApiError("Failed to fetch thread", response.status);
     }
 
-    return response.json();
+    return { ...(await response.json()), etag: response.headers.get("ETag") };
+  },
+
+  // Messages added to the user's thread after `sinceId`, oldest first (at most
+  // `limit`). Resolves to null when the thread is unchanged since `etag`.
+  async getThreadChanges(
+    apiKey: string,
+    sinceId: number,
+    options: { etag?: string | null; limit?: number } = {}
+  ): Promise<Thread | null> {
+    const params = new URLSearchParams({ since_id: String(sinceId) });
+    if (options.limit) params.set("limit", String(options.limit));
+
+    const headers: Record<string, string> = { "X-API-Key": apiKey };
+    if (options.etag) headers["If-None-Match"] = options.etag;
+
+    const response = await fetch(`${apiUrl}/threads/me?${params.toString()}`, {
+      headers,
+      cache: "no-store",
+    });
+
+    if (response.status === 304) {
+      return null;
+    }
+    if (!response.ok) {
+      throw new ApiError("Failed to fetch thread", response.status);
+    }
+
+    return { ...(await response.json()), etag: response.headers.get("ETag") };
   },
 
-  // Send a message
-  async sendMessage(content: string, apiKey: string): Promise<{
+  // Send a message. Retrying with the same `idempotencyKey` returns the first
+  // attempt's messages instead of storing the message again.
+  async sendMessage(content: string, apiKey: string, idempotencyKey?: string): Promise<{
     user_message: any;
     bot_message: any;
   }> {
     const response = await fetch(`${apiUrl}/messages`, {
       method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        "X-API-Key": apiKey,
-      },
+      headers: messageHeaders(apiKey, idempotencyKey),
       body: JSON.stringify({ content }),
     });
 
@@ -57,6 +108,66 @@ export const api = {
     return response.json();
   },
 
+  // Send a message and stream the bot reply: `onToken` receives the reply
+  // text as it is generated; resolves once the reply has been stored. A
+  // retry with the same `idempotencyKey` gets the stored reply without tokens.
+  async sendMessageStreaming(
+    content: string,
+    apiKey: string,
+    onToken: (text: string) => void,
+    idempotencyKey?: string
+  ): Promise<{ user_message: Message; bot_message: Message }> {
+    const response = await fetch(`${apiUrl}/messages?stream=true`, {
+      method: "POST",
+      headers: messageHeaders(apiKey, idempotencyKey),
+      body: JSON.stringify({ content }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new ApiError("Failed to send message", response.status);
+    }
+
+    // The body is newline-delimited JSON events
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = "";
+    let userMessage: Message | null = null;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+
+      let newline;
+      while ((newline = buffered.indexOf("\n")) >= 0) {
+        const line = buffered.slice(0, newline);
+        buffered = buffered.slice(newline + 1);
+        if (!line.trim()) continue;
+
+        const event = JSON.parse(line);
+        if (event.type === "user_message") {
+          userMessage = event.message;
+        } else if (event.type === "token") {
+          onToken(event.text);
+        } else if (event.type === "bot_message" && userMessage) {
+          return { user_message: userMessage, bot_message: event.message };
+        } else if (event.type === "error") {
+          throw new ApiError(event.detail);
+        }
+      }
+    }
+
+    throw new ApiError("Reply stream ended unexpectedly");
+  },
+
+  // URL of the Server-Sent Events stream of new messages in the user's thread.
+  // EventSource cannot set headers, so the API key travels as a query parameter.
+  messageStreamUrl(apiKey: string, afterId?: number): string {
+    const params = new URLSearchParams({ api_key: apiKey });
+    if (afterId !== undefined) params.set("after_id", String(afterId));
+    return `${apiUrl}/messages/stream?${params.toString()}`;
+  },
+
   // Get user info
   async getUserInfo(apiKey: string): Promise<User> {
     const response = await fetch(`${apiUrl}/users/me`, {